@@ -0,0 +1,275 @@
+import csv
+import json
+import os
+import sqlite3
+import zlib
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+ANALYTICS_DB_FILENAME = "analytics.db"
+ANALYTICS_JSON_FILENAME = "analytics.json"
+JOURNAL_FILENAME = "send_journal.csv"
+JOURNAL_FIELDS = ["ts", "email", "event", "message_id", "thread_id"]
+KINDS = ("sent", "opened", "replied", "bounced")
+# Limiti superiori (secondi) dei bucket per tempo alla prima apertura / alla risposta.
+LATENCY_BUCKETS = (60, 300, 900, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 86400, 2 * 86400, 7 * 86400)
+LATENCY_KINDS = {"opened": "time_to_first_open", "replied": "time_to_reply"}
+TOP_DOMAINS = 50
+INGEST_BATCH_ROWS = 10000
+_TAIL_CHECK_BYTES = 4096
+_NO_TS = -1.0
+_SHEET_FORMATS = ("%d/%m/%Y %H:%M:%S", "%m/%d/%Y %H:%M:%S", "%Y-%m-%d %H:%M:%S")
+
+
+def append_journal(fh, ts: str, email: str, event: str, message_id: str = "", thread_id: str = "") -> None:
+    """Una riga del journal di invio (`send_journal.csv`, solo append)."""
+    csv.writer(fh).writerow([ts, email, event, message_id or "", thread_id or ""])
+    fh.flush()
+
+
+def open_journal(path: str):
+    new = not os.path.exists(path) or os.path.getsize(path) == 0
+    fh = open(path, "a", encoding="utf-8", newline="")
+    if new:
+        csv.writer(fh).writerow(JOURNAL_FIELDS)
+    return fh
+
+
+def parse_ts(value: str) -> Optional[float]:
+    """Timestamp ISO 8601 (o data formattata da Sheets) in secondi epoch UTC; None se illeggibile."""
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        moment = None
+        for fmt in _SHEET_FORMATS:
+            try:
+                moment = datetime.strptime(value, fmt)
+                break
+            except ValueError:
+                continue
+        if moment is None:
+            return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def _tail_crc(path: str, offset: int) -> int:
+    start = max(0, offset - _TAIL_CHECK_BYTES)
+    with open(path, "rb") as f:
+        f.seek(start)
+        return zlib.crc32(f.read(offset - start))
+
+
+def _bucket(seconds: float) -> int:
+    for i, limit in enumerate(LATENCY_BUCKETS):
+        if seconds < limit:
+            return i
+    return len(LATENCY_BUCKETS)
+
+
+class AnalyticsStore:
+    """Rollup incrementali di una campagna in `analytics.db` (SQLite).
+
+    Per ogni destinatario si tiene solo il primo evento di ciascun tipo
+    (invio, apertura, risposta, bounce): i contatori orari, per dominio e gli
+    istogrammi dei tempi vengono incrementati solo quando un evento è nuovo, quindi
+    rileggere una riga già vista non cambia nulla. Per ogni file sorgente si salva
+    l'offset già consumato (con un CRC degli ultimi byte per accorgersi di file
+    riscritti): ogni giro legge solo le righe nuove.
+    """
+
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS recipients ("
+            " email TEXT PRIMARY KEY, domain TEXT NOT NULL,"
+            " sent REAL, opened REAL, replied REAL, bounced REAL);"
+            "CREATE TABLE IF NOT EXISTS hourly (hour TEXT, kind TEXT, n INTEGER NOT NULL, PRIMARY KEY (hour, kind));"
+            "CREATE TABLE IF NOT EXISTS domains (domain TEXT, kind TEXT, n INTEGER NOT NULL, PRIMARY KEY (domain, kind));"
+            "CREATE TABLE IF NOT EXISTS latency (kind TEXT, bucket INTEGER, n INTEGER NOT NULL, PRIMARY KEY (kind, bucket));"
+            "CREATE TABLE IF NOT EXISTS sources (name TEXT PRIMARY KEY, offset INTEGER NOT NULL, tail_crc INTEGER NOT NULL);"
+        )
+
+    def _bump(self, table: str, key_col: str, key: str, kind_col: str, kind, amount: int = 1) -> None:
+        self._conn.execute(
+            f"INSERT INTO {table} ({key_col}, {kind_col}, n) VALUES (?, ?, ?) "
+            f"ON CONFLICT ({key_col}, {kind_col}) DO UPDATE SET n = n + excluded.n",
+            (key, kind, amount),
+        )
+
+    def record(self, email: str, kind: str, ts: Optional[float]) -> bool:
+        """Registra il primo evento `kind` del destinatario; False se era già noto."""
+        email = email.strip().lower()
+        if "@" not in email:
+            return False
+        row = self._conn.execute(
+            "SELECT domain, sent, opened, replied, bounced FROM recipients WHERE email = ?", (email,),
+        ).fetchone()
+        if row is None:
+            domain = email.rsplit("@", 1)[1]
+            self._conn.execute("INSERT INTO recipients (email, domain) VALUES (?, ?)", (email, domain))
+            current = dict.fromkeys(KINDS)
+        else:
+            domain = row[0]
+            current = dict(zip(KINDS, row[1:]))
+        if current[kind] is not None:
+            return False
+        value = _NO_TS if ts is None else ts
+        self._conn.execute(f"UPDATE recipients SET {kind} = ? WHERE email = ?", (value, email))
+        self._bump("domains", "domain", domain, "kind", kind)
+        if ts is not None:
+            hour = datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H")
+            self._bump("hourly", "hour", hour, "kind", kind)
+        # Tempi rispetto all'invio: calcolati da qualunque lato arrivi per ultimo.
+        if kind == "sent" and ts is not None:
+            for other, name in LATENCY_KINDS.items():
+                if current[other] is not None and current[other] != _NO_TS:
+                    self._bump("latency", "kind", name, "bucket", _bucket(current[other] - ts))
+        elif kind in LATENCY_KINDS and ts is not None and current["sent"] not in (None, _NO_TS):
+            self._bump("latency", "kind", LATENCY_KINDS[kind], "bucket", _bucket(ts - current["sent"]))
+        return True
+
+    def ingest_csv(self, name: str, path: str, kind: str, email_field: str, ts_field: str = "ts",
+                   resolve: Optional[Callable[[List[str]], Dict[str, str]]] = None,
+                   row_filter: Optional[Callable[[Dict[str, str]], bool]] = None,
+                   default_ts: Optional[float] = None) -> int:
+        """Legge le righe di `path` successive al checkpoint `name`; ritorna quante righe nuove.
+
+        `resolve` traduce i valori senza `@` (token di tracking) in email, a blocchi.
+        """
+        if not os.path.exists(path):
+            return 0
+        size = os.path.getsize(path)
+        saved = self._conn.execute("SELECT offset, tail_crc FROM sources WHERE name = ?", (name,)).fetchone()
+        offset = 0
+        if saved is not None and saved[0] <= size and _tail_crc(path, saved[0]) == saved[1]:
+            offset = saved[0]
+        consumed = 0
+        with open(path, "rb") as f:
+            header_line = f.readline()
+            if not header_line.endswith(b"\n"):
+                return 0
+            header = next(csv.reader([header_line.decode("utf-8")]))
+            f.seek(max(offset, len(header_line)))
+            batch: List[Tuple[Dict[str, str], int]] = []
+            while True:
+                line = f.readline()
+                # Una riga senza newline è ancora in scrittura: la si legge al prossimo giro.
+                complete = line.endswith(b"\n")
+                if complete:
+                    values = next(csv.reader([line.decode("utf-8")]), [])
+                    batch.append((dict(zip(header, values)), f.tell()))
+                if batch and (not complete or len(batch) >= INGEST_BATCH_ROWS):
+                    consumed += self._apply(name, path, batch, kind, email_field, ts_field, resolve,
+                                            row_filter, default_ts)
+                    batch = []
+                if not complete:
+                    break
+        return consumed
+
+    def _apply(self, name, path, batch, kind, email_field, ts_field, resolve, row_filter, default_ts) -> int:
+        rows = [row for row, _ in batch if row_filter is None or row_filter(row)]
+        tokens = [r.get(email_field, "").strip() for r in rows if "@" not in r.get(email_field, "")]
+        resolved = resolve([t for t in tokens if t]) if resolve and any(tokens) else {}
+        with self._conn:
+            for row in rows:
+                value = row.get(email_field, "").strip()
+                email = value if "@" in value else resolved.get(value, "")
+                if email:
+                    ts = parse_ts(row.get(ts_field, ""))
+                    self.record(email, kind, default_ts if ts is None else ts)
+            end = batch[-1][1]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sources (name, offset, tail_crc) VALUES (?, ?, ?)",
+                (name, end, _tail_crc(path, end)),
+            )
+        return len(batch)
+
+    def ingest_events(self, name: str, events: Iterable[Tuple[str, str, Optional[float]]]) -> int:
+        """Eventi (email, kind, ts) non provenienti da un file a offset: registrati una sola volta per `name`."""
+        if self._conn.execute("SELECT 1 FROM sources WHERE name = ?", (name,)).fetchone():
+            return 0
+        count = 0
+        with self._conn:
+            for email, kind, ts in events:
+                self.record(email, kind, ts)
+                count += 1
+            self._conn.execute("INSERT OR REPLACE INTO sources (name, offset, tail_crc) VALUES (?, 0, 0)", (name,))
+        return count
+
+    def summary(self, campaign: str) -> Dict:
+        totals = dict.fromkeys(KINDS, 0)
+        domains: Dict[str, Dict[str, int]] = {}
+        for domain, kind, n in self._conn.execute("SELECT domain, kind, n FROM domains"):
+            domains.setdefault(domain, dict.fromkeys(KINDS, 0))[kind] = n
+            totals[kind] += n
+
+        def rates(counts: Dict[str, int]) -> Dict[str, Optional[float]]:
+            sent = counts["sent"]
+            return {
+                f"{label}_rate": round(counts[kind] / sent, 4) if sent else None
+                for label, kind in (("open", "opened"), ("reply", "replied"), ("bounce", "bounced"))
+            }
+
+        hourly: Dict[str, Dict[str, int]] = {}
+        daily: Dict[str, Dict[str, int]] = {}
+        for hour, kind, n in self._conn.execute("SELECT hour, kind, n FROM hourly ORDER BY hour"):
+            hourly.setdefault(hour, {})[kind] = n
+            day = daily.setdefault(hour[:10], {})
+            day[kind] = day.get(kind, 0) + n
+
+        latency = {}
+        for name in LATENCY_KINDS.values():
+            counts = dict(self._conn.execute("SELECT bucket, n FROM latency WHERE kind = ?", (name,)).fetchall())
+            total = sum(counts.values())
+            buckets = [
+                {"le_seconds": LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else None, "count": counts.get(i, 0)}
+                for i in range(len(LATENCY_BUCKETS) + 1)
+            ]
+            latency[name] = {
+                "count": total,
+                "buckets": buckets,
+                "p50_le_seconds": _quantile_bound(buckets, total, 0.5),
+                "p90_le_seconds": _quantile_bound(buckets, total, 0.9),
+            }
+
+        top = sorted(domains.items(), key=lambda item: (-item[1]["sent"], item[0]))[:TOP_DOMAINS]
+        return {
+            "campaign": campaign,
+            "updated_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "totals": totals,
+            "rates": rates(totals),
+            "daily": daily,
+            "hourly": hourly,
+            **latency,
+            "domains": [{"domain": d, **counts, **rates(counts)} for d, counts in top],
+            "domains_total": len(domains),
+        }
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def _quantile_bound(buckets: List[Dict], total: int, q: float) -> Optional[int]:
+    """Limite superiore del bucket che contiene il quantile `q` (None = oltre l'ultimo bucket)."""
+    if not total:
+        return None
+    seen = 0
+    for bucket in buckets:
+        seen += bucket["count"]
+        if seen >= q * total:
+            return bucket["le_seconds"]
+    return None
+
+
+def write_analytics_json(path: str, summary: Dict) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
@@ -0,0 +1,165 @@
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+
+# Rinnovo anticipato: il token viene rinfrescato in background quando mancano meno
+# di questi secondi alla scadenza, così nessuna chiamata API paga il refresh.
+REFRESH_MARGIN_SECONDS = int(os.environ.get("TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+RETRY_AFTER_FAILURE_SECONDS = 30
+
+
+def _write_token_atomic(token_path: str, payload: str) -> None:
+    """Scrive il token su file temporaneo (0600) e lo sostituisce con os.replace."""
+    tmp_path = f"{token_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, token_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class SharedCredentials(Credentials):
+    """Credentials condivise tra servizi e thread: refresh serializzato e persistito su disco.
+
+    `refresh` è chiamato sia dal thread di rinnovo sia (come ultima risorsa) da
+    `before_request` delle librerie Google: il lock evita refresh doppi e, se un altro
+    thread ha appena rinnovato il token, la chiamata non fa nulla.
+    """
+
+    token_path: str = ""
+    refresh_margin: float = REFRESH_MARGIN_SECONDS
+
+    def _init_shared(self, token_path: str, refresh_margin: float) -> "SharedCredentials":
+        self.token_path = token_path
+        self.refresh_margin = refresh_margin
+        self._refresh_lock = threading.RLock()
+        return self
+
+    def seconds_to_refresh(self) -> float:
+        """Secondi che mancano al momento del rinnovo anticipato (<= 0: da rinnovare ora)."""
+        if not self.token or self.expiry is None:
+            return 0.0 if self.refresh_token else float("inf")
+        remaining = (self.expiry - datetime.utcnow()).total_seconds()
+        return remaining - self.refresh_margin
+
+    def refresh(self, request) -> None:
+        with self._refresh_lock:
+            if self.valid and self.seconds_to_refresh() > 0:
+                return
+            super().refresh(request)
+            _write_token_atomic(self.token_path, self.to_json())
+
+    def persist(self) -> None:
+        with self._refresh_lock:
+            _write_token_atomic(self.token_path, self.to_json())
+
+
+class CredentialsManager:
+    """Una credenziale per account (cartella creds + file token), condivisa nel processo.
+
+    Un thread daemon rinnova i token `refresh_margin` secondi prima della scadenza e
+    scrive il risultato in modo atomico; le chiamate successive a `get` restituiscono
+    sempre lo stesso oggetto, quindi tutti i servizi costruiti vedono il token nuovo.
+    """
+
+    def __init__(self, refresh_margin: float = REFRESH_MARGIN_SECONDS, background: bool = True):
+        self.refresh_margin = refresh_margin
+        self.background = background
+        self._credentials: Dict[Tuple[str, str], SharedCredentials] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_error: Optional[str] = None
+
+    def get(self, creds_dir: str, token_filename: str, scopes: List[str],
+            run_flow: Callable[[InstalledAppFlow], Credentials]) -> SharedCredentials:
+        key = (os.path.abspath(creds_dir), token_filename)
+        with self._lock:
+            creds = self._credentials.get(key)
+            if creds is None:
+                creds = self._load(creds_dir, token_filename, scopes, run_flow)
+                self._credentials[key] = creds
+        if creds.seconds_to_refresh() <= 0 and creds.refresh_token:
+            creds.refresh(Request())
+        self._ensure_thread()
+        return creds
+
+    def _load(self, creds_dir: str, token_filename: str, scopes: List[str],
+              run_flow: Callable[[InstalledAppFlow], Credentials]) -> SharedCredentials:
+        token_path = os.path.join(creds_dir, token_filename)
+        if os.path.exists(token_path):
+            with open(token_path, "r", encoding="utf-8") as f:
+                info = json.load(f)
+            creds = SharedCredentials.from_authorized_user_info(info, scopes)
+            if creds.valid or creds.refresh_token:
+                return creds._init_shared(token_path, self.refresh_margin)
+        flow = InstalledAppFlow.from_client_secrets_file(os.path.join(creds_dir, "credentials.json"), scopes)
+        obtained = run_flow(flow)
+        creds = SharedCredentials.from_authorized_user_info(json.loads(obtained.to_json()), scopes)
+        creds._init_shared(token_path, self.refresh_margin)
+        creds.persist()
+        return creds
+
+    def _ensure_thread(self) -> None:
+        if not self.background:
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._run, name="token-refresh", daemon=True)
+                self._thread.start()
+            else:
+                self._wakeup.set()
+
+    def refresh_due(self) -> float:
+        """Rinnova le credenziali in scadenza; ritorna i secondi fino al prossimo rinnovo."""
+        with self._lock:
+            credentials = list(self._credentials.values())
+        next_due = float("inf")
+        for creds in credentials:
+            wait = creds.seconds_to_refresh()
+            if wait <= 0 and creds.refresh_token:
+                try:
+                    creds.refresh(Request())
+                    self.last_error = None
+                    wait = creds.seconds_to_refresh()
+                except Exception as exc:
+                    # Nessun crash del thread: si riprova tra poco, e in ultima istanza
+                    # il refresh avviene comunque nella richiesta (before_request).
+                    self.last_error = str(exc)
+                    wait = RETRY_AFTER_FAILURE_SECONDS
+            next_due = min(next_due, max(wait, 1.0))
+        return next_due
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            wait = self.refresh_due()
+            self._wakeup.wait(timeout=None if wait == float("inf") else wait)
+            self._wakeup.clear()
+
+    def shutdown(self) -> None:
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+_MANAGER = CredentialsManager()
+
+
+def get_credentials(creds_dir: str, token_filename: str, scopes: List[str],
+                    run_flow: Callable[[InstalledAppFlow], Credentials]) -> SharedCredentials:
+    return _MANAGER.get(creds_dir, token_filename, scopes, run_flow)
@@ -0,0 +1,131 @@
+import csv
+import email
+import os
+import re
+from email import policy
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+BOUNCES_FIELDS = [
+    "bounced_email", "kind", "status", "action", "diagnostic", "message_id", "thread_id", "bounce_message_id", "ts",
+]
+HARD = "hard"
+SOFT = "soft"
+# Oltre questa dimensione (sizeEstimate) il bounce contiene probabilmente il messaggio
+# originale con allegati: ci si ferma ai metadati invece di scaricare il raw.
+RAW_FETCH_MAX_BYTES = 512 * 1024
+METADATA_HEADERS = ["X-Failed-Recipients", "Content-Type", "Subject"]
+# Errori permanenti che non dipendono dall'indirizzo (casella piena, policy, rete): soft.
+SOFT_PERMANENT_PREFIXES = ("5.2.2", "5.2.3", "5.3.4", "5.4.", "5.7.")
+_STATUS_RE = re.compile(r"\b([245]\.\d{1,3}\.\d{1,3})\b")
+
+
+class Bounce(NamedTuple):
+    recipient: str
+    kind: str
+    status: str
+    action: str
+    diagnostic: str
+
+
+def classify(status: str, action: str = "") -> str:
+    """hard = indirizzo da sopprimere; soft = errore temporaneo o non legato al destinatario."""
+    status = (status or "").strip()
+    action = (action or "").strip().lower()
+    if status.startswith("5."):
+        return SOFT if status.startswith(SOFT_PERMANENT_PREFIXES) else HARD
+    if status.startswith("4.") or action in ("delayed", "relayed", "delivered", "expanded"):
+        return SOFT
+    return HARD if action == "failed" or not status else SOFT
+
+
+def _field_value(value: Optional[str]) -> str:
+    """`rfc822; user@x.com` -> `user@x.com`, con righe ripiegate riunite."""
+    value = " ".join(str(value or "").split())
+    return value.split(";", 1)[1].strip() if ";" in value else value
+
+
+def parse_dsn(raw: bytes) -> List[Bounce]:
+    """Estrae i destinatari falliti dalla parte `message/delivery-status` (RFC 3464).
+
+    Il messaggio è analizzato col pacchetto `email`, ma si leggono solo i blocchi
+    per-destinatario del delivery-status: i corpi testuali non vengono decodificati.
+    Senza DSN strutturato si ripiega su `X-Failed-Recipients` e sul primo codice
+    di stato trovato nel testo.
+    """
+    msg = email.message_from_bytes(raw, policy=policy.compat32)
+    bounces: List[Bounce] = []
+    for part in msg.walk():
+        if part.get_content_type() != "message/delivery-status":
+            continue
+        blocks = part.get_payload()
+        if not isinstance(blocks, list):
+            continue
+        # Il primo blocco contiene i campi per-messaggio (Reporting-MTA, ...).
+        for block in blocks[1:]:
+            recipient = _field_value(block.get("Final-Recipient") or block.get("Original-Recipient"))
+            if "@" not in recipient:
+                continue
+            status = _field_value(block.get("Status"))
+            action = _field_value(block.get("Action")).lower()
+            diagnostic = _field_value(block.get("Diagnostic-Code"))
+            bounces.append(Bounce(recipient, classify(status, action), status, action, diagnostic))
+    if bounces:
+        return bounces
+    failed = _field_value(msg.get("X-Failed-Recipients"))
+    if not failed:
+        return []
+    status = ""
+    for part in msg.walk():
+        if part.get_content_maintype() == "text":
+            found = _STATUS_RE.search(part.get_payload(decode=True).decode("utf-8", errors="ignore"))
+            if found:
+                status = found.group(1)
+                break
+    return [
+        Bounce(addr.strip(), classify(status, "failed"), status, "failed", "")
+        for addr in failed.split(",") if "@" in addr
+    ]
+
+
+def bounces_from_headers(headers: Iterable[Dict[str, str]]) -> List[Bounce]:
+    """Bounce dai soli metadati (`format="metadata"`): X-Failed-Recipients, senza codice di stato."""
+    for header in headers:
+        if header.get("name", "").lower() == "x-failed-recipients":
+            return [
+                Bounce(addr.strip(), HARD, "", "failed", "")
+                for addr in header.get("value", "").split(",") if "@" in addr
+            ]
+    return []
+
+
+def build_thread_index(state: Dict[str, Dict[str, Any]], sent_threads: Iterable[Dict[str, str]] = ()) -> Dict[str, tuple]:
+    """thread_id -> (email, message_id) dai messaggi inviati: Gmail mette il DSN nel thread originale."""
+    index: Dict[str, tuple] = {}
+    for row in sent_threads:
+        if row.get("threadId"):
+            index[row["threadId"]] = (row.get("email", ""), "")
+    for key, entry in state.items():
+        if entry.get("thread_id"):
+            index[entry["thread_id"]] = (key, entry.get("message_id") or "")
+    return index
+
+
+def read_bounces(path: str) -> List[Dict[str, str]]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        return [row for row in csv.DictReader(f) if (row.get("bounced_email") or "").strip()]
+
+
+def write_bounces(path: str, rows: List[Dict[str, str]]) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=BOUNCES_FIELDS, extrasaction="ignore")
+        w.writeheader()
+        w.writerows({name: row.get(name) or "" for name in BOUNCES_FIELDS} for row in rows)
+    os.replace(tmp_path, path)
+
+
+def is_hard(row: Dict[str, str]) -> bool:
+    """Le righe senza `kind` (bounces.csv precedenti) restano hard, come prima."""
+    return (row.get("kind") or HARD).strip().lower() != SOFT
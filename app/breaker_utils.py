@@ -0,0 +1,95 @@
+from typing import Any, Callable, Optional
+
+from clock_utils import SYSTEM_CLOCK
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Circuit breaker attorno al trasporto di invio (closed → open → half-open).
+
+    - closed: le richieste passano; dopo `failure_threshold` errori ritentabili
+      consecutivi il circuito si apre.
+    - open: nessuna richiesta; `wait_ready` attende la fine della finestra, che
+      cresce di `multiplier` a ogni riapertura fino a `max_open_seconds`.
+    - half-open: passa una sola richiesta di prova; se il servizio risponde il
+      circuito si richiude (e la finestra torna a `open_seconds`), altrimenti si riapre.
+
+    Tutte le attese passano da `clock`, quindi funziona anche con l'orologio
+    virtuale di `send --simulate`. `listener(state, **fields)` riceve ogni transizione.
+    """
+
+    def __init__(self, failure_threshold: int = 5, open_seconds: float = 120.0, multiplier: float = 2.0,
+                 max_open_seconds: float = 3600.0, clock=SYSTEM_CLOCK,
+                 listener: Optional[Callable[..., Any]] = None):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = max(open_seconds, 0.0)
+        self.multiplier = max(multiplier, 1.0)
+        self.max_open_seconds = max(max_open_seconds, self.open_seconds)
+        self.clock = clock
+        self.listener = listener
+        self.state = CLOSED
+        self.failures = 0
+        self.opens = 0
+        self.open_time = 0.0
+        self._next_open = self.open_seconds
+        self._retry_at = 0.0
+        self._outage_started: Optional[float] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.failure_threshold > 0
+
+    def outage_seconds(self) -> float:
+        """Durata del disservizio in corso, inclusa la finestra di apertura già programmata."""
+        if self._outage_started is None:
+            return 0.0
+        end = self._retry_at if self.state == OPEN else self.clock.monotonic()
+        return end - self._outage_started
+
+    def wait_ready(self) -> None:
+        """Se il circuito è aperto attende la fine della finestra e passa a half-open."""
+        if self.state != OPEN:
+            return
+        remaining = self._retry_at - self.clock.monotonic()
+        if remaining > 0:
+            self.clock.sleep(remaining)
+            self.open_time += remaining
+        self._transition(HALF_OPEN, outage_seconds=round(self.outage_seconds(), 1))
+
+    def record_success(self) -> None:
+        """Il servizio ha risposto (anche con un errore non ritentabile): il circuito si chiude."""
+        self.failures = 0
+        if self.state == CLOSED:
+            return
+        outage = self.outage_seconds()
+        self._next_open = self.open_seconds
+        self._outage_started = None
+        self._transition(CLOSED, outage_seconds=round(outage, 1))
+
+    def record_failure(self) -> bool:
+        """Registra un errore ritentabile; ritorna True se il circuito è (ora) aperto."""
+        if not self.enabled:
+            return False
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self._open()
+            return True
+        return False
+
+    def _open(self) -> None:
+        duration = self._next_open
+        self._next_open = min(duration * self.multiplier, self.max_open_seconds)
+        now = self.clock.monotonic()
+        if self._outage_started is None:
+            self._outage_started = now
+        self._retry_at = now + duration
+        self.opens += 1
+        self._transition(OPEN, open_seconds=round(duration, 1), consecutive_failures=self.failures)
+
+    def _transition(self, state: str, **fields: Any) -> None:
+        self.state = state
+        if self.listener is not None:
+            self.listener(state, **fields)
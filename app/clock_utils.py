@@ -0,0 +1,43 @@
+import time
+from datetime import datetime, timedelta
+
+
+class SystemClock:
+    """Orologio reale: tempo UTC, monotonic e sleep vero."""
+
+    def now(self) -> datetime:
+        return datetime.utcnow()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+
+class VirtualClock:
+    """Orologio simulato: `sleep` fa solo avanzare il tempo, senza attese reali."""
+
+    def __init__(self, start: datetime | None = None):
+        self.start = start or datetime.utcnow()
+        self.elapsed = 0.0
+
+    def now(self) -> datetime:
+        return self.start + timedelta(seconds=self.elapsed)
+
+    def monotonic(self) -> float:
+        return self.elapsed
+
+    def sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            self.elapsed += seconds
+
+    def advance_to(self, moment: datetime) -> None:
+        self.elapsed = max(self.elapsed, (moment - self.start).total_seconds())
+
+
+SYSTEM_CLOCK = SystemClock()
+
+
+def utc_iso(moment: datetime) -> str:
+    return moment.isoformat(timespec="seconds") + "Z"
@@ -0,0 +1,166 @@
+import json
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+EVENTS_DIRNAME = "events"
+PARQUET_DIRNAME = "parquet"
+SEND_EVENTS = frozenset({"send_attempt", "send_success", "send_failed", "send_retry_scheduled"})
+EVENT_FIELDS = ("ts", "event", "campaign", "account", "email", "message_id", "thread_id", "attempt", "error", "detail")
+DICTIONARY_COLUMNS = ("event", "campaign", "account")
+DEFAULT_FLUSH_ROWS = 500
+DEFAULT_FLUSH_SECONDS = 5.0
+EXPORT_BATCH_ROWS = 100_000
+
+
+class EventStore:
+    """Archivio durevole degli eventi di invio e di engagement, in JSONL giornalieri.
+
+    Gli eventi sono accumulati in memoria e accodati a `events-<giorno>.jsonl` a
+    blocchi (ogni `flush_rows` righe o `flush_seconds` secondi, e alla chiusura) con
+    una sola write in append: più processi possono scrivere nella stessa cartella.
+    Le colonne sono fisse (`EVENT_FIELDS`); i campi extra finiscono in `detail`.
+    """
+
+    def __init__(self, root: str, campaign: str = "", account: str = "",
+                 flush_rows: int = DEFAULT_FLUSH_ROWS, flush_seconds: float = DEFAULT_FLUSH_SECONDS):
+        self.root = root
+        self.campaign = campaign
+        self.account = account
+        self.flush_rows = max(1, flush_rows)
+        self.flush_seconds = flush_seconds
+        self.written = 0
+        self._pending: Dict[str, List[str]] = {}
+        self._count = 0
+        self._last_flush = time.monotonic()
+
+    def add(self, event: str, ts: Optional[str] = None, **fields: Any) -> None:
+        ts = ts or datetime.utcnow().isoformat(timespec="milliseconds") + "Z"
+        if "attempt" not in fields and "attempts" in fields:
+            fields["attempt"] = fields.pop("attempts")
+        record = {
+            "ts": ts,
+            "event": event,
+            "campaign": fields.pop("campaign", None) or self.campaign,
+            "account": fields.pop("account", None) or self.account,
+        }
+        for name in EVENT_FIELDS[4:-1]:
+            value = fields.pop(name, None)
+            record[name] = None if value in (None, "") else value
+        record["detail"] = json.dumps(fields, ensure_ascii=False, sort_keys=True) if fields else None
+        self._pending.setdefault(ts[:10], []).append(json.dumps(record, ensure_ascii=False))
+        self._count += 1
+        if self._count >= self.flush_rows or time.monotonic() - self._last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self) -> int:
+        pending, self._pending = self._pending, {}
+        self._count = 0
+        self._last_flush = time.monotonic()
+        if not pending:
+            return 0
+        os.makedirs(self.root, exist_ok=True)
+        written = 0
+        for day, lines in pending.items():
+            with open(os.path.join(self.root, f"events-{day}.jsonl"), "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            written += len(lines)
+        self.written += written
+        return written
+
+    def close(self) -> None:
+        self.flush()
+
+
+def iter_event_files(root: str) -> List[str]:
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        os.path.join(root, name) for name in os.listdir(root)
+        if name.startswith("events-") and name.endswith(".jsonl")
+    )
+
+
+def _read_events(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            # Una riga senza newline è ancora in scrittura da un altro processo.
+            if not line.endswith("\n"):
+                break
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as exc:
+        raise RuntimeError("pyarrow non installato: serve per esportare gli eventi in Parquet") from exc
+
+
+def _event_schema():
+    import pyarrow as pa
+
+    text = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ("ts", pa.timestamp("ms", tz="UTC")),
+        ("event", text),
+        ("campaign", text),
+        ("account", text),
+        ("email", pa.string()),
+        ("message_id", pa.string()),
+        ("thread_id", pa.string()),
+        ("attempt", pa.int32()),
+        ("error", pa.string()),
+        ("detail", pa.string()),
+    ])
+
+
+def _batch_table(rows: List[Dict[str, Any]], schema):
+    import pyarrow as pa
+
+    columns = {}
+    for field in schema:
+        values = [row.get(field.name) for row in rows]
+        if field.name == "ts":
+            values = [datetime.fromisoformat(v) if v else None for v in values]
+            columns[field.name] = pa.array(values, type=field.type)
+        elif pa.types.is_dictionary(field.type):
+            columns[field.name] = pa.array(values, type=pa.string()).dictionary_encode()
+        else:
+            columns[field.name] = pa.array(values, type=field.type)
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+def export_parquet(root: str, out_dir: str, force: bool = False) -> List[str]:
+    """Esporta ogni `events-<giorno>.jsonl` in `events-<giorno>.parquet` dentro `out_dir`.
+
+    `event`, `campaign` e `account` sono colonne dictionary-encoded; i file già
+    esportati e non modificati dopo l'export vengono saltati. Ritorna i file scritti.
+    """
+    _require_pyarrow()
+    import pyarrow.parquet as pq
+
+    schema = _event_schema()
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for path in iter_event_files(root):
+        target = os.path.join(out_dir, os.path.basename(path)[:-len(".jsonl")] + ".parquet")
+        if not force and os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+            continue
+        tmp_path = f"{target}.tmp"
+        with pq.ParquetWriter(tmp_path, schema, compression="zstd", use_dictionary=list(DICTIONARY_COLUMNS)) as writer:
+            batch: List[Dict[str, Any]] = []
+            for row in _read_events(path):
+                batch.append(row)
+                if len(batch) >= EXPORT_BATCH_ROWS:
+                    writer.write_table(_batch_table(batch, schema))
+                    batch = []
+            if batch:
+                writer.write_table(_batch_table(batch, schema))
+        os.replace(tmp_path, target)
+        written.append(target)
+    return written
@@ -1,10 +1,11 @@
 import os
 from typing import Any, Dict, List, Optional
-from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
 
+from auth_utils import get_credentials
+from http_utils import pooled_http
+
 SCOPES = [
     "https://www.googleapis.com/auth/gmail.send",
     "https://www.googleapis.com/auth/gmail.modify",
@@ -13,22 +14,12 @@ SCOPES = [
 
 def get_service(creds_dir: str) -> Any:
     os.makedirs(creds_dir, exist_ok=True)
-    token_path = os.path.join(creds_dir, "token.json")
     creds_path = os.path.join(creds_dir, "credentials.json")
     if not os.path.exists(creds_path):
         raise FileNotFoundError(f"credentials.json non trovato in {creds_dir}")
-    creds = None
-    if os.path.exists(token_path):
-        creds = Credentials.from_authorized_user_file(token_path, SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(creds_path, SCOPES)
-            creds = _run_headless_flow(flow)
-        with open(token_path, "w", encoding="utf-8") as f:
-            f.write(creds.to_json())
-    return build("gmail", "v1", credentials=creds)
+    # Credenziale condivisa per account, rinnovata in background prima della scadenza.
+    creds = get_credentials(creds_dir, "token.json", SCOPES, _run_headless_flow)
+    return build("gmail", "v1", http=pooled_http(creds))
 
 
 def _run_headless_flow(flow: InstalledAppFlow):
@@ -0,0 +1,80 @@
+import os
+import threading
+from typing import Any, Dict, List
+
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.http import build_http
+
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "8"))
+HTTP_TIMEOUT_SECONDS = float(os.environ.get("HTTP_TIMEOUT_SECONDS", "60"))
+
+
+class PooledHttp:
+    """Facciata thread-safe con l'interfaccia di `httplib2.Http` usata da googleapiclient.
+
+    `httplib2.Http` non è thread-safe: ogni `request` prende in prestito un
+    `AuthorizedHttp` dal pool (al massimo `size`, riusati in ordine LIFO così le
+    connessioni keep-alive restano calde) e lo restituisce a fine chiamata. Le
+    credenziali sono condivise, quindi il refresh resta unico per account.
+    """
+
+    def __init__(self, credentials: Any, size: int = HTTP_POOL_SIZE, timeout: float = HTTP_TIMEOUT_SECONDS):
+        self.credentials = credentials
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.created = 0
+        self._idle: List[Any] = []
+        self._cond = threading.Condition()
+
+    def _new_http(self) -> Any:
+        # build_http esclude il 308 dai redirect: serve agli upload resumable.
+        http = build_http()
+        http.timeout = self.timeout
+        return AuthorizedHttp(self.credentials, http=http)
+
+    def _checkout(self) -> Any:
+        with self._cond:
+            while not self._idle and self.created >= self.size:
+                self._cond.wait()
+            if self._idle:
+                return self._idle.pop()
+            self.created += 1
+        try:
+            return self._new_http()
+        except BaseException:
+            with self._cond:
+                self.created -= 1
+                self._cond.notify()
+            raise
+
+    def _checkin(self, http: Any) -> None:
+        with self._cond:
+            self._idle.append(http)
+            self._cond.notify()
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        http = self._checkout()
+        try:
+            return http.request(uri, method=method, body=body, headers=headers, **kwargs)
+        finally:
+            self._checkin(http)
+
+    def close(self) -> None:
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self.created -= len(idle)
+        for http in idle:
+            http.close()
+
+
+_POOLS: Dict[int, PooledHttp] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def pooled_http(credentials: Any) -> PooledHttp:
+    """Pool condiviso per credenziale: servizi diversi dello stesso account riusano le connessioni."""
+    with _POOLS_LOCK:
+        pool = _POOLS.get(id(credentials))
+        if pool is None or pool.credentials is not credentials:
+            pool = _POOLS[id(credentials)] = PooledHttp(credentials)
+        return pool
@@ -0,0 +1,159 @@
+import fcntl
+import json
+import os
+import secrets
+import socket
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, Mapping, Optional, Tuple
+
+from clock_utils import SYSTEM_CLOCK
+
+CLAIMS_FILENAME = "claims.db"
+DEFAULT_LEASE_SECONDS = 900.0
+CLAIMED = "claimed"
+DONE = "done"
+BUSY = "busy"
+_EPOCH = datetime(1970, 1, 1)
+
+
+def new_worker_id() -> str:
+    """Identificativo del processo di invio: host, pid e un suffisso casuale (pid riusati dopo un crash)."""
+    return f"{socket.gethostname()}-{os.getpid()}-{secrets.token_hex(3)}"
+
+
+class LeaseStore:
+    """Claim dei destinatari di una campagna condiviso da più processi o host.
+
+    Prima di costruire e spedire un messaggio il processo prende un lease sulla
+    chiave del destinatario (transazione `BEGIN IMMEDIATE` su `claims.db` nella
+    cartella dei log). Il lease scade dopo `lease_seconds` se non viene rinnovato:
+    i destinatari di un worker caduto tornano disponibili agli altri. Un destinatario
+    inviato resta `done` e non viene più preso da nessuno.
+
+    Accanto al lease c'è l'ultima entry di stato del destinatario non ancora riportata
+    in state.json (`save_entry`): un tentativo costa un UPDATE su una riga, mentre
+    state.json si riscrive solo quando si unisce (`unmerged_entries`/`mark_merged`).
+    L'entry sopravvive al cambio di proprietario, quindi chi riprende un destinatario
+    di un worker caduto ne eredita tentativi e stato.
+    """
+
+    def __init__(self, path: str, owner: Optional[str] = None, lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 clock=SYSTEM_CLOCK):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.owner = owner or new_worker_id()
+        self.lease_seconds = lease_seconds
+        self.clock = clock
+        self.taken_over = 0
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            "key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL, done INTEGER NOT NULL DEFAULT 0, "
+            "entry TEXT)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(leases)")}
+        if "entry" not in columns:
+            # claims.db creato prima delle entry di stato.
+            self._conn.execute("ALTER TABLE leases ADD COLUMN entry TEXT")
+
+    def _now(self) -> float:
+        """Secondi epoch UTC dal `clock` (condiviso tra processi: stesso riferimento di time.time)."""
+        return (self.clock.now() - _EPOCH).total_seconds()
+
+    def claim(self, key: str) -> str:
+        """Prende il destinatario: `claimed`, oppure `done` (già inviato) o `busy` (lease altrui attivo)."""
+        now = self._now()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute("SELECT owner, expires, done FROM leases WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[2]:
+                self._conn.execute("COMMIT")
+                return DONE
+            if row is not None and row[0] != self.owner and row[1] > now:
+                self._conn.execute("COMMIT")
+                return BUSY
+            if row is not None and row[0] != self.owner:
+                self.taken_over += 1
+            self._conn.execute(
+                "INSERT INTO leases (key, owner, expires, done) VALUES (?, ?, ?, 0) "
+                "ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires = excluded.expires, done = 0",
+                (key, self.owner, now + self.lease_seconds),
+            )
+            self._conn.execute("COMMIT")
+            return CLAIMED
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def renew(self, key: str) -> bool:
+        """Estende il lease; False se nel frattempo è scaduto ed è stato preso da un altro processo."""
+        cur = self._conn.execute(
+            "UPDATE leases SET expires = ? WHERE key = ? AND owner = ? AND done = 0",
+            (self._now() + self.lease_seconds, key, self.owner),
+        )
+        return cur.rowcount == 1
+
+    def complete(self, key: str) -> None:
+        self._conn.execute(
+            "UPDATE leases SET done = 1, expires = ? WHERE key = ? AND owner = ?",
+            (self._now(), key, self.owner),
+        )
+
+    def save_entry(self, key: str, entry: Mapping[str, Any]) -> None:
+        """Salva l'entry di stato di un destinatario di questo processo (non ancora in state.json)."""
+        self._conn.execute(
+            "UPDATE leases SET entry = ? WHERE key = ? AND owner = ?",
+            (json.dumps(dict(entry), ensure_ascii=False), key, self.owner),
+        )
+
+    def entry(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute("SELECT entry FROM leases WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row is not None and row[0] else None
+
+    def unmerged_entries(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Entry degli altri processi non ancora riportate in state.json."""
+        rows = self._conn.execute(
+            "SELECT key, entry FROM leases WHERE entry IS NOT NULL AND owner != ?", (self.owner,),
+        ).fetchall()
+        for key, entry in rows:
+            yield key, json.loads(entry)
+
+    def mark_merged(self) -> None:
+        """Le entry di questo processo sono in state.json: da qui in poi fa fede il file."""
+        self._conn.execute("UPDATE leases SET entry = NULL WHERE owner = ? AND entry IS NOT NULL", (self.owner,))
+
+    def release_all(self) -> int:
+        """Rilascia i lease non conclusi di questo processo (fine giro, limite, errori), dopo `mark_merged`."""
+        cur = self._conn.execute("DELETE FROM leases WHERE owner = ? AND done = 0", (self.owner,))
+        return cur.rowcount
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def open_lease_store(logs_dir: str, lease_seconds: float = DEFAULT_LEASE_SECONDS, clock=SYSTEM_CLOCK) -> LeaseStore:
+    return LeaseStore(os.path.join(logs_dir, CLAIMS_FILENAME), lease_seconds=lease_seconds, clock=clock)
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """Lock esclusivo tra processi (flock) su un file accanto a quello da proteggere."""
+    with open(path, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def file_stamp(path: str) -> Optional[Tuple[int, int, int]]:
+    """Firma (inode, mtime, size): cambia a ogni riscrittura atomica del file."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
@@ -0,0 +1,94 @@
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Optional
+
+LEDGER_DB_SUFFIX = ".db"
+WINDOW_SECONDS = 24 * 3600
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _epoch(moment: datetime) -> float:
+    return (moment - _EPOCH).total_seconds()
+
+
+class SendLedger:
+    """Registro persistente degli invii di un account, per il limite su 24 ore mobili.
+
+    Ogni invio prenota una riga (timestamp, campagna) prima della chiamata API, in
+    una transazione `BEGIN IMMEDIATE`: processi e campagne diversi sullo stesso
+    account vedono lo stesso conteggio e non possono superare il limite insieme.
+    Se l'invio fallisce la prenotazione viene rilasciata.
+    """
+
+    def __init__(self, path: str, window_seconds: float = WINDOW_SECONDS):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.window = window_seconds
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sends ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL NOT NULL, campaign TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sends_ts ON sends(ts)")
+
+    def count(self, now: datetime) -> int:
+        """Invii dell'account nelle ultime 24 ore."""
+        (used,) = self._conn.execute(
+            "SELECT COUNT(*) FROM sends WHERE ts > ?", (_epoch(now) - self.window,),
+        ).fetchone()
+        return used
+
+    def reserve(self, now: datetime, limit: int, campaign: str) -> Optional[int]:
+        """Prenota un invio se c'è capacità nella finestra; ritorna l'id o None se pieno."""
+        ts = _epoch(now)
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute("DELETE FROM sends WHERE ts <= ?", (ts - self.window,))
+            (used,) = self._conn.execute("SELECT COUNT(*) FROM sends").fetchone()
+            if used >= limit:
+                self._conn.execute("COMMIT")
+                return None
+            cur = self._conn.execute("INSERT INTO sends (ts, campaign) VALUES (?, ?)", (ts, campaign))
+            self._conn.execute("COMMIT")
+            return cur.lastrowid
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def confirm(self, reservation: int, now: datetime) -> None:
+        """Allinea il timestamp all'invio effettivo (dopo attese o retry)."""
+        self._conn.execute("UPDATE sends SET ts = ? WHERE id = ?", (_epoch(now), reservation))
+
+    def release(self, reservation: int) -> None:
+        self._conn.execute("DELETE FROM sends WHERE id = ?", (reservation,))
+
+    def next_free_at(self, now: datetime, limit: int) -> datetime:
+        """Istante in cui la finestra mobile avrà di nuovo almeno un invio disponibile."""
+        since = _epoch(now) - self.window
+        row = self._conn.execute(
+            "SELECT ts FROM sends WHERE ts > ? ORDER BY ts LIMIT 1 OFFSET ?",
+            (since, max(self.count(now) - limit, 0)),
+        ).fetchone()
+        if row is None:
+            return now
+        return _EPOCH + timedelta(seconds=row[0] + self.window)
+
+    def snapshot(self, path: str) -> "SendLedger":
+        """Copia coerente del registro (per la simulazione, che non deve toccare l'originale)."""
+        copy = SendLedger(path, self.window)
+        self._conn.backup(copy._conn)
+        return copy
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def ledger_path(ledger_dir: str, account: str) -> str:
+    return os.path.join(ledger_dir, f"{account}{LEDGER_DB_SUFFIX}")
+
+
+def open_send_ledger(ledger_dir: str, account: str) -> SendLedger:
+    return SendLedger(ledger_path(ledger_dir, account))
@@ -1,13 +1,44 @@
 #!/usr/bin/env python3
-import argparse, os, csv, time, uuid, json, random
-from datetime import datetime
+import argparse, os, csv, io, time, json, random, tempfile, heapq, itertools
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from typing import Dict, Any
-from jinja2 import Template
 import yaml
 import pandas as pd
 
 from gmail_utils import get_service, ensure_label, add_labels, search_messages, get_thread
 from sheets_utils import get_sheets_service
+from suppression_utils import make_normalizer, load_campaign_suppressions, SuppressionIndex
+from tracking_server import run_tracking_server, LOCAL_OPENS_FILENAME
+from mime_utils import UrlsafeBase64Writer, write_message
+from clock_utils import SYSTEM_CLOCK, VirtualClock, utc_iso
+from render_utils import render_file, render_string
+from bounce_utils import (
+    HARD, METADATA_HEADERS, RAW_FETCH_MAX_BYTES, Bounce, bounces_from_headers, build_thread_index, is_hard,
+    parse_dsn, read_bounces, write_bounces,
+)
+from events_utils import EVENTS_DIRNAME, PARQUET_DIRNAME, SEND_EVENTS, EventStore, export_parquet
+from analytics_utils import (
+    ANALYTICS_DB_FILENAME, ANALYTICS_JSON_FILENAME, JOURNAL_FILENAME, AnalyticsStore, append_journal,
+    open_journal, parse_ts, write_analytics_json,
+)
+from breaker_utils import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from ledger_utils import SendLedger, ledger_path, open_send_ledger
+from state_utils import StateTable
+from status_utils import (
+    DEFAULT_STATUS_INTERVAL_SECONDS, StatusFile, combine_statuses, format_status, prune_worker_statuses,
+    read_worker_statuses, worker_status_path,
+)
+from lease_utils import BUSY, CLAIMED, CLAIMS_FILENAME, DEFAULT_LEASE_SECONDS, DONE, file_lock, file_stamp, open_lease_store
+from simulation import SimulatedGmailService
+from recipients_utils import (
+    RESUME_FILENAME, count_rows, find_recipients_file, load_resume_checkpoint, open_recipient_source,
+    save_resume_checkpoint, template_columns,
+)
+from tracking_utils import (
+    load_tracking_secret, make_token, new_tracking_id, open_token_index, resolve_recipients,
+)
 from googleapiclient.errors import HttpError
 
 APP_ROOT = os.path.dirname(os.path.abspath(__file__))
@@ -15,7 +46,20 @@ DATA_ROOT = os.environ.get("DATA_ROOT", "/data")
 CREDS_ROOT = os.environ.get("CREDS_ROOT", "/creds")
 CAMPAIGNS_DIR = os.path.join(DATA_ROOT, "campaigns")
 STATE_FILENAME = "state.json"
+DEFAULT_STATE_MERGE_SECONDS = 30.0
+UNSUBS_UNRESOLVED_FILENAME = "unsubs_unresolved.csv"
+SUPPRESSION_DIRNAME = "suppression"
+TRACKING_DIRNAME = "tracking"
+LEDGER_DIRNAME = "ledger"
 DEFAULT_JITTER_RATIO = 0.3
+DEFAULT_MEDIA_UPLOAD_THRESHOLD = 4 * 1024 * 1024
+MEDIA_CHUNK_GRANULARITY = 256 * 1024
+DEFAULT_MEDIA_CHUNK_BYTES = 20 * MEDIA_CHUNK_GRANULARITY
+PREFLIGHT_RENDER_BATCH = 2000
+PREFLIGHT_ERROR_SAMPLES = 20
+
+# Event store attivo durante `send`: log_event vi copia gli eventi di invio (SEND_EVENTS).
+_EVENT_SINK: EventStore | None = None
 
 
 def _utc_now() -> str:
@@ -32,6 +76,8 @@ def log_event(level: str, event: str, **fields: Any) -> None:
     if fields:
         payload["data"] = fields
     print(json.dumps(payload, ensure_ascii=False))
+    if _EVENT_SINK is not None and event in SEND_EVENTS:
+        _EVENT_SINK.add(event, ts=payload["ts"], **fields)
 
 
 def _extract_status_code(exc: Exception) -> int | None:
@@ -52,22 +98,47 @@ def _is_retryable_exception(exc: Exception) -> bool:
     return isinstance(exc, (TimeoutError, ConnectionError))
 
 
-def _sleep_with_jitter(base_seconds: float) -> None:
-    jitter = base_seconds * DEFAULT_JITTER_RATIO
-    time.sleep(base_seconds + random.uniform(0, jitter))
+def _with_jitter(base_seconds: float) -> float:
+    return base_seconds + random.uniform(0, base_seconds * DEFAULT_JITTER_RATIO)
+
+
+def _sleep_with_jitter(base_seconds: float, clock=SYSTEM_CLOCK) -> None:
+    clock.sleep(_with_jitter(base_seconds))
+
+
+def _message_request(service, msg_body: Dict[str, Any], draft: bool = False, media=None):
+    """Richiesta Gmail per il messaggio: invio diretto, invio di una bozza (`draft_id`) o creazione bozza."""
+    if draft:
+        if media is not None:
+            return service.users().drafts().create(userId="me", body={}, media_body=media)
+        return service.users().drafts().create(userId="me", body={"message": msg_body})
+    if media is not None:
+        return service.users().messages().send(userId="me", body={}, media_body=media)
+    if "draft_id" in msg_body:
+        return service.users().drafts().send(userId="me", body={"id": msg_body["draft_id"]})
+    return service.users().messages().send(userId="me", body=msg_body)
 
 
 def _send_with_backoff(service, msg_body: Dict[str, Any], max_attempts: int, initial_delay: float,
-                       multiplier: float, max_delay: float):
-    """Invia il messaggio Gmail con retry exponential backoff."""
+                       multiplier: float, max_delay: float, resumable: bool = True,
+                       chunk_size: int = DEFAULT_MEDIA_CHUNK_BYTES, clock=SYSTEM_CLOCK, draft: bool = False,
+                       email: str | None = None, campaign: str | None = None):
+    """Invia il messaggio Gmail con retry exponential backoff (con `draft` crea invece una bozza).
+
+    `email` e `campaign` finiscono negli eventi `send_retry_scheduled`, come per i retry in coda.
+    """
+    if "media_path" in msg_body:
+        return _send_media_with_backoff(
+            service, msg_body, max_attempts, initial_delay, multiplier, max_delay, resumable, chunk_size, clock,
+            draft=draft, email=email, campaign=campaign,
+        )
     attempt = 1
     current_delay = max(initial_delay, 1.0)
     max_delay = max(max_delay, current_delay)
 
     while attempt <= max_attempts:
         try:
-            request = service.users().messages().send(userId="me", body=msg_body)
-            return request.execute()
+            return _message_request(service, msg_body, draft).execute()
         except Exception as exc:
             if not _is_retryable_exception(exc) or attempt == max_attempts:
                 raise
@@ -75,15 +146,67 @@ def _send_with_backoff(service, msg_body: Dict[str, Any], max_attempts: int, ini
             log_event(
                 "warning",
                 "send_retry_scheduled",
+                email=email,
+                campaign=campaign,
                 attempt=attempt,
                 max_attempts=max_attempts,
                 error=str(exc),
                 sleep_seconds=round(sleep_for, 2),
             )
-            _sleep_with_jitter(sleep_for)
+            _sleep_with_jitter(sleep_for, clock)
             current_delay = min(current_delay * max(multiplier, 1.0), max_delay)
             attempt += 1
 
+
+def _send_media_with_backoff(service, msg_body: Dict[str, Any], max_attempts: int, initial_delay: float,
+                             multiplier: float, max_delay: float, resumable: bool, chunk_size: int,
+                             clock=SYSTEM_CLOCK, draft: bool = False, email: str | None = None,
+                             campaign: str | None = None):
+    """Invia un messaggio grande come upload media (message/rfc822) invece che come JSON base64.
+
+    In modalità resumable un errore ritentabile non riparte da zero: `next_chunk`
+    interroga la sessione di upload e riprende dall'ultimo byte confermato.
+    """
+    from googleapiclient.http import MediaIoBaseUpload
+
+    chunk_size = max(MEDIA_CHUNK_GRANULARITY, chunk_size // MEDIA_CHUNK_GRANULARITY * MEDIA_CHUNK_GRANULARITY)
+    attempt = 1
+    current_delay = max(initial_delay, 1.0)
+    max_delay = max(max_delay, current_delay)
+
+    with open(msg_body["media_path"], "rb") as fh:
+        media = MediaIoBaseUpload(fh, mimetype="message/rfc822", chunksize=chunk_size, resumable=resumable)
+        request = _message_request(service, msg_body, draft, media=media)
+        while True:
+            try:
+                if not resumable:
+                    return request.execute()
+                _, response = request.next_chunk()
+                if response is not None:
+                    return response
+                # Chunk confermato: i tentativi contano per singolo chunk.
+                attempt = 1
+                current_delay = max(initial_delay, 1.0)
+            except Exception as exc:
+                if not _is_retryable_exception(exc) or attempt >= max_attempts:
+                    raise
+                sleep_for = min(current_delay, max_delay)
+                log_event(
+                    "warning",
+                    "send_retry_scheduled",
+                    email=email,
+                    campaign=campaign,
+                    attempt=attempt,
+                    max_attempts=max_attempts,
+                    error=str(exc),
+                    sleep_seconds=round(sleep_for, 2),
+                    upload_bytes_confirmed=getattr(request, "resumable_progress", 0),
+                    upload_bytes_total=msg_body.get("size"),
+                )
+                _sleep_with_jitter(sleep_for, clock)
+                current_delay = min(current_delay * max(multiplier, 1.0), max_delay)
+                attempt += 1
+
 def load_config(campaign: str) -> Dict[str, Any]:
     cfg_path = os.path.join(CAMPAIGNS_DIR, campaign, "campaign_config.yaml")
     if not os.path.exists(cfg_path):
@@ -92,9 +215,51 @@ def load_config(campaign: str) -> Dict[str, Any]:
         return yaml.safe_load(f)
 
 def render_template(tpl_path: str, ctx: Dict[str, Any]) -> str:
-    with open(tpl_path, "r", encoding="utf-8") as f:
-        tpl = Template(f.read())
-    return tpl.render(**ctx)
+    """Render del template HTML, memoizzato sulle variabili che il template usa davvero."""
+    return render_file(tpl_path, ctx)
+
+
+def _open_global_suppression() -> SuppressionIndex:
+    return SuppressionIndex(os.path.join(DATA_ROOT, SUPPRESSION_DIRNAME))
+
+
+def _tracking_dir() -> str:
+    return os.path.join(DATA_ROOT, TRACKING_DIRNAME)
+
+
+def _ledger_dir() -> str:
+    return os.path.join(DATA_ROOT, LEDGER_DIRNAME)
+
+
+def _events_dir() -> str:
+    return os.path.join(DATA_ROOT, EVENTS_DIRNAME)
+
+
+def _iso_from_epoch(seconds: float | None) -> str | None:
+    return utc_iso(datetime.utcfromtimestamp(seconds)) if seconds is not None else None
+
+
+def _record_events(event: str, campaign: str, account: str, rows) -> int:
+    """Accoda all'event store eventi di engagement (open/reply/bounce) già deduplicati."""
+    store = EventStore(_events_dir(), campaign=campaign, account=account)
+    for fields in rows:
+        store.add(event, **fields)
+    store.close()
+    return store.written
+
+
+def _build_tracking_urls(campaign: str, email: str, tracking_base: str, unsubscribe_base: str,
+                         token: str | None) -> tuple:
+    """URL di pixel/unsubscribe: col token opaco se disponibile, altrimenti con l'email in chiaro."""
+    ref = f"t={token}" if token else None
+    tracking_pixel_url = ""
+    if tracking_base:
+        # Apps Script: assumiamo che tracking_base contenga .../exec?mode=pixel
+        tracking_pixel_url = f"{tracking_base}&cid={campaign}&{ref or f'to={email}'}"
+    unsubscribe_url = ""
+    if unsubscribe_base:
+        unsubscribe_url = f"{unsubscribe_base}&cid={campaign}&{ref or f'email={email}'}"
+    return tracking_pixel_url, unsubscribe_url
 
 
 def _resolve_account(account: str | None, campaign: str | None) -> str:
@@ -118,45 +283,187 @@ def _normalize_attachment_path(path: str | None) -> str | None:
     return os.path.join(DATA_ROOT, rel)
 
 
-def _load_first_recipient_row(csv_path: str) -> Dict[str, Any]:
-    if not os.path.exists(csv_path):
-        raise FileNotFoundError(f"recipients.csv non trovato: {csv_path}")
-    with open(csv_path, newline="", encoding="utf-8") as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            email = row.get("email", "").strip()
-            if email:
-                return row
-    raise ValueError("recipients.csv non contiene righe valide con campo email")
+def _recipients_path(campaign: str, cfg: Dict[str, Any]) -> str:
+    return find_recipients_file(os.path.join(CAMPAIGNS_DIR, campaign), cfg.get("recipients_file"))
+
+
+def _recipient_columns(cfg: Dict[str, Any], template_path: str) -> set | None:
+    """Colonne da leggere dalla sorgente destinatari: solo quelle usate da template e oggetto."""
+    if not cfg.get("project_recipient_columns", True) or not os.path.exists(template_path):
+        return None
+    with open(template_path, "r", encoding="utf-8") as f:
+        return template_columns(f.read(), cfg.get("subject", "Campagna"))
+
+
+def _load_first_recipient_row(path: str, columns=None) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"file destinatari non trovato: {path}")
+    for row in open_recipient_source(path, columns=columns):
+        email = (row.get("email") or "").strip()
+        if email:
+            return row
+    raise ValueError(f"{os.path.basename(path)} non contiene righe valide con campo email")
+
 
+def _summarize_recipients(path: str, default_attachment: str | None, suppressed=None, normalize=None,
+                          excluded=None, on_row=None, columns=None):
+    """Scorre il CSV una sola volta: conteggi, duplicati, esclusi e allegati (stat in cache per percorso).
 
-def _summarize_recipients(csv_path: str, default_attachment: str | None):
+    `suppressed` è l'indice globale, `excluded` un insieme di chiavi normalizzate (soppressi
+    della campagna, già inviati); `on_row(row_number, email, row)` riceve le righe che `send` spedirebbe.
+    """
     stats = {
         "total": 0,
         "missing_email": 0,
-        "attachment_missing": [],
+        "suppressed": 0,
+        "duplicates": 0,
+        "excluded": 0,
+        "eligible": 0,
+        "attachment_missing": {},
         "attachment_ok": set(),
+        "attachment_bytes": 0,
+        "max_attachment_bytes": 0,
     }
-    if not os.path.exists(csv_path):
-        raise FileNotFoundError(f"recipients.csv non trovato: {csv_path}")
-
-    with open(csv_path, newline="", encoding="utf-8") as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            email = row.get("email", "").strip()
-            if not email:
-                stats["missing_email"] += 1
-                continue
-            stats["total"] += 1
-            attachment_path = _normalize_attachment_path(row.get("attachment_path", "")) or default_attachment
-            if attachment_path:
-                if os.path.exists(attachment_path):
-                    stats["attachment_ok"].add(attachment_path)
-                else:
-                    stats["attachment_missing"].append(attachment_path)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"file destinatari non trovato: {path}")
+
+    normalize = normalize or (lambda e: e.strip().lower())
+    attachment_cache: Dict[str, tuple] = {}
+    seen = set()
+    for row_number, row in enumerate(open_recipient_source(path, columns=columns), start=1):
+        email = (row.get("email") or "").strip()
+        if not email:
+            stats["missing_email"] += 1
+            continue
+        stats["total"] += 1
+        raw_attachment = row.get("attachment_path") or ""
+        cached = attachment_cache.get(raw_attachment)
+        if cached is None:
+            attachment_path = _normalize_attachment_path(raw_attachment) or default_attachment
+            try:
+                size = os.stat(attachment_path).st_size if attachment_path else None
+            except OSError:
+                size = None
+            cached = attachment_cache[raw_attachment] = (attachment_path, size)
+        attachment_path, attachment_size = cached
+        if attachment_path:
+            if attachment_size is not None:
+                stats["attachment_ok"].add(attachment_path)
+            else:
+                missing = stats["attachment_missing"]
+                missing[attachment_path] = missing.get(attachment_path, 0) + 1
+
+        key = normalize(email)
+        if key in seen:
+            stats["duplicates"] += 1
+            continue
+        seen.add(key)
+        if suppressed is not None and email in suppressed:
+            stats["suppressed"] += 1
+            continue
+        if excluded is not None and key in excluded:
+            stats["excluded"] += 1
+            continue
+        stats["eligible"] += 1
+        if attachment_size:
+            stats["attachment_bytes"] += attachment_size
+            stats["max_attachment_bytes"] = max(stats["max_attachment_bytes"], attachment_size)
+        if on_row is not None:
+            on_row(row_number, email, row)
     return stats
 
 
+_STRICT_TEMPLATES: Dict[str, Any] = {}
+
+
+def _strict_template(source: str):
+    """Template compilato con StrictUndefined, in cache per processo (inline o worker)."""
+    tpl = _STRICT_TEMPLATES.get(source)
+    if tpl is None:
+        from jinja2 import Environment, StrictUndefined
+
+        tpl = _STRICT_TEMPLATES[source] = Environment(undefined=StrictUndefined).from_string(source)
+        # Jinja copia i globals (una ChainMap) a ogni render: appiattirli una volta costa molto meno.
+        tpl.globals = dict(tpl.globals)
+    return tpl
+
+
+def _render_check_batch(body_source: str, subject_source: str, rows: list) -> Dict[str, Any]:
+    """Render di controllo di un blocco di righe `(row_number, row, pixel_url, unsubscribe_url)`."""
+    body_tpl = _strict_template(body_source)
+    subject_tpl = _strict_template(subject_source)
+    result = {"rendered": 0, "errors": 0, "error_samples": [], "body_bytes": 0, "max_body_bytes": 0}
+    for row_number, row, tracking_pixel_url, unsubscribe_url in rows:
+        email = row["email"].strip()
+        # Le righe più corte dell'header hanno colonne None: le trattiamo come variabili mancanti.
+        row = {k: v for k, v in row.items() if v is not None}
+        ctx = {**row, "tracking_pixel_url": tracking_pixel_url, "unsubscribe_url": unsubscribe_url, "email": email}
+        try:
+            body = body_tpl.render(**ctx)
+            subject_tpl.render(**row)
+        except Exception as exc:
+            result["errors"] += 1
+            if len(result["error_samples"]) < PREFLIGHT_ERROR_SAMPLES:
+                result["error_samples"].append({"row": row_number, "email": email, "error": f"{type(exc).__name__}: {exc}"})
+            continue
+        size = len(body.encode("utf-8"))
+        result["rendered"] += 1
+        result["body_bytes"] += size
+        result["max_body_bytes"] = max(result["max_body_bytes"], size)
+    return result
+
+
+class _PreflightRenderer:
+    """Accumula righe in blocchi e le renderizza inline o in un pool di processi (coda limitata)."""
+
+    def __init__(self, body_source: str, subject_source: str, workers: int, batch_size: int | None = None):
+        self.body_source = body_source
+        self.subject_source = subject_source
+        self.workers = workers
+        self.batch_size = batch_size or PREFLIGHT_RENDER_BATCH
+        self.batch: list = []
+        self.futures = deque()
+        self.executor = None
+        self.totals = {"rendered": 0, "errors": 0, "error_samples": [], "body_bytes": 0, "max_body_bytes": 0}
+
+    def _merge(self, result: Dict[str, Any]) -> None:
+        totals = self.totals
+        for field in ("rendered", "errors", "body_bytes"):
+            totals[field] += result[field]
+        totals["max_body_bytes"] = max(totals["max_body_bytes"], result["max_body_bytes"])
+        room = PREFLIGHT_ERROR_SAMPLES - len(totals["error_samples"])
+        totals["error_samples"].extend(result["error_samples"][:room])
+
+    def add(self, item: tuple) -> None:
+        self.batch.append(item)
+        if len(self.batch) >= self.batch_size:
+            self._submit()
+
+    def _submit(self) -> None:
+        batch, self.batch = self.batch, []
+        if self.workers <= 1:
+            self._merge(_render_check_batch(self.body_source, self.subject_source, batch))
+            return
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.futures.append(self.executor.submit(_render_check_batch, self.body_source, self.subject_source, batch))
+        while len(self.futures) > 2 * self.workers:
+            self._merge(self.futures.popleft().result())
+
+    def finish(self) -> Dict[str, Any]:
+        try:
+            if self.batch:
+                if self.executor is None:
+                    self.workers = 1
+                self._submit()
+            while self.futures:
+                self._merge(self.futures.popleft().result())
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True, cancel_futures=True)
+        return self.totals
+
+
 def cmd_auth(args):
     """Consente di eseguire solo il flow OAuth senza inviare email."""
     account = _resolve_account(getattr(args, "account", None), getattr(args, "campaign", None))
@@ -171,32 +478,51 @@ def cmd_auth(args):
     log_event("info", "auth_success", account=account, email=email)
 
 
+def _checked_attachment(attachment_path: str | None) -> str | None:
+    if not attachment_path:
+        return None
+    attachment_path = attachment_path.strip()
+    if attachment_path and os.path.exists(attachment_path):
+        return attachment_path
+    log_event("warning", "attachment_missing", attachment_path=attachment_path)
+    return None
+
+
 def make_message(sender: str, to: str, subject: str, html_body: str, attachment_path: str | None):
-    from email.mime.text import MIMEText
-    from email.mime.multipart import MIMEMultipart
-    from email.mime.base import MIMEBase
-    from email import encoders
-    import base64, os
-
-    msg = MIMEMultipart()
-    msg["To"] = to
-    msg["From"] = sender
-    msg["Subject"] = subject
-    msg.attach(MIMEText(html_body, "html", "utf-8"))
-    if attachment_path:
-        attachment_path = attachment_path.strip()
-        if attachment_path and os.path.exists(attachment_path):
-            part = MIMEBase("application", "octet-stream")
-            with open(attachment_path, "rb") as f:
-                part.set_payload(f.read())
-            encoders.encode_base64(part)
-            filename = os.path.basename(attachment_path)
-            part.add_header("Content-Disposition", f'attachment; filename="{filename}"')
-            msg.attach(part)
-        else:
-            log_event("warning", "attachment_missing", attachment_path=attachment_path)
-    raw = base64.urlsafe_b64encode(msg.as_bytes()).decode("utf-8")
-    return {"raw": raw}
+    """Messaggio per messages.send: il MIME è codificato in base64url mentre viene scritto."""
+    buf = io.BytesIO()
+    encoder = UrlsafeBase64Writer(buf)
+    write_message(encoder, sender, to, subject, html_body, _checked_attachment(attachment_path))
+    encoder.close()
+    return {"raw": buf.getvalue().decode("ascii")}
+
+
+def make_media_message(sender: str, to: str, subject: str, html_body: str, attachment_path: str | None):
+    """Scrive il messaggio RFC 822 grezzo su file temporaneo, per l'upload media di messages.send."""
+    attachment_path = _checked_attachment(attachment_path)
+    fd, path = tempfile.mkstemp(prefix="campaign-", suffix=".eml")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            size = write_message(f, sender, to, subject, html_body, attachment_path)
+    except BaseException:
+        os.remove(path)
+        raise
+    return {"media_path": path, "size": size}
+
+
+def _estimate_message_size(html_body: str, attachment_path: str | None) -> int:
+    """Stima (per eccesso) della dimensione RFC 822: corpo HTML + allegato in base64."""
+    size = len(html_body.encode("utf-8")) * 4 // 3 + 1024
+    if attachment_path and os.path.exists(attachment_path.strip()):
+        size += os.path.getsize(attachment_path.strip()) * 4 // 3
+    return size
+
+
+def _discard_message(msg: Dict[str, Any] | None) -> None:
+    """Rimuove l'eventuale file temporaneo di un messaggio media."""
+    path = (msg or {}).get("media_path")
+    if path and os.path.exists(path):
+        os.remove(path)
 
 def load_send_state(path: str) -> Dict[str, Any]:
     if not os.path.exists(path):
@@ -213,27 +539,177 @@ def save_send_state(path: str, state: Dict[str, Any]) -> None:
         json.dump(state, f, ensure_ascii=False, indent=2)
     os.replace(tmp_path, path)
 
+
+def _merge_save_state(state_path: str, send_state: StateTable, owned, normalize, stamp, leases):
+    """Riscrive state.json sotto lock, unendo le entry degli altri processi.
+
+    Dal disco si riprendono le entry salvate dagli altri, poi si applicano quelle che
+    hanno solo in `claims.db` (più recenti del file); le chiavi in `owned` le scrive
+    solo questo processo. `stamp` è la firma del file al salvataggio precedente.
+    Costa O(N): va chiamata a intervalli e a fine giro, non a ogni tentativo (che
+    salva la sola entry con `leases.save_entry`). Ritorna la nuova firma.
+    """
+    with file_lock(f"{state_path}.lock"):
+        if file_stamp(state_path) != stamp:
+            send_state.merge_from(StateTable.load(state_path, normalize), skip=owned)
+        for key, entry in leases.unmerged_entries():
+            send_state[key] = entry
+        send_state.write_json(state_path)
+        leases.mark_merged()
+        return file_stamp(state_path)
+
+
+def _iter_unique_recipients(rows, normalize, is_suppressed, counters: Dict[str, int]):
+    """Normalizza e deduplica i destinatari, scartando i soppressi prima di render/MIME."""
+    seen = set()
+    for row in rows:
+        email = (row.get("email") or "").strip()
+        if not email:
+            counters["empty"] = counters.get("empty", 0) + 1
+            continue
+        key = normalize(email)
+        if key in seen:
+            counters["duplicates"] += 1
+            log_event("info", "recipient_duplicate", email=email, key=key)
+            continue
+        seen.add(key)
+        if is_suppressed(key, email):
+            counters["suppressed"] += 1
+            log_event("info", "recipient_suppressed", email=email, key=key)
+            continue
+        yield key, email, row
+
+
+def _build_message_job(template_path: str, subject_tpl: str, ctx: Dict[str, Any], row: Dict[str, Any],
+                       sender: str, to: str, attachment_path: str | None, media_threshold: int = 0):
+    """Render + MIME di un destinatario: gira inline o in un worker del ProcessPoolExecutor."""
+    html_body = render_template(template_path, ctx)
+    subject = render_string(subject_tpl, row)
+    if media_threshold > 0 and _estimate_message_size(html_body, attachment_path) > media_threshold:
+        return make_media_message(sender, to, subject, html_body, attachment_path)
+    return make_message(sender, to, subject, html_body, attachment_path)
+
+
+class _MessageJobs:
+    """Parametri per costruire il messaggio di un destinatario, condivisi da `send` e `stage`.
+
+    `job()` assegna il tracking_id (se servono i token) e ritorna gli argomenti di
+    `_build_message_job`: il render vero avviene dopo, inline o nel pool di processi.
+    """
+
+    def __init__(self, campaign: str, cfg: Dict[str, Any]):
+        self.campaign = campaign
+        self.from_email = cfg.get("send_as_email") or cfg["from_email"]
+        self.subject_tpl = cfg.get("subject", "Campagna")
+        self.template_html = os.path.join(CAMPAIGNS_DIR, campaign, "template.html")
+        self.default_attachment_path = _normalize_attachment_path(cfg.get("default_attachment_path"))
+        self.media_threshold = int(cfg.get("media_upload_threshold_bytes", DEFAULT_MEDIA_UPLOAD_THRESHOLD) or 0)
+        tracking_base = (cfg.get("tracking_base_url") or "").rstrip("/")
+        unsubscribe_base = (cfg.get("unsubscribe_base_url") or "").rstrip("/")
+        self.tracking_base = tracking_base if cfg.get("track_opens", False) else ""
+        self.unsubscribe_base = unsubscribe_base if cfg.get("unsubscribe_enabled", False) else ""
+        self.token_index = None
+        self.tracking_secret = b""
+        if cfg.get("tracking_tokens", True) and (self.tracking_base or self.unsubscribe_base):
+            self.tracking_secret = load_tracking_secret(_tracking_dir())
+            self.token_index = open_token_index(_tracking_dir())
+
+    def job(self, entry, email: str, row: Dict[str, Any]) -> tuple:
+        token = None
+        if self.token_index is not None:
+            if not entry.get("tracking_id"):
+                entry["tracking_id"] = new_tracking_id()
+            self.token_index.add(entry["tracking_id"], self.campaign, email)
+            token = make_token(self.tracking_secret, entry["tracking_id"])
+        tracking_pixel_url, unsubscribe_url = _build_tracking_urls(
+            self.campaign, email, self.tracking_base, self.unsubscribe_base, token,
+        )
+        ctx = {**row, "tracking_pixel_url": tracking_pixel_url, "unsubscribe_url": unsubscribe_url, "email": email}
+        attachment_path = row.get("attachment_path", "").strip()
+        attachment_path = _normalize_attachment_path(attachment_path) or self.default_attachment_path
+        return (self.template_html, self.subject_tpl, ctx, row, self.from_email, email, attachment_path,
+                self.media_threshold)
+
+    def close(self) -> None:
+        if self.token_index is not None:
+            self.token_index.close()
+
+
+def _prefetch_messages(candidates, executor, depth: int):
+    """Costruisce i messaggi in anticipo rispetto all'invio, con al massimo `depth` in coda.
+
+    Senza executor il messaggio è costruito inline al momento del consumo; con un
+    ProcessPoolExecutor la CPU (render, MIME, base64) si sovrappone alla latenza
+    delle API e il generatore si ferma quando la coda è piena (backpressure).
+    Un job già pronto (dict, es. una bozza da `stage`) passa senza essere costruito.
+    """
+    if executor is None:
+        for item, job in candidates:
+            yield item, job if isinstance(job, dict) else _build_message_job(*job)
+        return
+    pending = deque()
+    try:
+        for item, job in candidates:
+            if isinstance(job, dict):
+                future = Future()
+                future.set_result(job)
+            else:
+                future = executor.submit(_build_message_job, *job)
+            pending.append((item, future))
+            if len(pending) >= depth:
+                item, future = pending.popleft()
+                yield item, future.result()
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+    finally:
+        for _, future in pending:
+            if not future.cancel() and future.done() and future.exception() is None:
+                _discard_message(future.result())
+
+
 def cmd_send(args):
     campaign = args.campaign
     cfg = load_config(campaign)
+    if getattr(args, "simulate", False):
+        return _simulate_send(args, campaign, cfg)
 
     creds_dir = os.path.join(CREDS_ROOT, cfg.get("account_name", "default"))
     service = get_service(creds_dir)
+    sheets_service = None
+    if float(cfg.get("unsubs_refresh_seconds", 0) or 0) > 0 and cfg.get("sheet_id"):
+        sheets_service = get_sheets_service(creds_dir)
+    _run_send(
+        campaign, cfg, service, os.path.join(DATA_ROOT, "logs", campaign),
+        sheets_service=sheets_service, until_done=getattr(args, "until_done", False),
+    )
 
-    from_email = cfg.get("send_as_email") or cfg["from_email"]
-    subject_tpl = cfg.get("subject", "Campagna")
-    label_name = cfg.get("label_for_sent") or f"campaign/{campaign}"
-    label_id = ensure_label(service, label_name)
 
-    recipients_csv = os.path.join(CAMPAIGNS_DIR, campaign, "recipients.csv")
-    template_html = os.path.join(CAMPAIGNS_DIR, campaign, "template.html")
+def _run_send(campaign: str, cfg: Dict[str, Any], service, logs_dir: str, clock=SYSTEM_CLOCK,
+              sheets_service=None, simulated: bool = False, until_done: bool = False,
+              ledger=None) -> Dict[str, Any]:
+    """Un giro di invio della campagna (fino a fine CSV o a `daily_send_limit`).
 
-    default_attachment_path = _normalize_attachment_path(cfg.get("default_attachment_path"))
+    `daily_send_limit` vale sulle 24 ore mobili dell'account, contate nel ledger
+    condiviso da processi e campagne; con `until_done` invece di fermarsi al limite
+    si attende esattamente fino a quando si libera capacità.
 
-    track_opens = bool(cfg.get("track_opens", False))
-    tracking_base = (cfg.get("tracking_base_url") or "").rstrip("/")
-    unsubscribe_base = (cfg.get("unsubscribe_base_url") or "").rstrip("/")
-    unsubscribe_enabled = bool(cfg.get("unsubscribe_enabled", False))
+    Più processi (anche su host diversi con la stessa cartella dati) possono lavorare
+    sulla stessa campagna: ogni destinatario viene preso con un lease in `claims.db`
+    prima di costruire il messaggio. Ogni tentativo salva solo l'entry del destinatario
+    in `claims.db`; state.json si riscrive unendo le entry dei diversi processi ogni
+    `state_merge_interval_seconds`, prima delle attese lunghe e a fine giro.
+
+    Tutte le attese passano da `clock`, così `send --simulate` esegue lo stesso flusso
+    con un orologio virtuale. In simulazione i messaggi non vengono costruiti, non si
+    usano lease e state.json si scrive solo a fine giro.
+    """
+    label_name = cfg.get("label_for_sent") or f"campaign/{campaign}"
+    label_id = ensure_label(service, label_name)
+
+    recipients_path = _recipients_path(campaign, cfg)
+    jobs = _MessageJobs(campaign, cfg)
+    recipient_columns = _recipient_columns(cfg, jobs.template_html)
 
     daily_limit = int(cfg.get("daily_send_limit", 100))
     delay = int(cfg.get("delay_between_emails_seconds", 10))
@@ -247,18 +723,71 @@ def cmd_send(args):
     max_attempts_per_contact = int(cfg.get("max_attempts_per_contact", 5))
     global_error_threshold = int(cfg.get("global_error_threshold_for_cooldown", 5))
     global_error_cooldown = int(cfg.get("global_error_cooldown_seconds", 120))
+    breaker_max_outage = float(cfg.get("circuit_breaker_max_outage_seconds", 6 * 3600) or 0)
+    media_resumable = bool(cfg.get("media_upload_resumable", True))
+    media_chunk = int(cfg.get("media_upload_chunk_bytes", DEFAULT_MEDIA_CHUNK_BYTES))
+
+    own_ledger = ledger is None
+    if own_ledger:
+        ledger = open_send_ledger(_ledger_dir(), cfg.get("account_name", "default"))
 
-    logs_dir = os.path.join(DATA_ROOT, "logs", campaign)
     os.makedirs(logs_dir, exist_ok=True)
     sent_log_path = os.path.join(logs_dir, "sent_log.csv")
     sent_threads_path = os.path.join(logs_dir, "sent_threads.csv")
     state_path = os.path.join(logs_dir, STATE_FILENAME)
-    send_state = load_send_state(state_path)
-
-    total_recipients = 0
-    if os.path.exists(recipients_csv):
-        with open(recipients_csv, newline="", encoding="utf-8") as csvfile:
-            total_recipients = sum(1 for _ in csv.DictReader(csvfile))
+    normalize = make_normalizer(cfg)
+    # Tabella compatta (chiavi normalizzate), non un dict per destinatario: vedi state_utils.
+    send_state = StateTable.load(state_path, normalize)
+    state_stamp = file_stamp(state_path)
+    leases = None
+    if not simulated:
+        leases = open_lease_store(logs_dir, float(cfg.get("claim_lease_seconds", DEFAULT_LEASE_SECONDS)), clock)
+        # Entry salvate in claims.db e mai arrivate in state.json (processi caduti o ancora in corsa).
+        for key, entry in leases.unmerged_entries():
+            send_state[key] = entry
+    # Chiavi prese da questo processo: le loro entry in state.json le scrive solo lui.
+    owned = set()
+    state_merge_interval = float(cfg.get("state_merge_interval_seconds", DEFAULT_STATE_MERGE_SECONDS))
+    last_state_merge = clock.monotonic()
+    suppressed = load_campaign_suppressions(logs_dir, normalize)
+    global_suppression = _open_global_suppression() if cfg.get("use_global_suppression", True) else None
+
+    unsubs_refresh = float(cfg.get("unsubs_refresh_seconds", 0) or 0)
+    unsubs_sheets = sheets_service if unsubs_refresh > 0 and cfg.get("sheet_id") else None
+    last_unsubs_sync = clock.monotonic()
+
+    def refresh_unsubs() -> None:
+        nonlocal last_unsubs_sync
+        if unsubs_sheets is None or clock.monotonic() - last_unsubs_sync < unsubs_refresh:
+            return
+        last_unsubs_sync = clock.monotonic()
+        try:
+            new_emails = _sync_unsubs(unsubs_sheets, cfg["sheet_id"], cfg.get("sheet_unsubs_name", "unsubs"), logs_dir)
+        except Exception as exc:
+            log_event("warning", "unsubs_refresh_failed", campaign=campaign, error=str(exc))
+            return
+        suppressed.update(normalize(e) for e in new_emails)
+        if global_suppression is not None:
+            global_suppression.refresh()
+        if new_emails:
+            log_event("info", "unsubs_refreshed", campaign=campaign, new=len(new_emails))
+
+    def is_suppressed(key: str, email: str) -> bool:
+        refresh_unsubs()
+        if key in suppressed:
+            return True
+        return global_suppression is not None and email in global_suppression
+
+    resume_path = os.path.join(logs_dir, RESUME_FILENAME)
+    resume_from, total_recipients = load_resume_checkpoint(resume_path, recipients_path)
+    if total_recipients is None and os.path.exists(recipients_path):
+        if resume_from is not None:
+            total_recipients = resume_from.row + count_rows(recipients_path, resume_from)
+        else:
+            total_recipients = count_rows(recipients_path)
+    total_recipients = total_recipients or 0
+    if resume_from is not None:
+        log_event("info", "send_resume", campaign=campaign, offset=resume_from.offset, row=resume_from.row)
 
     log_event(
         "info",
@@ -266,51 +795,135 @@ def cmd_send(args):
         campaign=campaign,
         total_recipients=total_recipients,
         daily_limit=daily_limit,
+        daily_remaining=max(daily_limit - ledger.count(clock.now()), 0),
+        until_done=until_done,
+        worker=leases.owner if leases is not None else None,
         delay_seconds=delay,
         batch_size=batch_size,
     )
 
+    status = None
+    if not simulated:
+        status_path = worker_status_path(logs_dir, leases.owner)
+        prune_worker_statuses(logs_dir, keep=status_path)
+        status = StatusFile(
+            status_path,
+            campaign,
+            clock=clock,
+            interval=float(cfg.get("status_interval_seconds", DEFAULT_STATUS_INTERVAL_SECONDS)),
+            worker=leases.owner,
+            total_recipients=total_recipients,
+            daily_limit=daily_limit,
+            until_done=until_done,
+        )
+
+    # Il checkpoint punta alla prima riga non ancora conclusa: avanza solo finché
+    # tutte le righe precedenti sono state inviate (o scartate in modo definitivo).
+    checkpoint = resume_from
+
+    def save_checkpoint(position) -> None:
+        if position is not None:
+            save_resume_checkpoint(resume_path, recipients_path, position, total_recipients)
+
     sent_set = set()
     if os.path.exists(sent_log_path):
         with open(sent_log_path, "r", encoding="utf-8") as f:
             for line in f:
-                sent_set.add(line.strip())
+                if line.strip():
+                    sent_set.add(normalize(line))
 
-    sent_today = 0
     batch_counter = 0
-    consecutive_errors = 0
     skipped_by_attempts = 0
+    already_sent = 0
     success_count = 0
     error_count = 0
+    filter_counters = {"duplicates": 0, "suppressed": 0, "empty": 0}
+    # Le righe prima del checkpoint di partenza sono tutte concluse; delle successive si contano
+    # quelle concluse in questo giro (inviate prima o ora, scartate, oltre i tentativi).
+    start_row = resume_from.row if resume_from is not None else 0
+
+    def report_status(force: bool = False, **fields: Any) -> None:
+        """Aggiorna lo status del worker con i contatori già in memoria (niente CSV né state.json)."""
+        if status is None:
+            return
+        concluded = start_row + already_sent + success_count + skipped_by_attempts + sum(filter_counters.values())
+        status.update(
+            send_state.status_counts(),
+            remaining=max(total_recipients - concluded, 0),
+            daily_remaining=max(daily_limit - ledger.count(clock.now()), 0),
+            force=force,
+            sent_this_run=success_count,
+            errors_this_run=error_count,
+            **fields,
+        )
 
-    sent_threads = []
-    if os.path.exists(sent_threads_path):
-        with open(sent_threads_path, "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            sent_threads = list(reader)
-
-    with open(recipients_csv, newline="", encoding="utf-8") as csvfile, \
-         open(sent_log_path, "a", encoding="utf-8") as logf:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            email = row.get("email", "").strip()
-            if not email:
+    report_status(force=True)
+
+    def persist_state(key: str | None = None, merge: bool = False) -> None:
+        """Salva l'entry di `key` in claims.db; state.json si riscrive ogni `state_merge_interval_seconds`."""
+        nonlocal state_stamp, last_state_merge
+        if simulated:
+            return
+        if key is not None:
+            leases.save_entry(key, send_state[key])
+        if merge or clock.monotonic() - last_state_merge >= state_merge_interval:
+            state_stamp = _merge_save_state(state_path, send_state, owned, normalize, state_stamp, leases)
+            last_state_merge = clock.monotonic()
+
+    reader = open_recipient_source(recipients_path, resume_from, recipient_columns)
+    limit_reached = False
+    circuit_aborted = False
+
+    def on_circuit(state: str, **fields: Any) -> None:
+        log_event("info" if state == CLOSED else "warning", f"circuit_{state}", campaign=campaign, **fields)
+        if state == OPEN:
+            persist_state(merge=True)
+            resume_at = clock.now() + timedelta(seconds=fields.get("open_seconds", 0))
+            report_status(force=True, state="waiting", next_send_at=utc_iso(resume_at))
+
+    breaker = CircuitBreaker(
+        failure_threshold=global_error_threshold,
+        open_seconds=global_error_cooldown,
+        multiplier=float(cfg.get("circuit_breaker_multiplier", 2)),
+        max_open_seconds=float(cfg.get("circuit_breaker_max_open_seconds", 3600)),
+        clock=clock,
+        listener=on_circuit,
+    )
+
+    def iter_candidates():
+        """Righe da spedire, con stato già aggiornato e parametri per costruire il messaggio."""
+        nonlocal skipped_by_attempts, already_sent
+        for key, email, row in _iter_unique_recipients(reader, normalize, is_suppressed, filter_counters):
+            row_start, row_end = reader.row_start, reader.row_end
+            state_entry = send_state.get(key)
+            if (state_entry and state_entry.get("status") == "sent") or key in sent_set:
+                already_sent += 1
                 continue
 
-            state_entry = send_state.get(email)
-            if not state_entry:
-                send_state[email] = {"status": "pending", "attempts": 0}
-            else:
-                if state_entry.get("status") == "sent":
+            if leases is not None:
+                claim = leases.claim(key)
+                if claim == DONE:
+                    already_sent += 1
+                    continue
+                if claim == BUSY:
+                    # Lo sta spedendo un altro processo: il checkpoint non lo supera.
+                    log_event("info", "recipient_claimed_elsewhere", email=email, campaign=campaign)
+                    mark_unfinished(row_start)
                     continue
-                if state_entry.get("status") == "sending":
-                    # Riporta a pending dopo crash
-                    state_entry["status"] = "pending"
+                owned.add(key)
+                latest = leases.entry(key)
+                if latest is not None:
+                    # Ripreso da un processo caduto: la sua ultima entry non è ancora in state.json.
+                    send_state[key] = latest
+                state_entry = send_state.get(key)
 
-            if email in sent_set:
-                continue
+            if not state_entry:
+                send_state[key] = {"status": "pending", "attempts": 0}
+            elif state_entry.get("status") == "sending":
+                # Riporta a pending dopo crash (con i lease, nessun altro processo lo sta inviando)
+                state_entry["status"] = "pending"
 
-            entry = send_state[email]
+            entry = send_state[key]
             attempts_done = entry.get("attempts", 0)
             if entry.get("status") == "error" and attempts_done >= max_attempts_per_contact:
                 log_event(
@@ -320,144 +933,372 @@ def cmd_send(args):
                     attempts=attempts_done,
                     max_attempts=max_attempts_per_contact,
                 )
+                # Scartato in modo definitivo: come un inviato, non blocca il checkpoint.
                 skipped_by_attempts += 1
                 continue
 
-            tracking_id = str(uuid.uuid4())
-            tracking_pixel_url = ""
-            if track_opens and tracking_base:
-                # Apps Script: assumiamo che tracking_base contenga .../exec?mode=pixel
-                tracking_pixel_url = f"{tracking_base}&cid={campaign}&to={email}"
-
-            unsubscribe_url = ""
-            if unsubscribe_enabled and unsubscribe_base:
-                unsubscribe_url = f"{unsubscribe_base}&email={email}"
-
-            ctx = {**row, "tracking_pixel_url": tracking_pixel_url, "unsubscribe_url": unsubscribe_url, "email": email}
-            html_body = render_template(template_html, ctx)
-            subject = Template(subject_tpl).render(**row)
-
-            attachment_path = row.get("attachment_path", "").strip()
-            attachment_path = _normalize_attachment_path(attachment_path) or default_attachment_path
+            job = jobs.job(entry, email, row)
+            if entry.get("draft_id"):
+                # Messaggio già caricato da `stage`: si spedisce la bozza; il job resta per
+                # ricostruirlo se la bozza è stata cancellata.
+                job = {"draft_id": entry["draft_id"], "fallback_job": job}
+            yield (key, email, row_start, row_end), job
+
+    # Righe non concluse (errori, retry in coda, lease di altri processi) per offset, con un heap
+    # a cancellazione pigra: un retry riuscito toglie il blocco e il checkpoint può riavanzare.
+    unfinished: Dict[int, Any] = {}
+    unfinished_heap: list = []
+    frontier = resume_from
+
+    def mark_unfinished(position) -> None:
+        if position.offset not in unfinished:
+            unfinished[position.offset] = position
+            heapq.heappush(unfinished_heap, position.offset)
+
+    def mark_finished(position) -> None:
+        unfinished.pop(position.offset, None)
+
+    def advance_checkpoint(position, persist: bool = False) -> None:
+        nonlocal checkpoint, frontier
+        if position is not None and (frontier is None or position.offset > frontier.offset):
+            frontier = position
+        while unfinished_heap and unfinished_heap[0] not in unfinished:
+            heapq.heappop(unfinished_heap)
+        checkpoint = frontier
+        if unfinished_heap and (frontier is None or unfinished_heap[0] < frontier.offset):
+            checkpoint = unfinished[unfinished_heap[0]]
+        if persist:
+            save_checkpoint(checkpoint)
+
+    mime_workers = int(cfg.get("mime_workers", 0) or 0)
+    mime_queue_size = int(cfg.get("mime_queue_size", 0) or 0) or max(2 * mime_workers, 1)
+    executor = ProcessPoolExecutor(max_workers=mime_workers) if mime_workers > 0 and not simulated else None
+    if simulated:
+        pipeline = ((item, {"raw": ""}) for item, _ in iter_candidates())
+    else:
+        pipeline = _prefetch_messages(iter_candidates(), executor, mime_queue_size)
+
+    # Retry non bloccanti: (scadenza monotonic, seq, item, messaggio, tentativi falliti nel giro).
+    retry_queue: list = []
+    retry_seq = itertools.count()
+
+    def send_stream():
+        """Nuovi destinatari dalla pipeline, con i retry in coda reinseriti appena scaduti.
+
+        Finché ci sono destinatari nuovi non si attende mai un retry; a pipeline finita
+        si dorme solo fino alla scadenza del primo retry in coda.
+        """
+        while True:
+            # I retry scaduti si controllano prima di prendere il prossimo messaggio dalla pipeline:
+            # se il giro si ferma su un retry non resta un messaggio costruito e mai scartato.
+            while retry_queue and retry_queue[0][0] <= clock.monotonic():
+                due, _, *queued = heapq.heappop(retry_queue)
+                yield tuple(queued)
+            try:
+                item, built = next(pipeline)
+            except StopIteration:
+                break
+            yield item, built, 0
+        while retry_queue:
+            wait = retry_queue[0][0] - clock.monotonic()
+            if wait > 0:
+                report_status(force=wait >= 1, next_send_at=utc_iso(clock.now() + timedelta(seconds=wait)))
+                clock.sleep(wait)
+            due, _, *queued = heapq.heappop(retry_queue)
+            yield tuple(queued)
+
+    global _EVENT_SINK
+    if not simulated:
+        _EVENT_SINK = EventStore(_events_dir(), campaign=campaign, account=cfg.get("account_name", "default"))
+    try:
+        with open(sent_log_path, "a", encoding="utf-8") as logf, \
+                open(sent_threads_path, "a", encoding="utf-8", newline="") as threads_file, \
+                open_journal(os.path.join(logs_dir, JOURNAL_FILENAME)) as journal:
+            # sent_threads.csv è solo in append: più processi possono scriverci insieme.
+            threads_writer = csv.DictWriter(threads_file, fieldnames=["email", "threadId"])
+            if threads_file.tell() == 0:
+                threads_writer.writeheader()
+                threads_file.flush()
+            for (key, email, row_start, row_end), msg, retry_round in send_stream():
+                if retry_round == 0:
+                    advance_checkpoint(row_start)
+
+                failed = False
+                lost = False
+                queued = False
+                try:
+                    while True:
+                        if breaker.state == OPEN and breaker_max_outage > 0 \
+                                and breaker.outage_seconds() > breaker_max_outage:
+                            log_event(
+                                "error",
+                                "circuit_gave_up",
+                                campaign=campaign,
+                                outage_seconds=round(breaker.outage_seconds(), 1),
+                                max_outage_seconds=breaker_max_outage,
+                            )
+                            circuit_aborted = True
+                            break
+                        breaker.wait_ready()
+
+                        # Rinnovo dopo ogni attesa (circuito, limite) e subito prima dell'invio: un'attesa
+                        # più lunga del lease può averlo fatto scadere e passare a un altro processo.
+                        if leases is not None and not leases.renew(key):
+                            log_event("warning", "claim_lost", email=email, campaign=campaign)
+                            lost = True
+                            break
+                        reservation = ledger.reserve(clock.now(), daily_limit, campaign)
+                        if reservation is None:
+                            if not until_done or daily_limit <= 0:
+                                log_event("info", "daily_limit_reached", campaign=campaign, daily_limit=daily_limit)
+                                limit_reached = True
+                                break
+                            resume_at = ledger.next_free_at(clock.now(), daily_limit)
+                            log_event(
+                                "info",
+                                "daily_limit_wait",
+                                campaign=campaign,
+                                daily_limit=daily_limit,
+                                resume_at=utc_iso(resume_at),
+                            )
+                            persist_state(merge=True)
+                            report_status(force=True, state="waiting", next_send_at=utc_iso(resume_at))
+                            clock.sleep(max((resume_at - clock.now()).total_seconds(), 0.001))
+                            continue
+
+                        ts_now = utc_iso(clock.now())
+                        entry = send_state[key]
+                        entry["status"] = "sending"
+                        entry["last_attempt"] = ts_now
+                        entry["attempts"] = entry.get("attempts", 0) + 1
+                        entry.pop("error", None)
+                        persist_state(key)
 
-            msg = make_message(from_email, email, subject, html_body, attachment_path)
+                        log_event(
+                            "info",
+                            "send_attempt",
+                            email=email,
+                            campaign=campaign,
+                            attempt=entry["attempts"],
+                        )
 
-            ts_now = datetime.utcnow().isoformat(timespec="seconds") + "Z"
-            entry = send_state[email]
-            entry["status"] = "sending"
-            entry["last_attempt"] = ts_now
-            entry["attempts"] = entry.get("attempts", 0) + 1
-            entry.pop("error", None)
-            save_send_state(state_path, send_state)
+                        # I retry passano dalla coda, non da sleep inline: una sola richiesta per tentativo.
+                        # Solo un upload media resumable ritenta dentro la sessione (riprende dall'ultimo chunk).
+                        probe = breaker.state == HALF_OPEN
+                        try:
+                            sent = _send_with_backoff(
+                                service,
+                                msg,
+                                max_retry_attempts if "media_path" in msg and not probe else 1,
+                                retry_backoff_initial,
+                                retry_backoff_multiplier,
+                                retry_backoff_max,
+                                resumable=media_resumable,
+                                chunk_size=media_chunk,
+                                clock=clock,
+                                email=email,
+                                campaign=campaign,
+                            )
+                        except Exception as exc:
+                            ledger.release(reservation)
+                            if "draft_id" in msg and _extract_status_code(exc) == 404:
+                                # Bozza cancellata dopo `stage`: si ricostruisce il messaggio completo.
+                                log_event("warning", "draft_missing", email=email, campaign=campaign,
+                                          draft_id=msg["draft_id"])
+                                entry.pop("draft_id", None)
+                                entry["attempts"] -= 1
+                                entry["status"] = "pending"
+                                persist_state(key)
+                                msg = _build_message_job(*msg["fallback_job"])
+                                continue
+                            retryable = _is_retryable_exception(exc)
+                            will_retry = retryable and not probe and retry_round + 1 < max_retry_attempts \
+                                and entry["attempts"] < max_attempts_per_contact
+                            # Il circuit breaker conta i contatti falliti, non i singoli tentativi: un errore
+                            # pesa solo quando i retry del contatto sono finiti (o fallisce la sonda).
+                            if retryable and not will_retry and breaker.record_failure():
+                                # Circuito aperto: l'errore è del servizio, non del contatto,
+                                # quindi il tentativo non viene conteggiato e si riprova dopo la pausa.
+                                entry["attempts"] -= 1
+                                entry["status"] = "pending"
+                                persist_state(key)
+                                continue
+                            if not retryable:
+                                breaker.record_success()
+                            entry["status"] = "error"
+                            entry["error"] = str(exc)
+                            entry["last_error_ts"] = utc_iso(clock.now())
+                            persist_state(key)
+                            if will_retry:
+                                # In coda con backoff: intanto il giro prosegue con gli altri destinatari.
+                                backoff = min(
+                                    max(retry_backoff_initial, 1.0) * max(retry_backoff_multiplier, 1.0) ** retry_round,
+                                    max(retry_backoff_max, retry_backoff_initial, 1.0),
+                                )
+                                retry_in = _with_jitter(backoff)
+                                heapq.heappush(retry_queue, (
+                                    clock.monotonic() + retry_in, next(retry_seq),
+                                    (key, email, row_start, row_end), msg, retry_round + 1,
+                                ))
+                                log_event(
+                                    "warning",
+                                    "send_retry_scheduled",
+                                    email=email,
+                                    campaign=campaign,
+                                    attempt=entry["attempts"],
+                                    max_attempts=max_retry_attempts,
+                                    error=str(exc),
+                                    sleep_seconds=round(retry_in, 2),
+                                    queued=len(retry_queue),
+                                )
+                                queued = True
+                                break
+                            append_journal(journal, entry["last_error_ts"], email, "failed")
+                            log_event(
+                                "error",
+                                "send_failed",
+                                email=email,
+                                campaign=campaign,
+                                error=str(exc),
+                                attempts=entry["attempts"],
+                            )
+                            failed = True
+                            break
+                        ledger.confirm(reservation, clock.now())
+                        breaker.record_success()
+                        break
+                finally:
+                    if not queued:
+                        _discard_message(msg)
+                if circuit_aborted or limit_reached:
+                    mark_unfinished(row_start)
+                    break
+                if queued:
+                    mark_unfinished(row_start)
+                    report_status(state="running")
+                    continue
+                if failed:
+                    error_count += 1
+                    mark_unfinished(row_start)
+                    report_status(state="running")
+                    continue
+                if lost:
+                    # Il destinatario è del nuovo proprietario: la sua entry prevale su quella locale.
+                    owned.discard(key)
+                    latest = leases.entry(key)
+                    if latest is not None:
+                        send_state[key] = latest
+                    mark_unfinished(row_start)
+                    continue
+                success_count += 1
 
-            log_event(
-                "info",
-                "send_attempt",
-                email=email,
-                campaign=campaign,
-                attempt=entry["attempts"],
-            )
+                msg_id = sent.get("id")
+                thread_id = sent.get("threadId")
 
-            try:
-                sent = _send_with_backoff(
-                    service,
-                    msg,
-                    max_retry_attempts,
-                    retry_backoff_initial,
-                    retry_backoff_multiplier,
-                    retry_backoff_max,
-                )
-            except Exception as exc:
-                entry["status"] = "error"
-                entry["error"] = str(exc)
-                entry["last_error_ts"] = datetime.utcnow().isoformat(timespec="seconds") + "Z"
-                save_send_state(state_path, send_state)
-                log_event(
-                    "error",
-                    "send_failed",
-                    email=email,
-                    campaign=campaign,
-                    error=str(exc),
-                    attempts=entry["attempts"],
-                )
-                error_count += 1
-                consecutive_errors += 1
-                if global_error_threshold > 0 and consecutive_errors >= global_error_threshold:
-                    if global_error_cooldown > 0:
+                if label_id and msg_id:
+                    try:
+                        add_labels(service, msg_id, [label_id])
+                    except Exception as e:
                         log_event(
                             "warning",
-                            "global_cooldown",
-                            consecutive_errors=consecutive_errors,
-                            cooldown_seconds=global_error_cooldown,
+                            "label_apply_failed",
+                            email=email,
+                            label=label_name,
+                            error=str(e),
                         )
-                    time.sleep(global_error_cooldown)
-                consecutive_errors = 0
-                continue
-            consecutive_errors = 0
-            success_count += 1
-
-            msg_id = sent.get("id")
-            thread_id = sent.get("threadId")
-
-            if label_id and msg_id:
-                try:
-                    add_labels(service, msg_id, [label_id])
-                except Exception as e:
-                    log_event(
-                        "warning",
-                        "label_apply_failed",
-                        email=email,
-                        label=label_name,
-                        error=str(e),
-                    )
 
-            logf.write(email + "\n")
-            logf.flush()
-            sent_set.add(email)
+                logf.write(email + "\n")
+                logf.flush()
+                sent_set.add(key)
 
-            sent_threads.append({"email": email, "threadId": thread_id})
-            with open(sent_threads_path, "w", encoding="utf-8", newline="") as tf:
-                writer = csv.DictWriter(tf, fieldnames=["email", "threadId"])
-                writer.writeheader()
-                writer.writerows(sent_threads)
+                threads_writer.writerow({"email": email, "threadId": thread_id})
+                threads_file.flush()
 
-            entry["status"] = "sent"
-            entry["message_id"] = msg_id
-            entry["thread_id"] = thread_id
-            entry["last_success_ts"] = datetime.utcnow().isoformat(timespec="seconds") + "Z"
-            save_send_state(state_path, send_state)
+                entry["status"] = "sent"
+                entry["message_id"] = msg_id
+                entry["thread_id"] = thread_id
+                entry["last_success_ts"] = utc_iso(clock.now())
+                from_draft = entry.pop("draft_id", None) is not None
+                persist_state(key)
+                if leases is not None:
+                    leases.complete(key)
+                append_journal(journal, entry["last_success_ts"], email, "sent", msg_id, thread_id)
 
-            log_event(
-                "info",
-                "send_success",
-                email=email,
-                campaign=campaign,
-                message_id=msg_id,
-                thread_id=thread_id,
-                attempt=entry["attempts"],
-            )
-
-            sent_today += 1
-            batch_counter += 1
-            if sent_today >= daily_limit:
                 log_event(
                     "info",
-                    "daily_limit_reached",
+                    "send_success",
+                    email=email,
                     campaign=campaign,
-                    daily_limit=daily_limit,
+                    message_id=msg_id,
+                    thread_id=thread_id,
+                    attempt=entry["attempts"],
+                    from_draft=from_draft,
                 )
-                break
-            time.sleep(delay)
-            if batch_counter >= batch_size:
-                batch_counter = 0
-                if pause_between > 0:
+
+                if retry_round:
+                    mark_finished(row_start)
+                advance_checkpoint(row_end, persist=True)
+
+                batch_counter += 1
+                status_pause = delay + (pause_between if batch_counter >= batch_size else 0)
+                if status is not None:
+                    status.record_send()
+                report_status(
+                    force=status_pause >= 1,
+                    state="running",
+                    next_send_at=utc_iso(clock.now() + timedelta(seconds=status_pause)),
+                )
+                # Senza --until-done ci si ferma se la finestra sarà ancora piena al prossimo invio.
+                if not until_done and ledger.count(clock.now() + timedelta(seconds=delay)) >= daily_limit:
                     log_event(
                         "info",
-                        "batch_pause",
+                        "daily_limit_reached",
                         campaign=campaign,
-                        pause_seconds=pause_between,
+                        daily_limit=daily_limit,
                     )
-                    time.sleep(pause_between)
+                    limit_reached = True
+                    break
+                clock.sleep(delay)
+                if batch_counter >= batch_size:
+                    batch_counter = 0
+                    if pause_between > 0:
+                        log_event(
+                            "info",
+                            "batch_pause",
+                            campaign=campaign,
+                            pause_seconds=pause_between,
+                        )
+                        clock.sleep(pause_between)
+    except BaseException:
+        report_status(force=True, state="interrupted", next_send_at=None)
+        raise
+    finally:
+        # Retry ancora in coda (giro interrotto): restano `error` in state.json e si ritentano al send successivo.
+        for _, _, _, queued_msg, _ in retry_queue:
+            _discard_message(queued_msg)
+        pipeline.close()
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        if _EVENT_SINK is not None:
+            _EVENT_SINK.close()
+            _EVENT_SINK = None
+        if leases is not None:
+            persist_state(merge=True)
+            leases.release_all()
+            leases.close()
+
+    if not limit_reached:
+        advance_checkpoint(reader.position)
+    save_checkpoint(checkpoint)
+    if simulated:
+        send_state.write_json(state_path)
+    if circuit_aborted:
+        report_status(force=True, state="circuit_aborted", next_send_at=None)
+    elif limit_reached:
+        report_status(force=True, state="limit_reached",
+                      next_send_at=utc_iso(ledger.next_free_at(clock.now(), daily_limit)))
+    else:
+        report_status(force=True, state="finished", next_send_at=None)
 
     log_event(
         "info",
@@ -466,9 +1307,254 @@ def cmd_send(args):
         sent=success_count,
         errors=error_count,
         skipped=skipped_by_attempts,
+        duplicates=filter_counters["duplicates"],
+        suppressed=filter_counters["suppressed"],
+        circuit_opens=breaker.opens,
+        circuit_open_seconds=round(breaker.open_time, 1),
+        circuit_aborted=circuit_aborted,
+        claims_taken_over=leases.taken_over if leases is not None else 0,
+    )
+    if global_suppression is not None:
+        global_suppression.close()
+    jobs.close()
+    if own_ledger:
+        ledger.close()
+    return {
+        "sent": success_count,
+        "errors": error_count,
+        "skipped": skipped_by_attempts,
+        "limit_reached": limit_reached,
+        "circuit_opens": breaker.opens,
+        "circuit_open_seconds": round(breaker.open_time, 1),
+        "circuit_aborted": circuit_aborted,
+    }
+
+
+def _simulate_send(args, campaign: str, cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """`send --simulate`: il ciclo reale di invio su orologio virtuale e trasporto finto.
+
+    Lavora su una copia temporanea di logs/<campagna> (stato e checkpoint compresi) e
+    ripete un giro al giorno finché restano destinatari o errori ancora ritentabili.
+    """
+    import contextlib
+    import shutil
+
+    cfg = {**cfg, "tracking_tokens": False}
+    start = datetime.fromisoformat(args.sim_start) if args.sim_start else datetime.utcnow()
+    if start.tzinfo is not None:
+        start = start.astimezone(timezone.utc).replace(tzinfo=None)
+    clock = VirtualClock(start)
+    service = SimulatedGmailService(
+        clock,
+        latency=args.sim_latency,
+        error_rate=args.sim_error_rate,
+        fatal_error_rate=args.sim_fatal_error_rate,
+        seed=args.sim_seed,
+    )
+    if args.sim_seed is not None:
+        random.seed(args.sim_seed)
+    max_attempts_per_contact = int(cfg.get("max_attempts_per_contact", 5))
+    wall_start = time.perf_counter()
+    per_day = []
+    active_seconds = 0.0
+    completed = False
+    with tempfile.TemporaryDirectory(prefix=f"simulate-{campaign}-") as logs_dir:
+        real_logs_dir = os.path.join(DATA_ROOT, "logs", campaign)
+        if os.path.isdir(real_logs_dir):
+            shutil.copytree(real_logs_dir, logs_dir, dirs_exist_ok=True)
+        # Il ledger dell'account parte dagli invii reali delle ultime 24 ore, ma in una copia.
+        sim_ledger_path = os.path.join(logs_dir, "ledger.sim.db")
+        real_ledger_path = ledger_path(_ledger_dir(), cfg.get("account_name", "default"))
+        if os.path.exists(real_ledger_path):
+            real_ledger = SendLedger(real_ledger_path)
+            ledger = real_ledger.snapshot(sim_ledger_path)
+            real_ledger.close()
+        else:
+            ledger = SendLedger(sim_ledger_path)
+        daily_limit = int(cfg.get("daily_send_limit", 100))
+        run_start = clock.now()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            for _ in range(max(args.sim_max_days, 1)):
+                result = _run_send(campaign, cfg, service, logs_dir, clock=clock, simulated=True, ledger=ledger)
+                active_seconds += (clock.now() - run_start).total_seconds()
+                per_day.append({
+                    "date": run_start.date().isoformat(),
+                    "start": utc_iso(run_start),
+                    "end": utc_iso(clock.now()),
+                    "sent": result["sent"],
+                    "errors": result["errors"],
+                    "circuit_opens": result["circuit_opens"],
+                })
+                state = load_send_state(os.path.join(logs_dir, STATE_FILENAME))
+                retry_pending = any(
+                    e.get("status") == "error" and e.get("attempts", 0) < max_attempts_per_contact
+                    for e in state.values()
+                )
+                progressed = result["sent"] + result["errors"] > 0
+                interrupted = result["limit_reached"] or result["circuit_aborted"]
+                if not interrupted and not (retry_pending and progressed):
+                    completed = True
+                    break
+                # Giro successivo: il giorno dopo alla stessa ora, o appena finito se il giro è durato di
+                # più, e comunque non prima che la finestra mobile di 24 ore liberi un invio.
+                run_start = max(run_start + timedelta(days=1), clock.now())
+                run_start = max(run_start, ledger.next_free_at(run_start, daily_limit))
+                clock.advance_to(run_start)
+        ledger.close()
+
+    finish = clock.now()
+    sent = sum(d["sent"] for d in per_day)
+    report = {
+        "campaign": campaign,
+        "start": utc_iso(start),
+        "finish": utc_iso(finish),
+        "duration_hours": round((finish - start).total_seconds() / 3600, 2),
+        "days": len(per_day),
+        "completed": completed,
+        "sent": sent,
+        "errors": sum(d["errors"] for d in per_day),
+        "throughput_per_hour": round(sent * 3600 / active_seconds, 1) if active_seconds else None,
+        "per_day": per_day,
+        "api_calls": service.calls,
+        "wall_seconds": round(time.perf_counter() - wall_start, 3),
+    }
+    log_event("info", "send_simulation_report", **report)
+    return report
+
+
+def cmd_stage(args):
+    campaign = args.campaign
+    cfg = load_config(campaign)
+    service = get_service(os.path.join(CREDS_ROOT, cfg.get("account_name", "default")))
+    return _run_stage(
+        campaign, cfg, service, os.path.join(DATA_ROOT, "logs", campaign),
+        limit=getattr(args, "limit", None), restage=getattr(args, "restage", False),
     )
 
 
+def _run_stage(campaign: str, cfg: Dict[str, Any], service, logs_dir: str, limit: int | None = None,
+               restage: bool = False) -> Dict[str, Any]:
+    """Crea in anticipo le bozze Gmail (`drafts.create`) dei destinatari ancora da inviare.
+
+    Render e upload del messaggio completo avvengono qui, fuori dalla finestra di
+    invio; l'id della bozza finisce in state.json (`draft_id`) e `send` chiama solo
+    `drafts.send`. Non consuma il limite giornaliero e non sposta il checkpoint.
+    I destinatari sono presi con lo stesso lease di `send`, che quindi può girare
+    in parallelo; con `restage` le bozze esistenti vengono cancellate e ricreate
+    (es. dopo una modifica al template).
+    """
+    max_retry_attempts = int(cfg.get("max_retry_attempts", 3))
+    retry_backoff_initial = float(cfg.get("retry_backoff_initial_seconds", 5))
+    retry_backoff_multiplier = float(cfg.get("retry_backoff_multiplier", 2))
+    retry_backoff_max = float(cfg.get("retry_backoff_max_seconds", 60))
+    max_attempts_per_contact = int(cfg.get("max_attempts_per_contact", 5))
+    media_resumable = bool(cfg.get("media_upload_resumable", True))
+    media_chunk = int(cfg.get("media_upload_chunk_bytes", DEFAULT_MEDIA_CHUNK_BYTES))
+
+    jobs = _MessageJobs(campaign, cfg)
+    recipients_path = _recipients_path(campaign, cfg)
+    os.makedirs(logs_dir, exist_ok=True)
+    state_path = os.path.join(logs_dir, STATE_FILENAME)
+    normalize = make_normalizer(cfg)
+    send_state = StateTable.load(state_path, normalize)
+    state_stamp = file_stamp(state_path)
+    leases = open_lease_store(logs_dir, float(cfg.get("claim_lease_seconds", DEFAULT_LEASE_SECONDS)))
+    for key, entry in leases.unmerged_entries():
+        send_state[key] = entry
+    owned = set()
+    state_merge_interval = float(cfg.get("state_merge_interval_seconds", DEFAULT_STATE_MERGE_SECONDS))
+    last_state_merge = time.monotonic()
+    suppressed = load_campaign_suppressions(logs_dir, normalize)
+    global_suppression = _open_global_suppression() if cfg.get("use_global_suppression", True) else None
+
+    def is_suppressed(key: str, email: str) -> bool:
+        return key in suppressed or (global_suppression is not None and email in global_suppression)
+
+    counters = {"duplicates": 0, "suppressed": 0}
+    staged = already_staged = errors = 0
+    log_event("info", "campaign_stage_start", campaign=campaign, limit=limit, restage=restage)
+    reader = open_recipient_source(recipients_path, None, _recipient_columns(cfg, jobs.template_html))
+    try:
+        for key, email, row in _iter_unique_recipients(reader, normalize, is_suppressed, counters):
+            if limit is not None and staged >= limit:
+                break
+            entry = send_state.get(key)
+            if entry is not None:
+                if entry.get("status") == "sent":
+                    continue
+                if entry.get("draft_id") and not restage:
+                    already_staged += 1
+                    continue
+                if entry.get("status") == "error" and entry.get("attempts", 0) >= max_attempts_per_contact:
+                    continue
+            if leases.claim(key) != CLAIMED:
+                continue
+            owned.add(key)
+            latest = leases.entry(key)
+            if latest is not None:
+                send_state[key] = latest
+                entry = send_state[key]
+            if entry is None:
+                send_state[key] = {"status": "pending", "attempts": 0}
+                entry = send_state[key]
+
+            if entry.get("draft_id"):
+                try:
+                    service.users().drafts().delete(userId="me", id=entry["draft_id"]).execute()
+                except Exception as exc:
+                    if _extract_status_code(exc) != 404:
+                        log_event("warning", "draft_delete_failed", email=email, campaign=campaign, error=str(exc))
+                        continue
+                entry.pop("draft_id", None)
+
+            msg = _build_message_job(*jobs.job(entry, email, row))
+            try:
+                draft = _send_with_backoff(
+                    service,
+                    msg,
+                    max_retry_attempts,
+                    retry_backoff_initial,
+                    retry_backoff_multiplier,
+                    retry_backoff_max,
+                    resumable=media_resumable,
+                    chunk_size=media_chunk,
+                    draft=True,
+                    email=email,
+                    campaign=campaign,
+                )
+            except Exception as exc:
+                errors += 1
+                log_event("error", "stage_failed", email=email, campaign=campaign, error=str(exc))
+                continue
+            finally:
+                _discard_message(msg)
+            entry["draft_id"] = draft["id"]
+            entry["staged_ts"] = utc_iso(datetime.utcnow())
+            leases.save_entry(key, entry)
+            if time.monotonic() - last_state_merge >= state_merge_interval:
+                state_stamp = _merge_save_state(state_path, send_state, owned, normalize, state_stamp, leases)
+                last_state_merge = time.monotonic()
+            staged += 1
+            log_event("info", "draft_staged", email=email, campaign=campaign, draft_id=draft["id"])
+    finally:
+        _merge_save_state(state_path, send_state, owned, normalize, state_stamp, leases)
+        leases.release_all()
+        leases.close()
+        jobs.close()
+        if global_suppression is not None:
+            global_suppression.close()
+
+    result = {
+        "staged": staged,
+        "already_staged": already_staged,
+        "errors": errors,
+        "duplicates": counters["duplicates"],
+        "suppressed": counters["suppressed"],
+    }
+    log_event("info", "campaign_stage_complete", campaign=campaign, **result)
+    return result
+
+
 def cmd_send_test(args):
     campaign = args.campaign
     test_email = args.to.strip()
@@ -481,7 +1567,7 @@ def cmd_send_test(args):
 
     from_email = cfg.get("send_as_email") or cfg["from_email"]
     subject_tpl = cfg.get("subject", "Campagna")
-    recipients_csv = os.path.join(CAMPAIGNS_DIR, campaign, "recipients.csv")
+    recipients_path = _recipients_path(campaign, cfg)
     template_html = os.path.join(CAMPAIGNS_DIR, campaign, "template.html")
 
     default_attachment_path = _normalize_attachment_path(cfg.get("default_attachment_path"))
@@ -495,16 +1581,22 @@ def cmd_send_test(args):
     retry_backoff_multiplier = float(cfg.get("retry_backoff_multiplier", 2))
     retry_backoff_max = float(cfg.get("retry_backoff_max_seconds", 60))
 
-    row = _load_first_recipient_row(recipients_csv)
+    row = _load_first_recipient_row(recipients_path, _recipient_columns(cfg, template_html))
     original_email = row.get("email", "").strip() or test_email
 
-    tracking_pixel_url = ""
-    if track_opens and tracking_base:
-        tracking_pixel_url = f"{tracking_base}&cid={campaign}&to={original_email}"
-
-    unsubscribe_url = ""
-    if unsubscribe_enabled and unsubscribe_base:
-        unsubscribe_url = f"{unsubscribe_base}&email={original_email}"
+    tracking_base = tracking_base if track_opens else ""
+    unsubscribe_base = unsubscribe_base if unsubscribe_enabled else ""
+    token = None
+    if cfg.get("tracking_tokens", True) and (tracking_base or unsubscribe_base):
+        # Il token del test punta al destinatario reale del test, non alla riga del CSV.
+        tracking_id = new_tracking_id()
+        token_index = open_token_index(_tracking_dir())
+        token_index.add(tracking_id, campaign, test_email)
+        token_index.close()
+        token = make_token(load_tracking_secret(_tracking_dir()), tracking_id)
+    tracking_pixel_url, unsubscribe_url = _build_tracking_urls(
+        campaign, original_email, tracking_base, unsubscribe_base, token,
+    )
 
     ctx = {
         **row,
@@ -513,11 +1605,15 @@ def cmd_send_test(args):
         "email": original_email,
     }
     html_body = render_template(template_html, ctx)
-    subject = Template(subject_tpl).render(**row)
+    subject = render_string(subject_tpl, row)
 
     attachment_path = _normalize_attachment_path(row.get("attachment_path", "")) or default_attachment_path
 
-    msg = make_message(from_email, test_email, subject, html_body, attachment_path)
+    media_threshold = int(cfg.get("media_upload_threshold_bytes", DEFAULT_MEDIA_UPLOAD_THRESHOLD) or 0)
+    if media_threshold > 0 and _estimate_message_size(html_body, attachment_path) > media_threshold:
+        msg = make_media_message(from_email, test_email, subject, html_body, attachment_path)
+    else:
+        msg = make_message(from_email, test_email, subject, html_body, attachment_path)
 
     log_event(
         "info",
@@ -535,6 +1631,10 @@ def cmd_send_test(args):
             retry_backoff_initial,
             retry_backoff_multiplier,
             retry_backoff_max,
+            resumable=bool(cfg.get("media_upload_resumable", True)),
+            chunk_size=int(cfg.get("media_upload_chunk_bytes", DEFAULT_MEDIA_CHUNK_BYTES)),
+            email=test_email,
+            campaign=campaign,
         )
     except Exception as exc:
         log_event(
@@ -545,6 +1645,8 @@ def cmd_send_test(args):
             error=str(exc),
         )
         raise
+    finally:
+        _discard_message(msg)
 
     log_event(
         "info",
@@ -556,18 +1658,40 @@ def cmd_send_test(args):
     )
 
 
+def _probe_sheet_header(sheets_service, sheet_id: str, sheet_name: str, expected: list) -> Dict[str, Any]:
+    """Legge la riga di intestazione di un tab e segnala le colonne attese mancanti."""
+    resp = sheets_service.spreadsheets().values().get(spreadsheetId=sheet_id, range=f"{sheet_name}!1:1").execute()
+    header = [str(h).strip() for h in (resp.get("values") or [[]])[0]]
+    return {"sheet": sheet_name, "header": header, "missing_columns": [c for c in expected if header and c not in header]}
+
+
 def cmd_preflight(args):
     campaign = args.campaign
     cfg = load_config(campaign)
+    started = time.perf_counter()
 
     creds_dir = os.path.join(CREDS_ROOT, cfg.get("account_name", "default"))
-    recipients_csv = os.path.join(CAMPAIGNS_DIR, campaign, "recipients.csv")
+    recipients_path = _recipients_path(campaign, cfg)
     template_html = os.path.join(CAMPAIGNS_DIR, campaign, "template.html")
+    logs_dir = os.path.join(DATA_ROOT, "logs", campaign)
     default_attachment_path = _normalize_attachment_path(cfg.get("default_attachment_path"))
+    workers = int(getattr(args, "workers", 0) or 0) or os.cpu_count() or 1
+    sample_size = int(getattr(args, "sample", 0) or 0)
 
     template_exists = os.path.exists(template_html)
+    renderer = None
     if not template_exists:
         log_event("error", "preflight_template_missing", campaign=campaign, template_path=template_html)
+    else:
+        with open(template_html, "r", encoding="utf-8") as f:
+            body_source = f.read()
+        subject_source = cfg.get("subject", "Campagna")
+        try:
+            _strict_template(body_source)
+            _strict_template(subject_source)
+            renderer = _PreflightRenderer(body_source, subject_source, workers)
+        except Exception as exc:
+            log_event("error", "preflight_template_error", campaign=campaign, error=f"{type(exc).__name__}: {exc}")
 
     default_attachment_ok = None
     if default_attachment_path:
@@ -580,31 +1704,79 @@ def cmd_preflight(args):
                 attachment_path=default_attachment_path,
             )
 
-    recipient_stats = {"total": 0, "missing_email": 0, "attachment_missing": [], "attachment_ok": set()}
+    track_opens = bool(cfg.get("track_opens", False))
+    tracking_base = (cfg.get("tracking_base_url") or "").rstrip("/") if track_opens else ""
+    unsubscribe_base = (cfg.get("unsubscribe_base_url") or "").rstrip("/") if cfg.get("unsubscribe_enabled") else ""
+    sample = []
+    sample_rng = random.Random(0)
+    sample_seen = 0
+
+    def on_row(row_number: int, email: str, row: Dict[str, Any]) -> None:
+        nonlocal sample_seen
+        if renderer is None:
+            return
+        item = (row_number, row, *_build_tracking_urls(campaign, email, tracking_base, unsubscribe_base, None))
+        if not sample_size:
+            renderer.add(item)
+            return
+        # Reservoir sampling: campione uniforme senza conoscere in anticipo il numero di righe.
+        sample_seen += 1
+        if len(sample) < sample_size:
+            sample.append(item)
+        else:
+            slot = sample_rng.randrange(sample_seen)
+            if slot < sample_size:
+                sample[slot] = item
+
+    normalize = make_normalizer(cfg)
+    excluded = set(load_campaign_suppressions(logs_dir, normalize))
+    state_path = os.path.join(logs_dir, STATE_FILENAME)
+    excluded.update(StateTable.load(state_path, normalize).keys_with_status("sent"))
+
+    global_suppression = _open_global_suppression()
+    recipient_stats = {
+        "total": 0, "missing_email": 0, "suppressed": 0, "duplicates": 0, "excluded": 0, "eligible": 0,
+        "attachment_missing": {}, "attachment_ok": set(), "attachment_bytes": 0, "max_attachment_bytes": 0,
+    }
     try:
-        recipient_stats = _summarize_recipients(recipients_csv, default_attachment_path)
+        recipient_stats = _summarize_recipients(
+            recipients_path, default_attachment_path, global_suppression, normalize, excluded, on_row,
+            _recipient_columns(cfg, template_html),
+        )
     except FileNotFoundError:
-        log_event("error", "preflight_recipients_missing", campaign=campaign, recipients_path=recipients_csv)
+        log_event("error", "preflight_recipients_missing", campaign=campaign, recipients_path=recipients_path)
 
-    for missing_path in recipient_stats["attachment_missing"]:
+    for missing_path, rows in recipient_stats["attachment_missing"].items():
         log_event(
             "warning",
             "preflight_attachment_missing",
             campaign=campaign,
             attachment_path=missing_path,
+            rows=rows,
         )
 
+    render = None
+    if renderer is not None:
+        for item in sample:
+            renderer.add(item)
+        render = renderer.finish()
+        for sample_error in render["error_samples"]:
+            log_event("error", "preflight_render_error", campaign=campaign, **sample_error)
+
     sheet_status = "skipped"
     sheet_error = None
+    sheet_headers = []
     if cfg.get("track_opens") and cfg.get("sheet_id"):
-        sheet_name = cfg.get("sheet_opens_name", "opens")
+        probes = [(cfg.get("sheet_opens_name", "opens"), ["ts", "cid", "to", "ua", "ip"])]
+        if cfg.get("unsubscribe_enabled") or float(cfg.get("unsubs_refresh_seconds", 0) or 0) > 0:
+            probes.append((cfg.get("sheet_unsubs_name", "unsubs"), ["ts", "email"]))
         try:
             sheets_service = get_sheets_service(creds_dir)
-            request = sheets_service.spreadsheets().values().get(
-                spreadsheetId=cfg["sheet_id"],
-                range=f"{sheet_name}!A1:A1",
-            )
-            request.execute()
+            for sheet_name, expected in probes:
+                probe = _probe_sheet_header(sheets_service, cfg["sheet_id"], sheet_name, expected)
+                sheet_headers.append(probe)
+                if probe["missing_columns"]:
+                    log_event("warning", "preflight_sheet_header_mismatch", campaign=campaign, **probe)
             sheet_status = "ok"
         except Exception as exc:
             sheet_status = "error"
@@ -617,20 +1789,44 @@ def cmd_preflight(args):
                 error=sheet_error,
             )
 
+    eligible = recipient_stats["eligible"]
+    daily_limit = int(cfg.get("daily_send_limit", 100)) or 1
+    payload_bytes = None
+    if render and render["rendered"]:
+        # Corpo HTML e allegati viaggiano in base64 (4/3) più ~1 KiB di intestazioni per messaggio.
+        avg_body = render["body_bytes"] / render["rendered"]
+        payload_bytes = int(eligible * (avg_body * 4 / 3 + 1024) + recipient_stats["attachment_bytes"] * 4 / 3)
+
     summary = {
         "campaign": campaign,
         "from_email": cfg.get("send_as_email") or cfg.get("from_email"),
         "subject": cfg.get("subject", ""),
         "total_recipients": recipient_stats["total"],
         "missing_email_rows": recipient_stats["missing_email"],
-        "attachment_missing": len(recipient_stats["attachment_missing"]),
+        "duplicate_rows": recipient_stats["duplicates"],
+        "globally_suppressed": recipient_stats["suppressed"],
+        "global_suppression_size": len(global_suppression),
+        "already_sent_or_suppressed": recipient_stats["excluded"],
+        "projected_sends": eligible,
+        "projected_days": -(-eligible // daily_limit),
+        "projected_payload_bytes": payload_bytes,
+        "max_attachment_bytes": recipient_stats["max_attachment_bytes"],
+        "attachment_missing": sum(recipient_stats["attachment_missing"].values()),
         "attachment_ok": len(recipient_stats["attachment_ok"]),
         "default_attachment_present": default_attachment_ok,
         "template_exists": template_exists,
+        "rendered_rows": render["rendered"] if render else 0,
+        "render_errors": render["errors"] if render else None,
+        "render_sampled": bool(sample_size),
+        "max_body_bytes": render["max_body_bytes"] if render else None,
         "sheet_status": sheet_status,
+        "elapsed_seconds": round(time.perf_counter() - started, 3),
     }
+    if sheet_headers:
+        summary["sheet_headers"] = sheet_headers
     if sheet_error:
         summary["sheet_error"] = sheet_error
+    global_suppression.close()
 
     log_event("info", "preflight_summary", **summary)
 
@@ -644,6 +1840,19 @@ def cmd_list(args):
         if os.path.isdir(path):
             print(name)
 
+def _map_threaded(fn, items: list, cfg: Dict[str, Any]):
+    """Applica `fn` in parallelo (thread, `api_workers` da config) mantenendo l'ordine degli input.
+
+    Il servizio Gmail usa un pool di connessioni HTTP: ogni thread prende la sua
+    connessione keep-alive, quindi le chiamate concorrenti sono sicure.
+    """
+    workers = int(cfg.get("api_workers", 8) or 1)
+    if workers <= 1 or len(items) <= 1:
+        return map(fn, items)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(fn, items))
+
+
 def cmd_check_bounces(args):
     campaign = args.campaign
     cfg = load_config(campaign)
@@ -658,29 +1867,87 @@ def cmd_check_bounces(args):
     os.makedirs(logs_dir, exist_ok=True)
     bounces_csv = os.path.join(logs_dir, "bounces.csv")
 
-    import re, base64
+    import base64
+
+    existing = read_bounces(bounces_csv)
+    processed = {r["bounce_message_id"] for r in existing if r.get("bounce_message_id")}
+    new_ids = [m["id"] for m in msgs if m["id"] not in processed]
+    max_raw = int(cfg.get("bounce_raw_max_bytes", RAW_FETCH_MAX_BYTES))
+
+    def fetch(message_id: str):
+        # Prima i soli metadati (header, thread, dimensione): il raw serve solo per il DSN
+        # e si scarica quando il bounce non include un originale troppo pesante.
+        meta = service.users().messages().get(
+            userId="me", id=message_id, format="metadata", metadataHeaders=METADATA_HEADERS,
+        ).execute()
+        bounces = []
+        if int(meta.get("sizeEstimate") or 0) <= max_raw:
+            raw = service.users().messages().get(userId="me", id=message_id, format="raw").execute()
+            bounces = parse_dsn(base64.urlsafe_b64decode(raw["raw"]))
+        if not bounces:
+            bounces = bounces_from_headers(meta.get("payload", {}).get("headers", []))
+        return meta, bounces
+
+    logs_state = load_send_state(os.path.join(logs_dir, STATE_FILENAME))
+    sent_threads_path = os.path.join(logs_dir, "sent_threads.csv")
+    sent_threads = []
+    if os.path.exists(sent_threads_path):
+        with open(sent_threads_path, "r", encoding="utf-8") as f:
+            sent_threads = list(csv.DictReader(f))
+    thread_index = build_thread_index(logs_state, sent_threads)
+
     rows = []
-    for m in msgs:
-        full = service.users().messages().get(userId="me", id=m["id"], format="full").execute()
-        payload = full.get("payload", {})
-        parts = payload.get("parts", []) or []
-        bodies = []
-        if "body" in payload and payload["body"].get("data"):
-            bodies.append(base64.urlsafe_b64decode(payload["body"]["data"]).decode(errors="ignore"))
-        for p in parts:
-            if p.get("mimeType", "").startswith("text/"):
-                data = p.get("body", {}).get("data")
-                if data:
-                    bodies.append(base64.urlsafe_b64decode(data).decode(errors="ignore"))
-        text = "\n".join(bodies)
-        m_emails = re.findall(r"[Ff]inal-Recipient:\s*rfc822;\s*([^\s]+)", text)
-        if m_emails:
-            rows.append({"bounced_email": m_emails[0]})
-    with open(bounces_csv, "w", encoding="utf-8", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=["bounced_email"])
-        w.writeheader()
-        w.writerows(rows)
-    print(f"Salvati bounce in {bounces_csv} ({len(rows)} trovati)")
+    for meta, bounces in _map_threaded(fetch, new_ids, cfg):
+        thread_id = meta.get("threadId") or ""
+        original_email, message_id = thread_index.get(thread_id, ("", ""))
+        internal = meta.get("internalDate")
+        ts = utc_iso(datetime.utcfromtimestamp(int(internal) / 1000)) if internal else ""
+        if not bounces and original_email:
+            # Nessun DSN leggibile ma il bounce è nel thread di un nostro invio.
+            bounces = [Bounce(original_email, HARD, "", "failed", "")]
+        for bounce in bounces:
+            rows.append({
+                "bounced_email": bounce.recipient,
+                "kind": bounce.kind,
+                "status": bounce.status,
+                "action": bounce.action,
+                "diagnostic": bounce.diagnostic,
+                "message_id": message_id if thread_id in thread_index else "",
+                "thread_id": thread_id if thread_id in thread_index else "",
+                "bounce_message_id": meta.get("id", ""),
+                "ts": ts,
+            })
+        if not bounces:
+            log_event("warning", "bounce_unparsed", campaign=campaign, bounce_message_id=meta.get("id"))
+
+    # Le righe di versioni precedenti (senza bounce_message_id) vengono sostituite da quelle nuove.
+    new_emails = {r["bounced_email"].strip().lower() for r in rows}
+    kept = [r for r in existing if r.get("bounce_message_id") or r["bounced_email"].strip().lower() not in new_emails]
+    known = {r["bounced_email"].strip().lower() for r in existing}
+    _record_events("bounce", campaign, cfg.get("account_name", "default"), (
+        {
+            "email": r["bounced_email"], "ts": r["ts"] or None, "message_id": r["message_id"],
+            "thread_id": r["thread_id"], "kind": r["kind"], "status": r["status"],
+        }
+        for r in rows if r["bounced_email"].strip().lower() not in known
+    ))
+    write_bounces(bounces_csv, kept + rows)
+    hard = [r["bounced_email"] for r in rows if is_hard(r)]
+    global_suppression = _open_global_suppression()
+    added = global_suppression.add_many(hard)
+    global_suppression.close()
+    log_event(
+        "info",
+        "bounces_checked",
+        campaign=campaign,
+        fetched=len(new_ids),
+        skipped=len(msgs) - len(new_ids),
+        hard=len(hard),
+        soft=len(rows) - len(hard),
+        correlated=sum(1 for r in rows if r["thread_id"]),
+    )
+    log_event("info", "global_suppression_updated", campaign=campaign, source="bounces", added=added)
+    print(f"Salvati bounce in {bounces_csv} ({len(rows)} nuovi, {len(hard)} hard)")
 
 def cmd_check_replies(args):
     campaign = args.campaign
@@ -699,21 +1966,29 @@ def cmd_check_replies(args):
     profile = service.users().getProfile(userId="me").execute()
     my_email = profile.get("emailAddress", "").lower()
 
-    for _, row in df.iterrows():
-        thread_id = str(row["threadId"])
-        email = row["email"]
-        th = get_thread(service, thread_id)
+    thread_ids = [str(t) for t in df["threadId"]]
+    threads = _map_threaded(lambda thread_id: get_thread(service, thread_id), thread_ids, cfg)
+    for email, th in zip(df["email"], threads):
         messages = th.get("messages", [])
-        someone_else = False
+        reply = None
         for msg in messages[1:]:
             headers = msg.get("payload", {}).get("headers", [])
             frm = next((h["value"] for h in headers if h.get("name")=="From"), "")
             if my_email not in frm.lower():
-                someone_else = True
+                reply = msg
                 break
-        if someone_else:
-            replies.append({"email": email, "replied": True})
+        if reply is not None:
+            # internalDate (ms epoch) della prima risposta: serve al tempo di risposta in `analytics`.
+            internal = reply.get("internalDate")
+            ts = utc_iso(datetime.utcfromtimestamp(int(internal) / 1000)) if internal else ""
+            replies.append({"email": email, "replied": True, "ts": ts})
     replies_csv = os.path.join(logs_dir, "replies.csv")
+    known = set()
+    if os.path.exists(replies_csv) and os.path.getsize(replies_csv) > 1:
+        known = {str(e).strip().lower() for e in pd.read_csv(replies_csv).get("email", [])}
+    _record_events("reply", campaign, cfg.get("account_name", "default"), (
+        {"email": r["email"], "ts": r["ts"] or None} for r in replies if str(r["email"]).strip().lower() not in known
+    ))
     pd.DataFrame(replies).to_csv(replies_csv, index=False)
     print(f"Salvate risposte in {replies_csv} ({len(replies)} trovate)")
 
@@ -747,6 +2022,11 @@ def cmd_fetch_opens(args):
     header = values[0]
     rows = values[1:]
     target_header = ["ts","cid","to","ua","ip"]
+    # Il foglio cresce solo in coda: all'event store vanno le righe oltre quelle già scaricate.
+    known_rows = 0
+    if os.path.exists(out_csv):
+        with open(out_csv, "r", encoding="utf-8") as f:
+            known_rows = max(sum(1 for _ in f) - 1, 0)
     index_map = {name: (header.index(name) if name in header else i) for i, name in enumerate(target_header)}
     with open(out_csv, "w", encoding="utf-8", newline="") as f:
         w = csv.writer(f); w.writerow(target_header)
@@ -756,8 +2036,128 @@ def cmd_fetch_opens(args):
                 idx = index_map[k]
                 out.append(r[idx] if idx < len(r) else "")
             w.writerow(out)
+    new_opens = [
+        {target_header[i]: (r[index_map[k]] if index_map[k] < len(r) else "") for i, k in enumerate(target_header)}
+        for r in rows[known_rows:]
+    ]
+    tokens = [o["to"] for o in new_opens if o["to"] and "@" not in o["to"]]
+    resolved = {}
+    if tokens:
+        token_index = open_token_index(_tracking_dir())
+        resolved = resolve_recipients(tokens, load_tracking_secret(_tracking_dir()), token_index)
+        token_index.close()
+    _record_events("open", campaign, cfg.get("account_name", "default"), (
+        {
+            "ts": _iso_from_epoch(parse_ts(o["ts"])),
+            "email": resolved.get(o["to"], o["to"]),
+            "user_agent": o["ua"],
+        }
+        for o in new_opens
+    ))
     print(f"Open salvati in {out_csv} ({len(rows)} righe)")
 
+def _sync_unsubs(sheets_service, sheet_id: str, sheet_name: str, logs_dir: str) -> list:
+    """Legge solo le righe del foglio unsubs successive al checkpoint e le accoda a unsubs.csv.
+
+    I token che l'indice locale non risolve (emessi da un altro host o prima dell'indice)
+    non si perdono: finiscono in unsubs_unresolved.csv e vengono ritentati a ogni sync,
+    ad esempio dopo aver copiato il tokens.db dell'host che li ha emessi.
+    """
+    os.makedirs(logs_dir, exist_ok=True)
+    checkpoint_path = os.path.join(logs_dir, "unsubs_checkpoint.json")
+    out_csv = os.path.join(logs_dir, "unsubs.csv")
+    unresolved_csv = os.path.join(logs_dir, UNSUBS_UNRESOLVED_FILENAME)
+    checkpoint = {"next_row": 1}
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            checkpoint.update(json.load(f))
+    next_row = int(checkpoint.get("next_row", 1))
+
+    rng = f"{sheet_name}!A{next_row}:B"  # ts,email
+    resp = sheets_service.spreadsheets().values().get(spreadsheetId=sheet_id, range=rng).execute()
+    values = resp.get("values", [])
+
+    new_rows = []
+    for i, r in enumerate(values):
+        if next_row + i == 1 and len(r) > 1 and r[1].strip().lower() == "email":
+            continue
+        email = (r[1] if len(r) > 1 else "").strip()
+        if email:
+            new_rows.append([r[0] if r else "", email, str(next_row + i)])
+
+    previous = []
+    if os.path.exists(unresolved_csv):
+        with open(unresolved_csv, "r", encoding="utf-8", newline="") as f:
+            previous = [[r.get("ts", ""), r.get("token", ""), r.get("sheet_row", "")] for r in csv.DictReader(f)]
+    new_rows = previous + new_rows
+
+    tokens = [row[1] for row in new_rows if "@" not in row[1]]
+    unresolved = []
+    if tokens:
+        token_index = open_token_index(_tracking_dir())
+        resolved = resolve_recipients(tokens, load_tracking_secret(_tracking_dir()), token_index)
+        token_index.close()
+        for row in new_rows:
+            if "@" not in row[1]:
+                if row[1] in resolved:
+                    row[1] = resolved[row[1]]
+                else:
+                    unresolved.append(row)
+        new_rows = [row for row in new_rows if "@" in row[1]]
+    if unresolved or previous:
+        tmp_path = f"{unresolved_csv}.tmp"
+        with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(["ts", "token", "sheet_row"])
+            w.writerows(unresolved)
+        os.replace(tmp_path, unresolved_csv)
+    if unresolved:
+        log_event(
+            "warning",
+            "unsubs_unresolved",
+            sheet=sheet_name,
+            count=len(unresolved),
+            new=sum(1 for row in unresolved if int(row[2] or 0) >= next_row),
+            path=unresolved_csv,
+        )
+
+    if new_rows:
+        write_header = not os.path.exists(out_csv) or os.path.getsize(out_csv) == 0
+        with open(out_csv, "a", encoding="utf-8", newline="") as f:
+            w = csv.writer(f)
+            if write_header:
+                w.writerow(["ts", "email"])
+            w.writerows(row[:2] for row in new_rows)
+        index = _open_global_suppression()
+        index.add_many(row[1] for row in new_rows)
+        index.close()
+
+    checkpoint["next_row"] = next_row + len(values)
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, checkpoint_path)
+    return [row[1] for row in new_rows]
+
+
+def cmd_fetch_unsubs(args):
+    campaign = args.campaign
+    cfg = load_config(campaign)
+    creds_dir = os.path.join(CREDS_ROOT, cfg.get("account_name", "default"))
+    service = get_sheets_service(creds_dir)
+
+    sheet_id = cfg.get("sheet_id")
+    sheet_name = cfg.get("sheet_unsubs_name", "unsubs")
+    if not sheet_id:
+        print("sheet_id non configurato in campaign_config.yaml")
+        return
+
+    logs_dir = os.path.join(DATA_ROOT, "logs", campaign)
+    emails = _sync_unsubs(service, sheet_id, sheet_name, logs_dir)
+    log_event("info", "unsubs_synced", campaign=campaign, new=len(emails))
+    print(f"Unsubscribe salvati in {os.path.join(logs_dir, 'unsubs.csv')} ({len(emails)} nuovi)")
+
+
 def cmd_stats(args):
     campaign = args.campaign
     logs_dir = os.path.join(DATA_ROOT, "logs", campaign)
@@ -765,6 +2165,7 @@ def cmd_stats(args):
     b_csv = os.path.join(logs_dir, "bounces.csv")
     r_csv = os.path.join(logs_dir, "replies.csv")
     o_csv = os.path.join(logs_dir, "opens.csv")
+    o_local_csv = os.path.join(logs_dir, LOCAL_OPENS_FILENAME)
 
     import csv
     sent = []
@@ -777,7 +2178,8 @@ def cmd_stats(args):
         with open(b_csv, "r", encoding="utf-8") as f:
             reader = csv.DictReader(f)
             for r in reader:
-                bounces.add(r["bounced_email"].strip().lower())
+                if is_hard(r):
+                    bounces.add(r["bounced_email"].strip().lower())
 
     replies = set()
     if os.path.exists(r_csv):
@@ -786,14 +2188,23 @@ def cmd_stats(args):
             for r in reader:
                 replies.add(r["email"].strip().lower())
 
-    opens = set()
-    if os.path.exists(o_csv):
-        with open(o_csv, "r", encoding="utf-8") as f:
+    open_refs = set()
+    for path in (o_csv, o_local_csv):
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8") as f:
             reader = csv.DictReader(f)
             for r in reader:
-                to = r.get("to","").strip().lower()
+                to = r.get("to","").strip()
                 if to:
-                    opens.add(to)
+                    open_refs.add(to)
+    opens = {r.lower() for r in open_refs if "@" in r}
+    tokens = [r for r in open_refs if "@" not in r]
+    if tokens:
+        token_index = open_token_index(_tracking_dir())
+        resolved = resolve_recipients(tokens, load_tracking_secret(_tracking_dir()), token_index)
+        token_index.close()
+        opens.update(e.lower() for e in resolved.values())
 
     rows = []
     for e in sent:
@@ -811,6 +2222,105 @@ def cmd_stats(args):
     if args.print:
         print(df.head(30).to_string(index=False))
 
+def cmd_analytics(args):
+    """Aggiorna i rollup incrementali della campagna e li scrive in analytics.json."""
+    campaign = args.campaign
+    logs_dir = os.path.join(DATA_ROOT, "logs", campaign)
+    if not os.path.isdir(logs_dir):
+        print(f"Nessun log per la campagna {campaign}: invia prima la campagna.")
+        return None
+    started = time.perf_counter()
+    store = AnalyticsStore(os.path.join(logs_dir, ANALYTICS_DB_FILENAME))
+
+    def resolve(tokens):
+        token_index = open_token_index(_tracking_dir())
+        try:
+            return resolve_recipients(tokens, load_tracking_secret(_tracking_dir()), token_index)
+        finally:
+            token_index.close()
+
+    def state_sends():
+        """Campagne inviate prima del journal: gli invii noti da state.json entrano una volta sola.
+
+        state.json si legge solo alla prima iterazione, cioè solo se la sorgente non è già stata acquisita.
+        """
+        state = StateTable.load(os.path.join(logs_dir, STATE_FILENAME))
+        for email in state.keys_with_status("sent"):
+            yield email, "sent", parse_ts(state[email].get("last_success_ts", ""))
+
+    new_rows = {
+        STATE_FILENAME: store.ingest_events(STATE_FILENAME, state_sends()),
+        JOURNAL_FILENAME: store.ingest_csv(
+            JOURNAL_FILENAME, os.path.join(logs_dir, JOURNAL_FILENAME), "sent", "email",
+            row_filter=lambda row: row.get("event") == "sent",
+        ),
+    }
+    for filename in ("opens.csv", LOCAL_OPENS_FILENAME):
+        new_rows[filename] = store.ingest_csv(filename, os.path.join(logs_dir, filename), "opened", "to", resolve=resolve)
+    new_rows["replies.csv"] = store.ingest_csv("replies.csv", os.path.join(logs_dir, "replies.csv"), "replied", "email")
+    new_rows["bounces.csv"] = store.ingest_csv(
+        "bounces.csv", os.path.join(logs_dir, "bounces.csv"), "bounced", "bounced_email", row_filter=is_hard,
+    )
+
+    summary = store.summary(campaign)
+    store.close()
+    out_path = os.path.join(logs_dir, ANALYTICS_JSON_FILENAME)
+    write_analytics_json(out_path, summary)
+    log_event(
+        "info",
+        "analytics_updated",
+        campaign=campaign,
+        new_rows=new_rows,
+        totals=summary["totals"],
+        elapsed_ms=round((time.perf_counter() - started) * 1000, 1),
+    )
+    if args.print:
+        print(json.dumps({k: summary[k] for k in ("totals", "rates", "daily")}, ensure_ascii=False, indent=2))
+    return summary
+
+def cmd_status(args):
+    """Stato live delle campagne dagli status.<worker>.json scritti da `send` (uniti se i worker
+    sono più di uno): non legge CSV né state.json."""
+    logs_root = os.path.join(DATA_ROOT, "logs")
+    if args.all:
+        campaigns = sorted(os.listdir(logs_root)) if os.path.isdir(logs_root) else []
+    else:
+        campaigns = [args.campaign]
+    now = datetime.utcnow()
+    statuses = []
+    for campaign in campaigns:
+        current = combine_statuses(read_worker_statuses(os.path.join(logs_root, campaign)), now)
+        if current is None:
+            if not args.all:
+                print(f"{campaign}: nessuno status (send non ancora eseguito)")
+            continue
+        statuses.append(current)
+        print(json.dumps(current, ensure_ascii=False) if args.json else format_status(current, now))
+    return statuses
+
+
+def cmd_export_events(args):
+    """Esporta l'event store (JSONL giornalieri) in Parquet, un file per giorno."""
+    out_dir = args.out or os.path.join(_events_dir(), PARQUET_DIRNAME)
+    written = export_parquet(_events_dir(), out_dir, force=args.force)
+    log_event("info", "events_exported", out_dir=out_dir, files=len(written))
+    print(f"Esportati {len(written)} file Parquet in {out_dir}")
+    return written
+
+def cmd_serve_tracking(args):
+    """Avvia il server locale di tracking (pixel + unsubscribe) al posto della Web App Apps Script."""
+    log_event("info", "tracking_server_start", host=args.host, port=args.port, data_root=DATA_ROOT)
+    run_tracking_server(
+        DATA_ROOT,
+        args.host,
+        args.port,
+        flush_interval=args.flush_interval,
+        batch_size=args.batch_size,
+        log=log_event,
+    )
+    log_event("info", "tracking_server_stop", host=args.host, port=args.port)
+
+
 def main():
     p = argparse.ArgumentParser(description="Email Campaign Manager (Docker)")
     sub = p.add_subparsers()
@@ -822,8 +2332,24 @@ def main():
 
     s1 = sub.add_parser("send", help="Invia una campagna")
     s1.add_argument("--campaign", required=True)
+    s1.add_argument("--simulate", action="store_true",
+                    help="Stima durata e giorni con orologio virtuale e trasporto finto (nessun invio reale)")
+    s1.add_argument("--until-done", action="store_true",
+                    help="Al raggiungimento di daily_send_limit attende che la finestra di 24 ore liberi capacità invece di uscire")
+    s1.add_argument("--sim-start", help="Inizio simulato, ISO 8601 UTC (default: adesso)")
+    s1.add_argument("--sim-latency", type=float, default=0.5, help="Secondi simulati per chiamata API")
+    s1.add_argument("--sim-error-rate", type=float, default=0.0, help="Quota di send con errore 503 ritentabile")
+    s1.add_argument("--sim-fatal-error-rate", type=float, default=0.0, help="Quota di send con errore 400 definitivo")
+    s1.add_argument("--sim-seed", type=int, help="Seed per errori e jitter riproducibili")
+    s1.add_argument("--sim-max-days", type=int, default=365, help="Numero massimo di giorni simulati")
     s1.set_defaults(func=cmd_send)
 
+    s1s = sub.add_parser("stage", help="Crea in anticipo le bozze Gmail dei destinatari ancora da inviare")
+    s1s.add_argument("--campaign", required=True)
+    s1s.add_argument("--limit", type=int, default=None, help="Numero massimo di bozze da creare in questo giro")
+    s1s.add_argument("--restage", action="store_true", help="Cancella e ricrea le bozze già presenti (es. template cambiato)")
+    s1s.set_defaults(func=cmd_stage)
+
     s1b = sub.add_parser("send-test", help="Invia un test usando la prima riga del CSV")
     s1b.add_argument("--campaign", required=True)
     s1b.add_argument("--to", required=True, help="Indirizzo email destinatario del test")
@@ -831,6 +2357,9 @@ def main():
 
     s1c = sub.add_parser("preflight", help="Riepiloga configurazione e controlli campagna")
     s1c.add_argument("--campaign", required=True)
+    s1c.add_argument("--sample", type=int, default=0,
+                     help="Renderizza solo un campione casuale di N righe (default: tutte)")
+    s1c.add_argument("--workers", type=int, default=0, help="Processi per il render di controllo (default: CPU)")
     s1c.set_defaults(func=cmd_preflight)
 
     s2 = sub.add_parser("list", help="Elenca campagne")
@@ -848,11 +2377,39 @@ def main():
     s5.add_argument("--campaign", required=True)
     s5.set_defaults(func=cmd_fetch_opens)
 
+    s5b = sub.add_parser("fetch-unsubs", help="Scarica i nuovi unsubscribe da Google Sheets")
+    s5b.add_argument("--campaign", required=True)
+    s5b.set_defaults(func=cmd_fetch_unsubs)
+
     s6 = sub.add_parser("stats", help="Crea stats.csv unendo sent/bounces/replies/opens")
     s6.add_argument("--campaign", required=True)
     s6.add_argument("--print", action="store_true")
     s6.set_defaults(func=cmd_stats)
 
+    s6b = sub.add_parser("analytics", help="Aggiorna i rollup incrementali (analytics.json) con i soli dati nuovi")
+    s6b.add_argument("--campaign", required=True)
+    s6b.add_argument("--print", action="store_true")
+    s6b.set_defaults(func=cmd_analytics)
+
+    s6s = sub.add_parser("status", help="Avanzamento live di una campagna (o di tutte) dagli status dei worker")
+    s6s_target = s6s.add_mutually_exclusive_group(required=True)
+    s6s_target.add_argument("--campaign")
+    s6s_target.add_argument("--all", action="store_true", help="Tutte le campagne con almeno uno status")
+    s6s.add_argument("--json", action="store_true", help="Stampa lo status unito in JSON")
+    s6s.set_defaults(func=cmd_status)
+
+    s6c = sub.add_parser("export-events", help="Esporta gli eventi di invio/engagement in Parquet (un file per giorno)")
+    s6c.add_argument("--out", help="Cartella di destinazione (default: data/events/parquet)")
+    s6c.add_argument("--force", action="store_true", help="Riesporta anche i giorni già esportati")
+    s6c.set_defaults(func=cmd_export_events)
+
+    s7 = sub.add_parser("serve-tracking", help="Server locale per pixel di apertura e unsubscribe")
+    s7.add_argument("--host", default="0.0.0.0")
+    s7.add_argument("--port", type=int, default=8080)
+    s7.add_argument("--flush-interval", type=float, default=1.0, help="Secondi tra due flush su disco")
+    s7.add_argument("--batch-size", type=int, default=1000, help="Flush anticipato dopo N hit")
+    s7.set_defaults(func=cmd_serve_tracking)
+
     args = p.parse_args()
     if hasattr(args, "func"):
         args.func(args)
@@ -0,0 +1,97 @@
+import base64
+import io
+import os
+import uuid
+from email.generator import BytesGenerator
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import BinaryIO, Iterator
+
+# 57 byte grezzi = una riga base64 da 76 caratteri: blocchi multipli di 57 producono
+# righe complete, identiche a quelle di email.encoders.encode_base64.
+BASE64_LINE_BYTES = 57
+DEFAULT_READ_CHUNK = BASE64_LINE_BYTES * 1024 * 4
+
+
+def iter_base64_lines(fh: BinaryIO, chunk_size: int = DEFAULT_READ_CHUNK) -> Iterator[bytes]:
+    """Codifica in base64 (righe MIME da 76 caratteri) leggendo il file a blocchi."""
+    chunk_size = max(BASE64_LINE_BYTES, chunk_size - chunk_size % BASE64_LINE_BYTES)
+    while True:
+        chunk = fh.read(chunk_size)
+        if not chunk:
+            return
+        yield base64.encodebytes(chunk)
+
+
+def write_message(fp: BinaryIO, sender: str, to: str, subject: str, html_body: str,
+                  attachment_path: str | None, chunk_size: int = DEFAULT_READ_CHUNK) -> int:
+    """Serializza il messaggio multipart su `fp` senza tenere l'allegato in memoria.
+
+    Intestazioni, boundary e parte HTML sono generate dal pacchetto `email` su uno
+    scheletro con un segnaposto al posto dell'allegato; il contenuto del file viene
+    poi codificato e scritto a blocchi. Ritorna il numero di byte scritti.
+    """
+    msg = MIMEMultipart()
+    msg["To"] = to
+    msg["From"] = sender
+    msg["Subject"] = subject
+    msg.attach(MIMEText(html_body, "html", "utf-8"))
+
+    marker = None
+    if attachment_path:
+        marker = f"ATTACHMENT-{uuid.uuid4().hex}"
+        part = MIMEBase("application", "octet-stream")
+        part.set_payload(marker)
+        part["Content-Transfer-Encoding"] = "base64"
+        filename = os.path.basename(attachment_path)
+        part.add_header("Content-Disposition", f'attachment; filename="{filename}"')
+        msg.attach(part)
+
+    skeleton = io.BytesIO()
+    BytesGenerator(skeleton, mangle_from_=False).flatten(msg)
+    head = skeleton.getvalue()
+    written = 0
+    if marker is None:
+        fp.write(head)
+        return len(head)
+
+    before, after = head.split(marker.encode("ascii"), 1)
+    fp.write(before)
+    written += len(before)
+    with open(attachment_path, "rb") as fh:
+        for block in iter_base64_lines(fh, chunk_size):
+            fp.write(block)
+            written += len(block)
+    # encodebytes chiude già l'ultima riga: evitiamo una riga vuota in più.
+    if after.startswith(b"\n"):
+        after = after[1:]
+    fp.write(after)
+    return written + len(after)
+
+
+class UrlsafeBase64Writer:
+    """File-like che codifica in base64url ciò che riceve e lo scrive su `fp` a blocchi.
+
+    Serve a produrre il campo `raw` di messages.send senza materializzare prima
+    l'intero messaggio RFC 822: resta in memoria solo l'output codificato.
+    """
+
+    def __init__(self, fp: BinaryIO):
+        self.fp = fp
+        self._tail = b""
+
+    def write(self, data: bytes) -> int:
+        size = len(data)
+        if self._tail:
+            data = self._tail + bytes(data)
+        cut = len(data) - len(data) % 3
+        self._tail = bytes(data[cut:])
+        if cut:
+            self.fp.write(base64.urlsafe_b64encode(memoryview(data)[:cut]))
+        return size
+
+    def close(self) -> None:
+        if self._tail:
+            self.fp.write(base64.urlsafe_b64encode(self._tail))
+            self._tail = b""
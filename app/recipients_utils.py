@@ -0,0 +1,314 @@
+import csv
+import json
+import os
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+RESUME_FILENAME = "resume.json"
+RECIPIENT_FILENAMES = ("recipients.csv", "recipients.jsonl", "recipients.parquet", "recipients.arrow")
+COLUMNAR_EXTENSIONS = (".parquet", ".arrow", ".feather")
+# Colonne sempre lette: servono a send anche se il template non le usa.
+REQUIRED_COLUMNS = ("email", "attachment_path")
+ARROW_BATCH_ROWS = 10_000
+_CRC_CHUNK = 1024 * 1024
+
+
+class Position(NamedTuple):
+    """Punto del file: offset in byte, righe dati lette prima di esso e CRC32 dei byte precedenti."""
+    offset: int
+    row: int
+    crc: int
+
+
+def file_fingerprint(path: str) -> Dict[str, int]:
+    st = os.stat(path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "ino": st.st_ino}
+
+
+def crc32_prefix(path: str, length: int) -> int:
+    crc = 0
+    remaining = length
+    with open(path, "rb") as f:
+        while remaining > 0:
+            chunk = f.read(min(_CRC_CHUNK, remaining))
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+            remaining -= len(chunk)
+    return crc
+
+
+def is_columnar(path: str) -> bool:
+    return path.lower().endswith(COLUMNAR_EXTENSIONS)
+
+
+def find_recipients_file(campaign_dir: str, configured: Optional[str] = None) -> str:
+    """File destinatari della campagna: `recipients_file` da config, altrimenti il primo esistente."""
+    if configured:
+        return configured if os.path.isabs(configured) else os.path.join(campaign_dir, configured)
+    for name in RECIPIENT_FILENAMES:
+        path = os.path.join(campaign_dir, name)
+        if os.path.exists(path):
+            return path
+    return os.path.join(campaign_dir, RECIPIENT_FILENAMES[0])
+
+
+def template_columns(*sources: str) -> Optional[set]:
+    """Variabili referenziate dai template (corpo, oggetto): le sole colonne da leggere.
+
+    Ritorna None se un template non è analizzabile: in quel caso si leggono tutte le colonne.
+    """
+    from jinja2 import Environment, meta
+
+    env = Environment()
+    columns = set(REQUIRED_COLUMNS)
+    for source in sources:
+        try:
+            columns |= meta.find_undeclared_variables(env.parse(source))
+        except Exception:
+            return None
+    return columns
+
+
+class _RecipientReader:
+    """Base comune: dopo ogni riga prodotta `row_start`/`row_end` descrivono la posizione del
+    record appena letto, così chi consuma può salvare un checkpoint e ripartire da lì.
+
+    Con `columns` le righe contengono solo quelle colonne (se presenti nel file).
+    """
+
+    def __init__(self, path: str, start: Optional[Position] = None, columns: Optional[Iterable[str]] = None):
+        self.path = path
+        self.start = start
+        self.columns = set(columns) if columns is not None else None
+        self.fieldnames: list = []
+        self.row_start: Optional[Position] = None
+        self.row_end: Optional[Position] = None
+        self.position: Optional[Position] = None
+
+    def _project(self, names: List[str]) -> List[str]:
+        if self.columns is None:
+            return list(names)
+        return [n for n in names if n in self.columns]
+
+
+class _LineReader(_RecipientReader):
+    """Formati testuali a righe: offset in byte e CRC32 dei byte letti, come per i checkpoint."""
+
+    def _lines(self, f):
+        while True:
+            raw = f.readline()
+            if not raw:
+                return
+            self._offset += len(raw)
+            self._crc = zlib.crc32(raw, self._crc)
+            yield raw.decode("utf-8-sig" if self._offset == len(raw) else "utf-8")
+
+    def _seek_start(self, f, row_number: int) -> int:
+        if self.start is not None and self.start.offset > self._offset:
+            f.seek(self.start.offset)
+            self._offset, row_number, self._crc = self.start
+        return row_number
+
+    def _advance(self, row_number: int) -> None:
+        self.row_start = self.position
+        self.position = self.row_end = Position(self._offset, row_number, self._crc)
+
+
+class CsvRecipientReader(_LineReader):
+    """Legge un CSV di destinatari sapendo, per ogni riga, dove inizia e finisce nel file."""
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        with open(self.path, "rb") as f:
+            self._offset = 0
+            self._crc = 0
+            reader = csv.reader(self._lines(f))
+            header = next(reader, [])
+            self.fieldnames = self._project(header)
+            keep = [(i, name) for i, name in enumerate(header) if name in self.fieldnames]
+            row_number = self._seek_start(f, 0)
+            self.position = Position(self._offset, row_number, self._crc)
+            for values in reader:
+                row_number += 1
+                self._advance(row_number)
+                if not values:
+                    continue
+                if len(values) >= len(header):
+                    yield {name: values[i] for i, name in keep}
+                else:
+                    # Riga corta: come csv.DictReader, le colonne mancanti valgono None.
+                    yield {name: (values[i] if i < len(values) else None) for i, name in keep}
+
+
+class JsonlRecipientReader(_LineReader):
+    """Un oggetto JSON per riga; le righe vuote sono ignorate."""
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        with open(self.path, "rb") as f:
+            self._offset = 0
+            self._crc = 0
+            row_number = self._seek_start(f, 0)
+            self.position = Position(self._offset, row_number, self._crc)
+            seen_fields: Dict[str, None] = {}
+            for line in self._lines(f):
+                row_number += 1
+                self._advance(row_number)
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if self.columns is not None:
+                    record = {k: v for k, v in record.items() if k in self.columns}
+                for key in record:
+                    if key not in seen_fields:
+                        seen_fields[key] = None
+                        self.fieldnames = list(seen_fields)
+                yield {k: ("" if v is None else v) for k, v in record.items()}
+
+
+class _ColumnarReader(_RecipientReader):
+    """Parquet/Arrow letti a record batch: la posizione è l'indice di riga (offset = row, crc = 0).
+
+    Le sottoclassi forniscono `_schema_names()`, `_batches(skip)` (coppie batch, prima riga)
+    e `row_count()`.
+    """
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        skip = self.start.row if self.start is not None else 0
+        self.fieldnames = self._project(self._schema_names())
+        row_number = skip
+        self.position = Position(row_number, row_number, 0)
+        for batch, first_row in self._batches(skip):
+            columns = {name: batch.column(name).to_pylist() for name in self.fieldnames}
+            for i in range(max(skip - first_row, 0), batch.num_rows):
+                self.row_start = self.position
+                row_number = first_row + i + 1
+                self.position = self.row_end = Position(row_number, row_number, 0)
+                yield {name: ("" if values[i] is None else values[i]) for name, values in columns.items()}
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as exc:
+        raise RuntimeError("pyarrow non installato: serve per leggere destinatari Parquet/Arrow") from exc
+
+
+class ParquetRecipientReader(_ColumnarReader):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _require_pyarrow()
+        import pyarrow.parquet as pq
+
+        self._file = pq.ParquetFile(self.path)
+
+    def _schema_names(self) -> List[str]:
+        return list(self._file.schema_arrow.names)
+
+    def row_count(self) -> int:
+        return self._file.metadata.num_rows
+
+    def _batches(self, skip: int):
+        # Salta i row group interi già consumati, poi legge solo le colonne proiettate.
+        metadata = self._file.metadata
+        first_row = 0
+        groups = []
+        for i in range(metadata.num_row_groups):
+            rows = metadata.row_group(i).num_rows
+            if not groups and first_row + rows <= skip:
+                first_row += rows
+                continue
+            groups.append(i)
+        if not groups:
+            return
+        for batch in self._file.iter_batches(batch_size=ARROW_BATCH_ROWS, row_groups=groups,
+                                             columns=self.fieldnames):
+            yield batch, first_row
+            first_row += batch.num_rows
+
+
+class ArrowRecipientReader(_ColumnarReader):
+    """File Arrow IPC (.arrow/.feather v2), letto in memory map batch per batch."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _require_pyarrow()
+        import pyarrow as pa
+
+        self._source = pa.memory_map(self.path, "r")
+        self._reader = pa.ipc.open_file(self._source)
+
+    def _schema_names(self) -> List[str]:
+        return list(self._reader.schema.names)
+
+    def row_count(self) -> int:
+        return sum(self._reader.get_batch(i).num_rows for i in range(self._reader.num_record_batches))
+
+    def _batches(self, skip: int):
+        first_row = 0
+        for i in range(self._reader.num_record_batches):
+            batch = self._reader.get_batch(i)
+            if first_row + batch.num_rows > skip:
+                yield batch.select(self.fieldnames), first_row
+            first_row += batch.num_rows
+
+
+def open_recipient_source(path: str, start: Optional[Position] = None,
+                          columns: Optional[Iterable[str]] = None) -> _RecipientReader:
+    """Reader adatto all'estensione del file: .csv, .jsonl/.ndjson, .parquet, .arrow/.feather."""
+    lower = path.lower()
+    if lower.endswith(".parquet"):
+        return ParquetRecipientReader(path, start, columns)
+    if lower.endswith((".arrow", ".feather")):
+        return ArrowRecipientReader(path, start, columns)
+    if lower.endswith((".jsonl", ".ndjson")):
+        return JsonlRecipientReader(path, start, columns)
+    return CsvRecipientReader(path, start, columns)
+
+
+def count_rows(path: str, start: Optional[Position] = None) -> int:
+    reader = open_recipient_source(path, start, columns=("email",))
+    if isinstance(reader, _ColumnarReader):
+        return reader.row_count() - (start.row if start else 0)
+    for _ in reader:
+        pass
+    return reader.position.row - (start.row if start else 0) if reader.position else 0
+
+
+def load_resume_checkpoint(checkpoint_path: str, csv_path: str) -> tuple:
+    """Ritorna (Position | None, total_rows | None) validando il checkpoint rispetto al CSV.
+
+    Se il file è identico (size/mtime/inode) ci si fida del checkpoint; se è cambiato si
+    ricontrolla il CRC dei byte prima dell'offset (append in coda = checkpoint ancora valido).
+    """
+    if not os.path.exists(checkpoint_path) or not os.path.exists(csv_path):
+        return None, None
+    try:
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        position = Position(int(data["offset"]), int(data["row"]), int(data["crc32"]))
+    except (ValueError, KeyError, TypeError):
+        return None, None
+    fingerprint = file_fingerprint(csv_path)
+    if data.get("fingerprint") == fingerprint:
+        return position, data.get("total_rows")
+    if is_columnar(csv_path):
+        # Per Parquet/Arrow l'offset è un indice di riga: un file cambiato non è verificabile.
+        return None, None
+    if fingerprint["size"] < position.offset or crc32_prefix(csv_path, position.offset) != position.crc:
+        return None, None
+    return position, None
+
+
+def save_resume_checkpoint(checkpoint_path: str, csv_path: str, position: Position,
+                           total_rows: Optional[int]) -> None:
+    payload = {
+        "offset": position.offset,
+        "row": position.row,
+        "crc32": position.crc,
+        "fingerprint": file_fingerprint(csv_path),
+        "total_rows": total_rows,
+    }
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, checkpoint_path)
@@ -0,0 +1,118 @@
+import os
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+from jinja2 import Environment, meta, nodes
+
+# Campi che cambiano a ogni destinatario: se il template li usa solo come `{{ campo }}`
+# non entrano nella chiave di cache e vengono sostituiti dopo il render.
+LATE_BOUND_FIELDS = ("email", "tracking_pixel_url", "unsubscribe_url")
+RENDER_CACHE_SIZE = int(os.environ.get("RENDER_CACHE_SIZE", "1024"))
+
+_MISSING = object()
+
+
+def _late_bindable(ast: nodes.Template, name: str) -> bool:
+    """True se `name` compare solo come output diretto (`{{ name }}`) e non viene mai assegnato."""
+    direct = 0
+    for output in ast.find_all(nodes.Output):
+        direct += sum(1 for child in output.nodes if isinstance(child, nodes.Name) and child.name == name)
+    total = 0
+    for ref in ast.find_all(nodes.Name):
+        if ref.name == name:
+            if ref.ctx != "load":
+                return False
+            total += 1
+    return total > 0 and total == direct
+
+
+class _Plan:
+    """Template compilato + variabili da cui dipende l'output."""
+
+    def __init__(self, env: Environment, source: str, late_fields: Tuple[str, ...]):
+        ast = env.parse(source)
+        self.template = env.from_string(ast)
+        self.used = frozenset(meta.find_undeclared_variables(ast))
+        self.late = tuple(name for name in late_fields if name in self.used and _late_bindable(ast, name))
+        self.keys = tuple(sorted(self.used.difference(self.late)))
+        marker = uuid.uuid4().hex
+        self.sentinels = {name: f"\x00{marker}:{name}\x00" for name in self.late}
+
+
+class MemoRenderer:
+    """Render Jinja2 memoizzato sulle sole variabili usate dal template.
+
+    Il template (corpo o oggetto) viene analizzato una volta con
+    `meta.find_undeclared_variables`: il contesto è ridotto a quelle variabili e
+    l'output è tenuto in una LRU di `cache_size` voci indicizzata dai loro valori.
+    I campi per-destinatario (`LATE_BOUND_FIELDS`) sono renderizzati come segnaposto
+    e sostituiti con `str.replace`, così righe che differiscono solo per email e URL
+    di tracking condividono lo stesso render. Il risultato è identico a `Template.render`.
+    """
+
+    def __init__(self, cache_size: int = RENDER_CACHE_SIZE, late_fields: Tuple[str, ...] = LATE_BOUND_FIELDS):
+        self.cache_size = cache_size
+        self.late_fields = tuple(late_fields)
+        self.hits = 0
+        self.misses = 0
+        self._env = Environment()
+        self._plans: Dict[str, _Plan] = {}
+        self._files: Dict[str, Tuple[int, int, str]] = {}
+        self._cache: "OrderedDict[Any, str]" = OrderedDict()
+
+    def _plan(self, source: str) -> _Plan:
+        plan = self._plans.get(source)
+        if plan is None:
+            plan = self._plans[source] = _Plan(self._env, source, self.late_fields)
+        return plan
+
+    def _source(self, path: str) -> str:
+        st = os.stat(path)
+        cached = self._files.get(path)
+        if cached is not None and cached[:2] == (st.st_mtime_ns, st.st_size):
+            return cached[2]
+        with open(path, "r", encoding="utf-8") as f:
+            source = f.read()
+        self._files[path] = (st.st_mtime_ns, st.st_size, source)
+        return source
+
+    def render_file(self, path: str, ctx: Dict[str, Any]) -> str:
+        return self.render(self._source(path), ctx)
+
+    def render(self, source: str, ctx: Dict[str, Any]) -> str:
+        plan = self._plan(source)
+        key = (source, tuple(ctx.get(name, _MISSING) for name in plan.keys))
+        try:
+            out = self._cache.get(key) if self.cache_size > 0 else None
+        except TypeError:
+            # Valori non hashable (es. liste da JSONL): render diretto, senza cache.
+            key, out = None, None
+        if out is None:
+            self.misses += 1
+            local = {name: ctx[name] for name in plan.used if name in ctx}
+            local.update(plan.sentinels)
+            out = plan.template.render(local)
+            if key is not None and self.cache_size > 0:
+                self._cache[key] = out
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        else:
+            self.hits += 1
+            self._cache.move_to_end(key)
+        # Il segnaposto c'è sempre, anche se il campo manca: il render in cache vale per entrambi
+        # i casi e un campo assente diventa "" come per un Undefined di Jinja.
+        for name in plan.late:
+            out = out.replace(plan.sentinels[name], str(ctx.get(name, "")))
+        return out
+
+
+_RENDERER = MemoRenderer()
+
+
+def render_file(path: str, ctx: Dict[str, Any]) -> str:
+    return _RENDERER.render_file(path, ctx)
+
+
+def render_string(source: str, ctx: Dict[str, Any]) -> str:
+    return _RENDERER.render(source, ctx)
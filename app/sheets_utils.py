@@ -1,29 +1,19 @@
 import os
-from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
 
+from auth_utils import get_credentials
+from http_utils import pooled_http
+
 SCOPES_SHEETS = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
 
 def get_sheets_service(creds_dir: str):
     os.makedirs(creds_dir, exist_ok=True)
-    token_path = os.path.join(creds_dir, "token_sheets.json")
     creds_path = os.path.join(creds_dir, "credentials.json")
     if not os.path.exists(creds_path):
         raise FileNotFoundError(f"credentials.json non trovato in {creds_dir}")
-    creds = None
-    if os.path.exists(token_path):
-        creds = Credentials.from_authorized_user_file(token_path, SCOPES_SHEETS)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(creds_path, SCOPES_SHEETS)
-            creds = _run_headless_flow(flow)
-        with open(token_path, "w", encoding="utf-8") as f:
-            f.write(creds.to_json())
-    return build("sheets", "v4", credentials=creds)
+    creds = get_credentials(creds_dir, "token_sheets.json", SCOPES_SHEETS, _run_headless_flow)
+    return build("sheets", "v4", http=pooled_http(creds))
 
 
 def _run_headless_flow(flow: InstalledAppFlow):
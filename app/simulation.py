@@ -0,0 +1,66 @@
+import random
+import types
+from typing import Any, Dict, Optional
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from clock_utils import VirtualClock
+
+
+class SimulatedGmailService:
+    """Trasporto finto per `send --simulate`: replica la chain `service.users().messages()...`.
+
+    Ogni chiamata fa avanzare l'orologio virtuale di `latency` secondi; le send
+    falliscono con probabilità `error_rate` (503, ritentabile) o `fatal_error_rate`
+    (400, definitivo) così da esercitare retry, backoff e cooldown reali.
+    """
+
+    def __init__(self, clock: VirtualClock, latency: float = 0.5, error_rate: float = 0.0,
+                 fatal_error_rate: float = 0.0, seed: Optional[int] = None):
+        self.clock = clock
+        self.latency = latency
+        self.error_rate = error_rate
+        self.fatal_error_rate = fatal_error_rate
+        self.rng = random.Random(seed)
+        self.calls: Dict[str, int] = {"send": 0, "retryable_errors": 0, "fatal_errors": 0}
+        self._next_id = 0
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def labels(self):
+        return self
+
+    def _request(self, fn):
+        def execute():
+            self.clock.sleep(self.latency)
+            return fn()
+        return types.SimpleNamespace(execute=execute)
+
+    def _send(self) -> Dict[str, Any]:
+        self.calls["send"] += 1
+        roll = self.rng.random()
+        if roll < self.fatal_error_rate:
+            self.calls["fatal_errors"] += 1
+            raise HttpError(httplib2.Response({"status": 400}), b"simulated invalid request")
+        if roll < self.fatal_error_rate + self.error_rate:
+            self.calls["retryable_errors"] += 1
+            raise HttpError(httplib2.Response({"status": 503}), b"simulated backend error")
+        self._next_id += 1
+        return {"id": f"sim-{self._next_id}", "threadId": f"sim-thread-{self._next_id}"}
+
+    def send(self, userId: str, body: Dict[str, Any] | None = None, media_body: Any = None):
+        return self._request(self._send)
+
+    def modify(self, userId: str, id: str, body: Dict[str, Any]):
+        return self._request(lambda: {})
+
+    def list(self, userId: str = "me", **kw):
+        return self._request(lambda: {"labels": []})
+
+    def create(self, userId: str, body: Dict[str, Any]):
+        return self._request(lambda: {"id": "sim-label", "name": body.get("name")})
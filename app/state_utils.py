@@ -0,0 +1,328 @@
+import base64
+import binascii
+import json
+import os
+import re
+import sys
+from array import array
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+# Campi di state.json salvati in array tipizzati; tutto il resto (es. `error`) va negli extra.
+STATE_FIELDS = (
+    "status", "attempts", "last_attempt", "last_success_ts", "last_error_ts", "message_id", "thread_id", "tracking_id",
+)
+_TS_FIELDS = ("last_attempt", "last_success_ts", "last_error_ts")
+_ID_FIELDS = ("message_id", "thread_id")
+_BIT = {name: 1 << i for i, name in enumerate(STATE_FIELDS)}
+_TS_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+_EPOCH = datetime(1970, 1, 1)
+_HEX64_RE = re.compile(r"[1-9a-f][0-9a-f]{0,15}")
+TRACKING_ID_BYTES = 9
+_INT64_MAX = 2 ** 63 - 1
+
+
+def _encode_ts(value: Any) -> Optional[int]:
+    if not isinstance(value, str) or len(value) != 20:
+        return None
+    try:
+        moment = datetime.strptime(value, _TS_FORMAT)
+    except ValueError:
+        return None
+    return int((moment - _EPOCH).total_seconds())
+
+
+def _decode_ts(seconds: int) -> str:
+    return (_EPOCH + timedelta(seconds=seconds)).strftime(_TS_FORMAT)
+
+
+def _encode_tracking_id(value: Any) -> Optional[bytes]:
+    if not isinstance(value, str) or len(value) != 12:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(value)
+    except (binascii.Error, ValueError):
+        return None
+    return raw if base64.urlsafe_b64encode(raw).decode("ascii") == value else None
+
+
+class _Pairs(list):
+    """Oggetto JSON letto come lista di coppie (object_pairs_hook), senza creare il dict."""
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, _Pairs):
+        return {k: _plain(v) for k, v in value}
+    if isinstance(value, list):
+        return [_plain(v) for v in value]
+    return value
+
+
+class StateEntry(MutableMapping):
+    """Vista dict di una riga di `StateTable`: legge e scrive direttamente negli array."""
+
+    __slots__ = ("_table", "_row")
+
+    def __init__(self, table: "StateTable", row: int):
+        self._table = table
+        self._row = row
+
+    def __getitem__(self, name: str) -> Any:
+        return self._table._get(self._row, name)
+
+    def __setitem__(self, name: str, value: Any) -> None:
+        self._table._set(self._row, name, value)
+
+    def __delitem__(self, name: str) -> None:
+        self._table._delete(self._row, name)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._table._fields(self._row))
+
+    def __len__(self) -> int:
+        return len(self._table._fields(self._row))
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+class StateTable(MutableMapping):
+    """Stato di invio della campagna in forma compatta, con la stessa interfaccia di un dict di dict.
+
+    Ogni email (interned) punta a un numero di riga; stato, tentativi, timestamp e id
+    Gmail stanno in array tipizzati, con una maschera per i campi presenti. Solo i
+    valori che non rientrano nei formati attesi (messaggi d'errore, campi sconosciuti)
+    restano oggetti Python negli extra. I dict completi si costruiscono solo per
+    l'export in JSON, riga per riga.
+    """
+
+    def __init__(self):
+        self._index: Dict[str, int] = {}
+        self._mask = array("H")
+        self._status = array("B")
+        self._attempts = array("q")
+        self._ts = {name: array("q") for name in _TS_FIELDS}
+        self._ids = {name: array("Q") for name in _ID_FIELDS}
+        self._tracking = bytearray()
+        self._status_names: List[str] = []
+        self._status_codes: Dict[str, int] = {}
+        self._status_counts: List[int] = []
+        self._extras: Dict[int, Dict[str, Any]] = {}
+
+    # --- righe -------------------------------------------------------------------------
+
+    def _new_row(self, key: str) -> int:
+        row = len(self._mask)
+        self._mask.append(0)
+        self._status.append(0)
+        self._attempts.append(0)
+        for column in self._ts.values():
+            column.append(0)
+        for column in self._ids.values():
+            column.append(0)
+        self._tracking.extend(bytes(TRACKING_ID_BYTES))
+        self._index[sys.intern(key)] = row
+        return row
+
+    def _uncount(self, row: int) -> None:
+        if self._mask[row] & _BIT["status"]:
+            self._status_counts[self._status[row]] -= 1
+
+    def _clear(self, row: int) -> None:
+        self._uncount(row)
+        self._mask[row] = 0
+        self._extras.pop(row, None)
+
+    def _fields(self, row: int) -> List[str]:
+        mask = self._mask[row]
+        names = [name for name in STATE_FIELDS if mask & _BIT[name]]
+        extras = self._extras.get(row)
+        if extras:
+            names.extend(extras)
+        return names
+
+    def _get(self, row: int, name: str) -> Any:
+        bit = _BIT.get(name)
+        if bit is not None and self._mask[row] & bit:
+            if name == "status":
+                return self._status_names[self._status[row]]
+            if name == "attempts":
+                return self._attempts[row]
+            if name in self._ts:
+                return _decode_ts(self._ts[name][row])
+            if name in self._ids:
+                return format(self._ids[name][row], "x")
+            start = row * TRACKING_ID_BYTES
+            return base64.urlsafe_b64encode(self._tracking[start:start + TRACKING_ID_BYTES]).decode("ascii")
+        extras = self._extras.get(row)
+        if extras is None or name not in extras:
+            raise KeyError(name)
+        return extras[name]
+
+    def _set_typed(self, row: int, name: str, value: Any) -> bool:
+        if name == "status":
+            if not isinstance(value, str):
+                return False
+            code = self._status_codes.get(value)
+            if code is None:
+                if len(self._status_names) >= 256:
+                    return False
+                code = self._status_codes[value] = len(self._status_names)
+                self._status_names.append(sys.intern(value))
+                self._status_counts.append(0)
+            self._status[row] = code
+        elif name == "attempts":
+            if type(value) is not int or abs(value) > _INT64_MAX:
+                return False
+            self._attempts[row] = value
+        elif name in self._ts:
+            seconds = _encode_ts(value)
+            if seconds is None or _decode_ts(seconds) != value:
+                return False
+            self._ts[name][row] = seconds
+        elif name in self._ids:
+            if not isinstance(value, str) or not _HEX64_RE.fullmatch(value):
+                return False
+            self._ids[name][row] = int(value, 16)
+        elif name == "tracking_id":
+            raw = _encode_tracking_id(value)
+            if raw is None:
+                return False
+            start = row * TRACKING_ID_BYTES
+            self._tracking[start:start + TRACKING_ID_BYTES] = raw
+        else:
+            return False
+        return True
+
+    def _set(self, row: int, name: str, value: Any) -> None:
+        bit = _BIT.get(name)
+        if name == "status":
+            self._uncount(row)
+        if bit is not None and self._set_typed(row, name, value):
+            self._mask[row] |= bit
+            if name == "status":
+                self._status_counts[self._status[row]] += 1
+            extras = self._extras.get(row)
+            if extras is not None:
+                extras.pop(name, None)
+                if not extras:
+                    del self._extras[row]
+            return
+        if bit is not None:
+            self._mask[row] &= ~bit
+        self._extras.setdefault(row, {})[name] = value
+
+    def _delete(self, row: int, name: str) -> None:
+        bit = _BIT.get(name)
+        if bit is not None and self._mask[row] & bit:
+            if name == "status":
+                self._uncount(row)
+            self._mask[row] &= ~bit
+            return
+        extras = self._extras.get(row)
+        if extras is None or name not in extras:
+            raise KeyError(name)
+        del extras[name]
+        if not extras:
+            del self._extras[row]
+
+    # --- interfaccia dict ---------------------------------------------------------------
+
+    def __getitem__(self, key: str) -> StateEntry:
+        return StateEntry(self, self._index[key])
+
+    def __setitem__(self, key: str, entry: Dict[str, Any]) -> None:
+        row = self._index.get(key)
+        if row is None:
+            row = self._new_row(key)
+        else:
+            self._clear(row)
+        for name, value in entry.items():
+            self._set(row, name, value)
+
+    def __delitem__(self, key: str) -> None:
+        self._clear(self._index.pop(key))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._index
+
+    def keys_with_status(self, status: str) -> Iterator[str]:
+        """Chiavi con lo stato dato, senza costruire le entry."""
+        code = self._status_codes.get(status)
+        if code is None:
+            return
+        bit = _BIT["status"]
+        for key, row in self._index.items():
+            if self._mask[row] & bit and self._status[row] == code:
+                yield key
+
+    def status_counts(self) -> Dict[str, int]:
+        """Destinatari per stato, mantenuti a ogni scrittura: costo costante."""
+        return {name: n for name, n in zip(self._status_names, self._status_counts) if n}
+
+    def merge_from(self, other: "StateTable", skip: Iterable[str] = ()) -> None:
+        """Copia le righe di `other`, tranne le chiavi in `skip` (quelle di cui si è proprietari)."""
+        skip = skip if isinstance(skip, (set, frozenset, dict)) else set(skip)
+        for key, row in other._index.items():
+            if key not in skip:
+                self[key] = StateEntry(other, row)
+
+    # --- JSON --------------------------------------------------------------------------
+
+    @classmethod
+    def from_entries(cls, entries: Iterable, normalize: Optional[Callable[[str], str]] = None) -> "StateTable":
+        """Costruisce la tabella da coppie (email, entry); con `normalize` migra le chiavi
+        alla forma normalizzata preferendo le entry già inviate."""
+        table = cls()
+        for email, entry in entries:
+            if not isinstance(email, str):
+                continue
+            if isinstance(entry, _Pairs):
+                entry = {name: _plain(value) for name, value in entry}
+            if not isinstance(entry, dict):
+                continue
+            key = normalize(email) if normalize is not None else email
+            current = table._index.get(key)
+            if current is not None:
+                replace = entry.get("status") == "sent" and table[key].get("status") != "sent"
+                if not replace:
+                    continue
+            table[key] = entry
+        return table
+
+    @classmethod
+    def load(cls, path: str, normalize: Optional[Callable[[str], str]] = None) -> "StateTable":
+        """Legge state.json senza creare un dict per destinatario (le entry arrivano come coppie)."""
+        if not os.path.exists(path):
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                data = json.load(f, object_pairs_hook=_Pairs)
+            except json.JSONDecodeError:
+                return cls()
+        if not isinstance(data, _Pairs):
+            return cls()
+        return cls.from_entries(data, normalize)
+
+    def write_json(self, path: str) -> None:
+        """Scrive state.json (stesso formato di `json.dump(..., indent=2)`) in modo atomico."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            if not self._index:
+                f.write("{}")
+            else:
+                sep = "{\n  "
+                for key, row in self._index.items():
+                    entry = {name: self._get(row, name) for name in self._fields(row)}
+                    body = json.dumps(entry, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+                    f.write(f"{sep}{json.dumps(key, ensure_ascii=False)}: {body}")
+                    sep = ",\n  "
+                f.write("\n}")
+        os.replace(tmp_path, path)
@@ -0,0 +1,196 @@
+import json
+import math
+import os
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from clock_utils import SYSTEM_CLOCK, utc_iso
+
+STATUS_FILENAME = "status.json"
+# Un file per processo `send` (status.<worker>.json): più worker possono girare sulla stessa campagna.
+STATUS_PREFIX = "status."
+ACTIVE_STATES = ("running", "waiting")
+DEFAULT_STATUS_INTERVAL_SECONDS = 2.0
+RATE_WINDOW_SECONDS = 3600
+# Oltre questo ritardo un `running` senza aggiornamenti è probabilmente un processo caduto.
+STALE_AFTER_SECONDS = 300
+
+
+class StatusFile:
+    """Riepilogo piccolo e incrementale di un giro di `send`, letto da `status`.
+
+    Contiene solo contatori e previsioni (conteggi per stato, velocità sull'ultima
+    ora, prossimo invio, quota residua, ETA): viene riscritto in modo atomico al
+    massimo ogni `interval` secondi, e sempre prima delle attese e a fine giro.
+    """
+
+    def __init__(self, path: str, campaign: str, clock=SYSTEM_CLOCK,
+                 interval: float = DEFAULT_STATUS_INTERVAL_SECONDS, **fields: Any):
+        self.path = path
+        self.clock = clock
+        self.interval = interval
+        self._sends = deque()
+        self._last_write: Optional[float] = None
+        self.data: Dict[str, Any] = {
+            "campaign": campaign,
+            "state": "running",
+            "pid": os.getpid(),
+            "started_at": utc_iso(clock.now()),
+            "next_send_at": None,
+            **fields,
+        }
+
+    def record_send(self) -> None:
+        now = self.clock.now()
+        self._sends.append(now)
+        while self._sends and (now - self._sends[0]).total_seconds() > RATE_WINDOW_SECONDS:
+            self._sends.popleft()
+
+    def rate_per_hour(self) -> Optional[float]:
+        """Invii all'ora sull'ultima ora (o dall'inizio del giro, se più recente)."""
+        if not self._sends:
+            return None
+        started = datetime.fromisoformat(self.data["started_at"].rstrip("Z"))
+        now = self.clock.now()
+        span = min((now - started).total_seconds(), RATE_WINDOW_SECONDS)
+        if span <= 0:
+            return None
+        return round(len(self._sends) * 3600 / span, 1)
+
+    def update(self, counts: Dict[str, int], remaining: int, daily_remaining: int, force: bool = False,
+               **fields: Any) -> None:
+        self.data.update(fields)
+        if not force and self._last_write is not None and self.clock.monotonic() - self._last_write < self.interval:
+            return
+        self._last_write = self.clock.monotonic()
+        now = self.clock.now()
+        rate = self.rate_per_hour()
+        self.data.update(
+            updated_at=utc_iso(now),
+            counts=counts,
+            remaining=remaining,
+            daily_remaining=daily_remaining,
+            rate_per_hour=rate,
+            eta=estimate_eta(now, remaining, rate, daily_remaining, self.data.get("daily_limit")),
+        )
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def estimate_eta(now: datetime, remaining: int, rate_per_hour: Optional[float], daily_remaining: int,
+                 daily_limit: Optional[int]) -> Optional[str]:
+    """Fine prevista: alla velocità attuale, più un giorno per ogni `daily_limit` oltre la quota residua."""
+    if remaining <= 0:
+        return utc_iso(now)
+    if not rate_per_hour:
+        return None
+    hours = remaining / rate_per_hour
+    if daily_limit and remaining > daily_remaining:
+        days = math.ceil((remaining - daily_remaining) / daily_limit)
+        last_day = remaining - daily_remaining - (days - 1) * daily_limit
+        hours = max(hours, days * 24 + last_day / rate_per_hour)
+    return utc_iso(now + timedelta(hours=hours))
+
+
+def worker_status_path(logs_dir: str, worker: str) -> str:
+    return os.path.join(logs_dir, f"{STATUS_PREFIX}{worker}.json")
+
+
+def read_worker_statuses(logs_dir: str) -> List[Dict[str, Any]]:
+    """Status di tutti i worker della campagna (compreso il vecchio status.json), dal meno recente."""
+    try:
+        names = os.listdir(logs_dir)
+    except FileNotFoundError:
+        return []
+    statuses = []
+    for name in names:
+        if name.startswith(STATUS_PREFIX) and name.endswith(".json"):
+            current = read_status(os.path.join(logs_dir, name))
+            if current is not None:
+                statuses.append(current)
+    return sorted(statuses, key=lambda st: st.get("updated_at") or "")
+
+
+def prune_worker_statuses(logs_dir: str, keep: str) -> None:
+    """Toglie gli status di worker non più attivi (giri conclusi), tranne quello di `keep`."""
+    try:
+        names = os.listdir(logs_dir)
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(logs_dir, name)
+        if not (name.startswith(STATUS_PREFIX) and name.endswith(".json")) or path == keep:
+            continue
+        current = read_status(path)
+        if current is None or current.get("state") not in ACTIVE_STATES:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def combine_statuses(statuses: List[Dict[str, Any]], now: datetime) -> Optional[Dict[str, Any]]:
+    """Vista di campagna dagli status dei worker: velocità e invii si sommano tra i worker attivi,
+    restanti e prossimo invio sono i più vicini; conteggi e quota vengono dal file più recente."""
+    if not statuses:
+        return None
+    latest = statuses[-1]
+    active = [st for st in statuses if st.get("state") in ACTIVE_STATES]
+    combined = dict(active[-1] if active else latest)
+    combined["counts"] = latest.get("counts")
+    combined["workers"] = [
+        {name: st.get(name) for name in ("worker", "state", "updated_at", "sent_this_run")} for st in statuses
+    ]
+    if len(active) < 2:
+        return combined
+    combined["state"] = "running" if any(st["state"] == "running" for st in active) else "waiting"
+    for name in ("sent_this_run", "errors_this_run"):
+        combined[name] = sum(st.get(name) or 0 for st in active)
+    rates = [st["rate_per_hour"] for st in active if st.get("rate_per_hour")]
+    combined["rate_per_hour"] = round(sum(rates), 1) if rates else None
+    remaining = [st["remaining"] for st in active if st.get("remaining") is not None]
+    combined["remaining"] = min(remaining) if remaining else None
+    next_sends = [st["next_send_at"] for st in active if st.get("next_send_at")]
+    combined["next_send_at"] = min(next_sends) if next_sends else None
+    combined["eta"] = estimate_eta(
+        now, combined["remaining"] or 0, combined["rate_per_hour"], latest.get("daily_remaining") or 0,
+        latest.get("daily_limit"),
+    )
+    return combined
+
+
+def read_status(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def format_status(status: Dict[str, Any], now: datetime) -> str:
+    """Una riga leggibile per campagna."""
+    state = status.get("state", "?")
+    # Durante un'attesa annunciata (limite, circuito, delay) il file non si aggiorna: non è un processo fermo.
+    expected = [t for t in (status.get("updated_at"), status.get("next_send_at")) if t]
+    if state in ("running", "waiting") and expected:
+        age = (now - max(datetime.fromisoformat(t.rstrip("Z")) for t in expected)).total_seconds()
+        if age > STALE_AFTER_SECONDS:
+            state = f"{state}?(fermo da {int(age)}s)"
+    counts = status.get("counts") or {}
+    workers = status.get("workers") or []
+    if len(workers) > 1:
+        active = sum(1 for w in workers if w.get("state") in ACTIVE_STATES)
+        state = f"{state} (worker attivi {active}/{len(workers)})"
+    parts = [
+        f"{status.get('campaign')}: {state}",
+        " ".join(f"{name}={n}" for name, n in sorted(counts.items())) or "nessun destinatario",
+        f"restanti={status.get('remaining')}",
+        f"quota={status.get('daily_remaining')}/{status.get('daily_limit')}",
+        f"velocità={status.get('rate_per_hour') or '-'}/h",
+        f"prossimo={status.get('next_send_at') or '-'}",
+        f"eta={status.get('eta') or '-'}",
+    ]
+    return " | ".join(parts)
@@ -0,0 +1,229 @@
+import csv
+import fcntl
+import hashlib
+import heapq
+import mmap
+import os
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, Set
+
+from bounce_utils import is_hard, read_bounces
+
+GMAIL_DOMAINS = {"gmail.com", "googlemail.com"}
+HASH_SIZE = 8
+JOURNAL_COMPACT_THRESHOLD = 50_000
+
+
+def normalize_email(email: str | None, fold_plus: bool = False, fold_gmail_dots: bool = False) -> str:
+    """Forma canonica di un indirizzo: trim + lowercase, opzionalmente senza +tag e punti Gmail."""
+    email = (email or "").strip().lower()
+    local, sep, domain = email.rpartition("@")
+    if not sep or not local:
+        return email
+    if fold_plus:
+        local = local.split("+", 1)[0] or local
+    if fold_gmail_dots and domain in GMAIL_DOMAINS:
+        local = local.replace(".", "")
+        domain = "gmail.com"
+    return f"{local}@{domain}"
+
+
+def make_normalizer(cfg: dict) -> Callable[[str], str]:
+    """Costruisce la funzione di normalizzazione secondo le opzioni dedupe_* del config."""
+    fold_plus = bool(cfg.get("dedupe_fold_plus_addresses", False))
+    fold_dots = bool(cfg.get("dedupe_fold_gmail_dots", False))
+
+    def _normalize(email: str | None) -> str:
+        return normalize_email(email, fold_plus=fold_plus, fold_gmail_dots=fold_dots)
+
+    return _normalize
+
+
+def _read_csv_column(path: str, column: str) -> Iterable[str]:
+    if not os.path.exists(path):
+        return
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            value = (row.get(column) or "").strip()
+            if value:
+                yield value
+
+
+def load_campaign_suppressions(logs_dir: str, normalize: Callable[[str], str]) -> Set[str]:
+    """Indirizzi normalizzati da escludere: bounce hard e unsubscribe noti per la campagna."""
+    suppressed = set()
+    # Solo i bounce hard: i soft (casella piena, rifiuti temporanei) restano ritentabili.
+    for row in read_bounces(os.path.join(logs_dir, "bounces.csv")):
+        if is_hard(row):
+            suppressed.add(normalize(row["bounced_email"]))
+    for email in _read_csv_column(os.path.join(logs_dir, "unsubs.csv"), "email"):
+        suppressed.add(normalize(email))
+    return suppressed
+
+
+def canonical_email(email: str | None) -> str:
+    """Forma usata dall'indice globale: +tag e punti Gmail sempre ripiegati, qualunque siano
+    le opzioni dedupe_* della campagna, così ogni variante della stessa casella coincide."""
+    return normalize_email(email, fold_plus=True, fold_gmail_dots=True)
+
+
+def email_digest(email: str) -> bytes:
+    """Hash a 64 bit dell'indirizzo canonico, confrontabile byte a byte nell'indice ordinato."""
+    return hashlib.blake2b(canonical_email(email).encode("utf-8"), digest_size=HASH_SIZE).digest()
+
+
+def _legacy_digest(email: str) -> bytes:
+    """Hash dell'indirizzo solo normalizzato, come nelle voci scritte prima della forma canonica."""
+    return hashlib.blake2b(normalize_email(email).encode("utf-8"), digest_size=HASH_SIZE).digest()
+
+
+class SuppressionIndex:
+    """Indice globale di soppressione condiviso tra campagne.
+
+    Gli hash sono tenuti in un file ordinato (`suppressed.idx`) letto via mmap con
+    ricerca binaria, più un journal append-only (`suppressed.journal`) per le
+    aggiunte recenti, fuso nell'indice quando supera JOURNAL_COMPACT_THRESHOLD.
+    Le chiavi sono gli hash di `canonical_email`: sopprimere `ab@gmail.com` esclude
+    anche `a.b+x@gmail.com` in ogni campagna.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.index_path = os.path.join(root, "suppressed.idx")
+        self.journal_path = os.path.join(root, "suppressed.journal")
+        self.lock_path = os.path.join(root, "suppressed.lock")
+        self._mm = None
+        self._index_file = None
+        self._index_stat = None
+        self._journal: Set[bytes] = set()
+        self._journal_offset = 0
+        self.refresh()
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        os.makedirs(self.root, exist_ok=True)
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _close_index(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+
+    def close(self) -> None:
+        self._close_index()
+
+    def refresh(self) -> None:
+        """Rilegge indice/journal se modificati da altri processi."""
+        try:
+            st = os.stat(self.index_path)
+            stat_key = (st.st_ino, st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            stat_key = None
+        if stat_key != self._index_stat:
+            self._close_index()
+            self._journal = set()
+            self._journal_offset = 0
+            self._index_stat = stat_key
+            if stat_key and stat_key[1] >= HASH_SIZE:
+                self._index_file = open(self.index_path, "rb")
+                self._mm = mmap.mmap(self._index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "rb") as f:
+                f.seek(self._journal_offset)
+                data = f.read()
+            usable = len(data) - len(data) % HASH_SIZE
+            for i in range(0, usable, HASH_SIZE):
+                self._journal.add(data[i:i + HASH_SIZE])
+            self._journal_offset += usable
+
+    def _index_count(self) -> int:
+        return len(self._mm) // HASH_SIZE if self._mm is not None else 0
+
+    def _index_contains(self, digest: bytes) -> bool:
+        mm = self._mm
+        lo, hi = 0, self._index_count()
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = mid * HASH_SIZE
+            value = mm[pos:pos + HASH_SIZE]
+            if value == digest:
+                return True
+            if value < digest:
+                lo = mid + 1
+            else:
+                hi = mid
+        return False
+
+    def contains_digest(self, digest: bytes) -> bool:
+        return digest in self._journal or self._index_contains(digest)
+
+    def __contains__(self, email: str) -> bool:
+        if self.contains_digest(email_digest(email)):
+            return True
+        return normalize_email(email) != canonical_email(email) and self.contains_digest(_legacy_digest(email))
+
+    def __len__(self) -> int:
+        return self._index_count() + len(self._journal)
+
+    def add_many(self, emails: Iterable[str]) -> int:
+        """Aggiunge indirizzi al journal; ritorna quanti erano nuovi."""
+        self.refresh()
+        fresh = []
+        for email in emails:
+            if not normalize_email(email):
+                continue
+            digest = email_digest(email)
+            if not self.contains_digest(digest):
+                self._journal.add(digest)
+                fresh.append(digest)
+        if not fresh:
+            return 0
+        with self._locked():
+            with open(self.journal_path, "ab") as f:
+                f.write(b"".join(fresh))
+            if os.path.getsize(self.journal_path) // HASH_SIZE >= JOURNAL_COMPACT_THRESHOLD:
+                self._compact_locked()
+        self.refresh()
+        return len(fresh)
+
+    def add(self, email: str) -> bool:
+        return self.add_many([email]) == 1
+
+    def compact(self) -> None:
+        """Fonde il journal nell'indice ordinato."""
+        with self._locked():
+            self._compact_locked()
+        self.refresh()
+
+    def _compact_locked(self) -> None:
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path, "rb") as f:
+            data = f.read()
+        journal = sorted({data[i:i + HASH_SIZE] for i in range(0, len(data) - len(data) % HASH_SIZE, HASH_SIZE)})
+
+        def _index_iter():
+            if not os.path.exists(self.index_path) or os.path.getsize(self.index_path) < HASH_SIZE:
+                return
+            with open(self.index_path, "rb") as idx:
+                with mmap.mmap(idx.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    for pos in range(0, len(mm), HASH_SIZE):
+                        yield mm[pos:pos + HASH_SIZE]
+
+        tmp_path = f"{self.index_path}.tmp"
+        last = None
+        with open(tmp_path, "wb") as out:
+            for digest in heapq.merge(_index_iter(), journal):
+                if digest != last:
+                    out.write(digest)
+                    last = digest
+        os.replace(tmp_path, self.index_path)
+        os.remove(self.journal_path)
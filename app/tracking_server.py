@@ -0,0 +1,248 @@
+import asyncio
+import base64
+import csv
+import io
+import os
+import re
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from events_utils import EVENTS_DIRNAME, EventStore
+from suppression_utils import SuppressionIndex
+from tracking_utils import load_tracking_secret, open_token_index, resolve_recipients, verify_token
+
+PIXEL_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAQAAAC1HAwCAAAAC0lEQVR42mP8/x8AAwMB/URn3jsAAAAASUVORK5CYII="
+)
+UNSUBSCRIBE_TEXT = "Disiscrizione registrata.".encode("utf-8")
+OPENS_HEADER = ["ts", "cid", "to", "ua", "ip"]
+UNSUBS_HEADER = ["ts", "email"]
+LOCAL_OPENS_FILENAME = "opens_local.csv"
+_CID_RE = re.compile(r"^[A-Za-z0-9_][A-Za-z0-9_.-]*$")
+_MAX_HEADER_BYTES = 16 * 1024
+
+
+def _utc_now() -> str:
+    return datetime.utcnow().isoformat(timespec="milliseconds") + "Z"
+
+
+class HitWriter:
+    """Accumula le righe per file e le scrive a blocchi (una write per file per flush)."""
+
+    def __init__(self, data_root: str, suppression_root: str):
+        self.data_root = data_root
+        self.suppression_root = suppression_root
+        self.tracking_dir = os.path.join(data_root, "tracking")
+        self._pending: Dict[str, List[List[str]]] = {}
+        self._headers: Dict[str, List[str]] = {}
+        self._unsubscribed: List[tuple] = []
+        self._opened: List[List[str]] = []
+        # L'event store viene scritto insieme ai CSV, a ogni flush.
+        self.events = EventStore(os.path.join(data_root, EVENTS_DIRNAME), flush_rows=1_000_000, flush_seconds=float("inf"))
+        self.count = 0
+
+    def _campaign_path(self, cid: str, filename: str) -> str:
+        if cid and _CID_RE.match(cid):
+            return os.path.join(self.data_root, "logs", cid, filename)
+        return os.path.join(self.data_root, "tracking", filename)
+
+    def add_open(self, cid: str, to: str, ua: str, ip: str) -> None:
+        path = self._campaign_path(cid, LOCAL_OPENS_FILENAME)
+        self._headers[path] = OPENS_HEADER
+        row = [_utc_now(), cid, to, ua, ip]
+        self._pending.setdefault(path, []).append(row)
+        self._opened.append(row)
+        self.count += 1
+
+    def add_unsubscribe(self, cid: str, recipient: str) -> None:
+        """`recipient` è un'email (link legacy) o un tracking_id già verificato."""
+        path = self._campaign_path(cid, "unsubs.csv")
+        self._headers[path] = UNSUBS_HEADER
+        self._unsubscribed.append((path, [_utc_now(), recipient], cid))
+        self.count += 1
+
+    def _resolve_unsubscribed(self, entries: List[tuple]) -> List[str]:
+        """Risolve i tracking_id in email e accoda le righe risolte ai file unsubs."""
+        tokens = [row[1] for _, row, _ in entries if "@" not in row[1]]
+        resolved = {}
+        if tokens:
+            index = open_token_index(self.tracking_dir)
+            try:
+                resolved = resolve_recipients(tokens, None, index)
+            finally:
+                index.close()
+        emails = []
+        for path, row, cid in entries:
+            email = row[1] if "@" in row[1] else resolved.get(row[1], "")
+            if email:
+                self._pending.setdefault(path, []).append([row[0], email])
+                emails.append(email)
+                self.events.add("unsubscribe", ts=row[0], campaign=cid, email=email)
+        return emails
+
+    def _record_open_events(self, rows: List[List[str]]) -> None:
+        tokens = [row[2] for row in rows if row[2] and "@" not in row[2]]
+        resolved = {}
+        if tokens:
+            index = open_token_index(self.tracking_dir)
+            try:
+                resolved = resolve_recipients(tokens, None, index)
+            finally:
+                index.close()
+        for ts, cid, to, ua, ip in rows:
+            self.events.add("open", ts=ts, campaign=cid, email=resolved.get(to, to), user_agent=ua)
+
+    def flush(self) -> int:
+        unsubscribed, self._unsubscribed = self._unsubscribed, []
+        emails = self._resolve_unsubscribed(unsubscribed) if unsubscribed else []
+        opened, self._opened = self._opened, []
+        if opened:
+            self._record_open_events(opened)
+        pending, self._pending = self._pending, {}
+        written = 0
+        for path, rows in pending.items():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            buf = io.StringIO()
+            w = csv.writer(buf)
+            if not os.path.exists(path) or os.path.getsize(path) == 0:
+                w.writerow(self._headers[path])
+            w.writerows(rows)
+            with open(path, "a", encoding="utf-8", newline="") as f:
+                f.write(buf.getvalue())
+            written += len(rows)
+        if emails:
+            index = SuppressionIndex(self.suppression_root)
+            index.add_many(emails)
+            index.close()
+        self.events.flush()
+        self.count = 0
+        return written
+
+
+class TrackingServer:
+    """Server HTTP minimale (asyncio) per pixel di apertura e unsubscribe.
+
+    Accetta le stesse query string della Web App Apps Script (`mode=pixel|unsubscribe`,
+    `cid`, `t` oppure i legacy `to`/`email`) così basta puntare `tracking_base_url`/`unsubscribe_base_url`
+    a questo server. Le hit sono bufferizzate e scritte ogni `flush_interval` secondi
+    o ogni `batch_size` hit.
+    """
+
+    def __init__(self, data_root: str, flush_interval: float = 1.0, batch_size: int = 1000,
+                 log: Optional[Callable[..., None]] = None):
+        self.writer = HitWriter(data_root, os.path.join(data_root, "suppression"))
+        self.secret = load_tracking_secret(self.writer.tracking_dir)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.log = log or (lambda *a, **kw: None)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._flusher: Optional[asyncio.Task] = None
+
+    def _flush(self) -> None:
+        try:
+            self.writer.flush()
+        except Exception as exc:
+            self.log("error", "tracking_flush_failed", error=str(exc))
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self._flush()
+
+    def _record(self, method: str, target: str, headers: Dict[str, str], peer: str) -> tuple:
+        parts = urlsplit(target)
+        params = {k: v[0] for k, v in parse_qs(parts.query).items() if v}
+        path = parts.path.rstrip("/")
+        mode = params.get("mode", "").lower()
+        if not mode:
+            mode = "unsubscribe" if path.endswith("/unsubscribe") else "pixel"
+        cid = params.get("cid", "")
+        tracking_id = verify_token(self.secret, params.get("t")) if "t" in params else None
+
+        if mode == "unsubscribe":
+            recipient = tracking_id or params.get("email", "").strip()
+            if recipient:
+                self.writer.add_unsubscribe(cid, recipient)
+            return "200 OK", "text/plain; charset=utf-8", UNSUBSCRIBE_TEXT
+        if method != "GET" and method != "HEAD":
+            return "405 Method Not Allowed", "text/plain; charset=utf-8", b""
+        if path.endswith("favicon.ico"):
+            return "404 Not Found", "text/plain; charset=utf-8", b""
+        ip = headers.get("x-forwarded-for", "").split(",")[0].strip() or peer
+        if "t" in params and not tracking_id:
+            # Token non firmato da noi: rispondiamo col pixel ma non registriamo nulla.
+            return "200 OK", "image/png", PIXEL_PNG
+        self.writer.add_open(cid, tracking_id or params.get("to", ""), headers.get("user-agent", ""), ip)
+        return "200 OK", "image/png", PIXEL_PNG
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peername = writer.get_extra_info("peername")
+        peer = peername[0] if isinstance(peername, tuple) else ""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    name, sep, value = line.partition(":")
+                    if sep:
+                        headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", "0") or 0)
+                if length:
+                    await reader.readexactly(length)
+
+                status, content_type, body = self._record(method.upper(), target, headers, peer)
+                keep_alive = version.upper() == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                response = (
+                    f"HTTP/1.1 {status}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    "Cache-Control: no-store, no-cache, must-revalidate\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+                ).encode("latin-1")
+                writer.write(response if method.upper() == "HEAD" else response + body)
+                if self.writer.count >= self.batch_size:
+                    self._flush()
+                await writer.drain()
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    async def start(self, host: str, port: int) -> Any:
+        self._server = await asyncio.start_server(self.handle, host, port, limit=_MAX_HEADER_BYTES)
+        self._flusher = asyncio.create_task(self._flush_loop())
+        return self._server
+
+    async def stop(self) -> None:
+        if self._flusher:
+            self._flusher.cancel()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        self._flush()
+
+    async def serve_forever(self, host: str, port: int) -> None:
+        server = await self.start(host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.stop()
+
+
+def run_tracking_server(data_root: str, host: str, port: int, flush_interval: float = 1.0,
+                        batch_size: int = 1000, log: Optional[Callable[..., None]] = None) -> None:
+    server = TrackingServer(data_root, flush_interval=flush_interval, batch_size=batch_size, log=log)
+    try:
+        asyncio.run(server.serve_forever(host, port))
+    except KeyboardInterrupt:
+        pass
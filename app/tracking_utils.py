@@ -0,0 +1,141 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import sqlite3
+from typing import Dict, Iterable, Optional, Tuple
+
+TRACKING_ID_BYTES = 9          # 12 caratteri base64url
+SIGNATURE_BYTES = 6            # 8 caratteri base64url
+TRACKING_ID_LEN = 12
+TOKEN_LEN = 20
+SECRET_FILENAME = "secret.key"
+TOKENS_DB_FILENAME = "tokens.db"
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def new_tracking_id() -> str:
+    return _b64(secrets.token_bytes(TRACKING_ID_BYTES))
+
+
+def load_tracking_secret(tracking_dir: str) -> bytes:
+    """Segreto HMAC: env TRACKING_SECRET oppure tracking/secret.key (creato al primo uso)."""
+    env_secret = os.environ.get("TRACKING_SECRET")
+    if env_secret:
+        return env_secret.encode("utf-8")
+    path = os.path.join(tracking_dir, SECRET_FILENAME)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+    os.makedirs(tracking_dir, exist_ok=True)
+    secret = secrets.token_bytes(32)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(secret)
+    try:
+        os.link(tmp_path, path)
+    except FileExistsError:
+        # Un altro processo ha vinto la corsa: usiamo il suo segreto.
+        with open(path, "rb") as f:
+            secret = f.read()
+    finally:
+        os.remove(tmp_path)
+    return secret
+
+
+def _signature(secret: bytes, tracking_id: str) -> str:
+    digest = hmac.new(secret, tracking_id.encode("ascii"), hashlib.sha256).digest()
+    return _b64(digest[:SIGNATURE_BYTES])
+
+
+def make_token(secret: bytes, tracking_id: str) -> str:
+    """Token opaco per URL: tracking_id seguito dalla firma HMAC troncata."""
+    return tracking_id + _signature(secret, tracking_id)
+
+
+def verify_token(secret: bytes, token: str | None) -> Optional[str]:
+    """Ritorna il tracking_id se la firma è valida, altrimenti None."""
+    token = (token or "").strip()
+    if len(token) != TOKEN_LEN:
+        return None
+    tracking_id, signature = token[:TRACKING_ID_LEN], token[TRACKING_ID_LEN:]
+    try:
+        expected = _signature(secret, tracking_id)
+    except UnicodeEncodeError:
+        return None
+    if not hmac.compare_digest(expected, signature):
+        return None
+    return tracking_id
+
+
+class TokenIndex:
+    """Indice tracking_id -> (campagna, email) su SQLite (chiave primaria, niente rowid)."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tokens ("
+            "id TEXT PRIMARY KEY, campaign TEXT NOT NULL, email TEXT NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self._conn.commit()
+
+    def add(self, tracking_id: str, campaign: str, email: str) -> None:
+        self._conn.execute(
+            "INSERT OR IGNORE INTO tokens (id, campaign, email) VALUES (?, ?, ?)",
+            (tracking_id, campaign, email),
+        )
+        self._conn.commit()
+
+    def lookup(self, tracking_id: str) -> Optional[Tuple[str, str]]:
+        row = self._conn.execute("SELECT campaign, email FROM tokens WHERE id = ?", (tracking_id,)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def lookup_many(self, tracking_ids: Iterable[str]) -> Dict[str, Tuple[str, str]]:
+        ids = list(dict.fromkeys(tracking_ids))
+        found: Dict[str, Tuple[str, str]] = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for tid, campaign, email in self._conn.execute(
+                f"SELECT id, campaign, email FROM tokens WHERE id IN ({placeholders})", chunk
+            ):
+                found[tid] = (campaign, email)
+        return found
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def open_token_index(tracking_dir: str) -> TokenIndex:
+    return TokenIndex(os.path.join(tracking_dir, TOKENS_DB_FILENAME))
+
+
+def resolve_recipients(values: Iterable[str], secret: bytes | None, index: TokenIndex) -> Dict[str, str]:
+    """Mappa i valori registrati (email legacy, token firmati o tracking_id già verificati) all'email."""
+    resolved: Dict[str, str] = {}
+    pending: Dict[str, str] = {}
+    for value in values:
+        value = (value or "").strip()
+        if not value or value in resolved:
+            continue
+        if "@" in value:
+            resolved[value] = value
+            continue
+        tracking_id = verify_token(secret, value) if secret else None
+        if not tracking_id and len(value) == TRACKING_ID_LEN:
+            tracking_id = value
+        if tracking_id:
+            pending[tracking_id] = value
+    for tracking_id, (_, email) in index.lookup_many(pending).items():
+        resolved[pending[tracking_id]] = email
+    return resolved
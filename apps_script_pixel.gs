@@ -4,6 +4,8 @@
  * 2) In Apps Script incolla questo codice e sostituisci SHEET_ID.
  * 3) Deploy -> Web app -> Access: Anyone.
  * 4) Usa la Web App URL in campaign_config.yaml (tracking_base_url/unsubscribe_base_url).
+ * Con tracking_tokens attivo gli URL contengono un token opaco `t` al posto dell'email:
+ * viene salvato nelle colonne `to`/`email` e risolto lato CLI (fetch-unsubs, stats).
  */
 
 const SHEET_ID = "INSERISCI_GOOGLE_SHEET_ID";
@@ -19,7 +21,7 @@ function handlePixel(e) {
   const sh = getOrCreateSheet(ss, "opens", ["ts","cid","to","ua","ip"]);
   const ts = new Date();
   const cid = e.parameter.cid || "";
-  const to = e.parameter.to || "";
+  const to = e.parameter.t || e.parameter.to || "";
   const ua = e.parameter.ua || "";
   const ip = e.parameter.ip || "";
   sh.appendRow([ts, cid, to, ua, ip]);
@@ -35,7 +37,7 @@ function handleUnsubscribe(e) {
   const ss = SpreadsheetApp.openById(SHEET_ID);
   const sh = getOrCreateSheet(ss, "unsubs", ["ts","email"]);
   const ts = new Date();
-  const email = e.parameter.email || "";
+  const email = e.parameter.t || e.parameter.email || "";
   sh.appendRow([ts, email]);
   return ContentService.createTextOutput("Disiscrizione registrata.")
     .setMimeType(ContentService.MimeType.TEXT);
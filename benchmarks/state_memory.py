@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""Memoria per destinatario dello stato di invio: dict di dict contro StateTable.
+
+Uso: PYTHONPATH=app python benchmarks/state_memory.py --recipients 200000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+from state_utils import StateTable  # noqa: E402
+from tracking_utils import new_tracking_id  # noqa: E402
+
+
+def make_entries(n: int):
+    """Entry come quelle scritte da `send`: quasi tutte inviate, qualche errore."""
+    for i in range(n):
+        entry = {
+            "status": "sent",
+            "last_attempt": "2024-01-01T08:00:00Z",
+            "attempts": 1,
+            "tracking_id": new_tracking_id(),
+            "message_id": format(0x18c0000000000000 + i, "x"),
+            "thread_id": format(0x18c0000000000000 + i, "x"),
+            "last_success_ts": "2024-01-01T08:00:01Z",
+        }
+        if i % 100 == 0:
+            entry.update(status="error", error="<HttpError 503 ...>", last_error_ts="2024-01-01T08:00:01Z")
+        yield f"recipient{i:07d}@example{i % 1000}.com", entry
+
+
+def measure(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    obj = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del obj
+    return size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--recipients", type=int, default=200_000)
+    args = parser.parse_args()
+    n = args.recipients
+    # Lo stato arriva da state.json: il dict di dict va misurato come lo crea json.loads
+    # (stringhe distinte per ogni valore). Le email sono comprese in entrambe le misure.
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "state.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(dict(make_entries(n)), f)
+
+        def load_dicts():
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+
+        as_dicts = measure(load_dicts)
+        as_table = measure(lambda: StateTable.load(path))
+    print(f"destinatari:      {n}")
+    print(f"dict di dict:     {as_dicts / n:8.1f} byte/destinatario ({as_dicts / 2**20:.1f} MiB)")
+    print(f"StateTable:       {as_table / n:8.1f} byte/destinatario ({as_table / 2**20:.1f} MiB)")
+    print(f"riduzione:        {as_dicts / as_table:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
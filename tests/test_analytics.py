@@ -0,0 +1,63 @@
+import json
+import types
+
+import app.manage as manage
+
+
+def test_analytics_rollups_are_incremental(tmp_path, monkeypatch, capsys):
+    manage.DATA_ROOT = str(tmp_path / "data")
+    logs_dir = tmp_path / "data" / "logs" / "example"
+    logs_dir.mkdir(parents=True)
+    (logs_dir / manage.STATE_FILENAME).write_text(json.dumps({
+        "old@legacy.it": {"status": "sent", "last_success_ts": "2024-01-01T07:30:00Z"},
+        "pending@x.com": {"status": "pending"},
+    }))
+    (logs_dir / "send_journal.csv").write_text(
+        "ts,email,event,message_id,thread_id\n"
+        "2024-01-01T08:00:00Z,a@x.com,sent,m1,t1\n"
+        "2024-01-01T08:10:00Z,b@x.com,failed,,\n"
+        "2024-01-01T08:20:00Z,b@x.com,sent,m2,t2\n"
+        "2024-01-01T09:05:00Z,c@y.org,sent,m3,t3\n"
+    )
+    (logs_dir / "opens.csv").write_text(
+        "ts,cid,to,ua,ip\n"
+        "2024-01-01T08:00:30Z,example,a@x.com,ua,ip\n"
+        "2024-01-01T12:00:00Z,example,A@x.com,ua,ip\n"
+    )
+    (logs_dir / "replies.csv").write_text("email,replied,ts\nb@x.com,True,2024-01-01T10:20:00Z\n")
+    (logs_dir / "bounces.csv").write_text("bounced_email\nc@y.org\n")
+
+    args = types.SimpleNamespace(campaign="example", print=False)
+    summary = manage.cmd_analytics(args)
+
+    assert summary["totals"] == {"sent": 4, "opened": 1, "replied": 1, "bounced": 1}
+    assert summary["rates"] == {"open_rate": 0.25, "reply_rate": 0.25, "bounce_rate": 0.25}
+    assert summary["daily"] == {"2024-01-01": {"sent": 4, "opened": 1, "replied": 1}}
+    assert summary["hourly"]["2024-01-01T08"] == {"sent": 2, "opened": 1}
+    assert summary["time_to_first_open"]["count"] == 1 and summary["time_to_first_open"]["p50_le_seconds"] == 60
+    assert summary["time_to_reply"]["p50_le_seconds"] == 3 * 3600
+    assert [d["domain"] for d in summary["domains"]] == ["x.com", "legacy.it", "y.org"]
+    assert summary["domains"][0]["open_rate"] == 0.5
+    assert json.loads((logs_dir / "analytics.json").read_text())["totals"] == summary["totals"]
+
+    # Secondo giro: solo le righe nuove (anche se opens.csv viene riscritto da fetch-opens con lo stesso prefisso);
+    # una riga senza newline è ancora in scrittura e resta per il giro dopo.
+    with open(logs_dir / "opens.csv", "a") as f:
+        f.write("2024-01-02T08:00:00Z,example,c@y.org,ua,ip\n")
+    (logs_dir / "opens.csv").write_text((logs_dir / "opens.csv").read_text())
+    with open(logs_dir / "send_journal.csv", "a") as f:
+        f.write("2024-01-02T09:00:00Z,d@x.com,sent,m4,t4\n2024-01-02T09:01:00Z,e@x.com,se")
+    capsys.readouterr()
+    # state.json è già acquisito: non va più riletto.
+    monkeypatch.setattr(manage.StateTable, "load", lambda *a, **kw: (_ for _ in ()).throw(AssertionError("letto")))
+    summary = manage.cmd_analytics(args)
+
+    event = json.loads(capsys.readouterr().out.splitlines()[-1])
+    assert event["event"] == "analytics_updated"
+    assert event["data"]["new_rows"] == {
+        "state.json": 0, "send_journal.csv": 1, "opens.csv": 1, "opens_local.csv": 0,
+        "replies.csv": 0, "bounces.csv": 0,
+    }
+    assert summary["totals"] == {"sent": 5, "opened": 2, "replied": 1, "bounced": 1}
+    buckets = {b["le_seconds"]: b["count"] for b in summary["time_to_first_open"]["buckets"]}
+    assert buckets[86400] == 1  # c@y.org: quasi 23 ore
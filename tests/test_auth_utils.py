@@ -0,0 +1,51 @@
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
+from google.oauth2.credentials import Credentials
+
+from app.auth_utils import CredentialsManager
+
+
+def _write_token(path, token, expires_in):
+    expiry = (datetime.utcnow() + timedelta(seconds=expires_in)).isoformat() + "Z"
+    path.write_text(json.dumps({
+        "token": token, "refresh_token": "r1", "client_id": "cid", "client_secret": "sec", "expiry": expiry,
+    }))
+
+
+def test_manager_shares_credentials_and_refreshes_once_before_expiry(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_refresh(self, request):
+        time.sleep(0.05)  # finestra in cui altri thread arrivano insieme
+        calls.append(threading.get_ident())
+        self.token = f"fresh-{len(calls)}"
+        self.expiry = datetime.utcnow() + timedelta(hours=1)
+
+    monkeypatch.setattr(Credentials, "refresh", fake_refresh)
+    token_path = tmp_path / "token.json"
+    _write_token(token_path, "old", expires_in=3600)
+
+    manager = CredentialsManager(refresh_margin=300, background=False)
+    creds = manager.get(str(tmp_path), "token.json", ["scope"], run_flow=None)
+    assert creds.token == "old" and calls == []
+    assert manager.get(str(tmp_path), "token.json", ["scope"], run_flow=None) is creds
+    assert 3000 < manager.refresh_due() <= 3300
+
+    # Token vicino alla scadenza: più worker chiedono il refresh insieme, ne parte uno solo.
+    creds.expiry = datetime.utcnow() + timedelta(seconds=60)
+    threads = [threading.Thread(target=creds.refresh, args=(None,)) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(calls) == 1
+    saved = json.loads(token_path.read_text())
+    assert saved["token"] == "fresh-1" and saved["refresh_token"] == "r1"
+    assert not list(tmp_path.glob("*.tmp"))
+
+    creds.expiry = datetime.utcnow() + timedelta(seconds=60)
+    manager.refresh_due()
+    assert creds.token == "fresh-2"
@@ -0,0 +1,132 @@
+import base64
+import json
+import os
+import types
+
+import app.manage as manage
+from app.bounce_utils import HARD, SOFT, parse_dsn
+from app.suppression_utils import load_campaign_suppressions, normalize_email
+
+DSN = b"""From: Mail Delivery Subsystem <mailer-daemon@googlemail.com>
+To: me@example.com
+Subject: Delivery Status Notification (Failure)
+MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="outer"
+
+--outer
+Content-Type: multipart/report; report-type=delivery-status; boundary="inner"
+
+--inner
+Content-Type: text/plain; charset=utf-8
+
+Il messaggio non e' stato consegnato.
+
+--inner
+Content-Type: message/delivery-status
+
+Reporting-MTA: dns; googlemail.com
+Arrival-Date: Mon, 01 Jan 2024 08:00:00 +0000
+
+Final-Recipient: rfc822; alice@example.com
+Action: failed
+Status: 5.1.1
+Diagnostic-Code: smtp; 550-5.1.1 The email account that you tried to reach
+ does not exist.
+
+Final-Recipient: rfc822; full@example.com
+Action: failed
+Status: 5.2.2
+Diagnostic-Code: smtp; 552 5.2.2 Mailbox full
+
+--inner
+Content-Type: text/rfc822-headers
+
+Message-ID: <orig@example.com>
+Subject: Ciao
+
+--inner--
+--outer--
+"""
+
+LEGACY = b"""From: Mail Delivery Subsystem <mailer-daemon@googlemail.com>
+X-Failed-Recipients: bob@example.com
+Subject: Delivery Status Notification (Delay)
+Content-Type: text/plain; charset=utf-8
+
+Temporary failure: 451 4.4.1 No answer from host
+"""
+
+
+def test_parse_dsn_reads_delivery_status_and_classifies():
+    bounces = parse_dsn(DSN)
+    assert [(b.recipient, b.kind, b.status) for b in bounces] == [
+        ("alice@example.com", HARD, "5.1.1"),
+        ("full@example.com", SOFT, "5.2.2"),
+    ]
+    assert bounces[0].diagnostic == "550-5.1.1 The email account that you tried to reach does not exist."
+    assert [(b.recipient, b.kind, b.status) for b in parse_dsn(LEGACY)] == [("bob@example.com", SOFT, "4.4.1")]
+
+
+def test_check_bounces_fetches_raw_only_for_new_messages(tmp_path, monkeypatch, tmp_campaign_dir):
+    import shutil
+
+    data_root = tmp_path / "data"
+    (data_root / "campaigns").mkdir(parents=True)
+    shutil.copytree(tmp_campaign_dir, data_root / "campaigns" / "example")
+    manage.DATA_ROOT = str(data_root)
+    manage.CAMPAIGNS_DIR = os.path.join(manage.DATA_ROOT, "campaigns")
+    logs_dir = data_root / "logs" / "example"
+    logs_dir.mkdir(parents=True)
+    (logs_dir / manage.STATE_FILENAME).write_text(json.dumps({
+        "alice@example.com": {"status": "sent", "message_id": "m-alice", "thread_id": "t-alice"},
+    }))
+    (logs_dir / "bounces.csv").write_text("bounced_email\nold@example.com\n")
+
+    messages = {
+        "b1": {"threadId": "t-alice", "sizeEstimate": 4000, "raw": DSN, "internalDate": "1704096000000"},
+        "b2": {"threadId": "t-other", "sizeEstimate": 9_000_000, "raw": None, "headers": [
+            {"name": "X-Failed-Recipients", "value": "huge@example.com"},
+        ]},
+    }
+    calls = []
+
+    class Service:
+        def users(self):
+            return self
+
+        def messages(self):
+            return self
+
+        def get(self, userId, id, format, metadataHeaders=None):
+            calls.append((id, format))
+            m = messages[id]
+            if format == "raw":
+                body = {"id": id, "raw": base64.urlsafe_b64encode(m["raw"]).decode()}
+            else:
+                body = {"id": id, "threadId": m["threadId"], "sizeEstimate": m["sizeEstimate"],
+                        "internalDate": m.get("internalDate"), "payload": {"headers": m.get("headers", [])}}
+            return types.SimpleNamespace(execute=lambda: body)
+
+    monkeypatch.setattr(manage, "get_service", lambda *_: Service())
+    monkeypatch.setattr(manage, "search_messages", lambda *a, **kw: [{"id": "b1"}, {"id": "b2"}])
+    args = types.SimpleNamespace(campaign="example")
+    manage.cmd_check_bounces(args)
+
+    assert sorted(calls) == [("b1", "metadata"), ("b1", "raw"), ("b2", "metadata")]
+    lines = (logs_dir / "bounces.csv").read_text().splitlines()
+    assert lines[0].startswith("bounced_email,kind,status,")
+    rows = {l.split(",")[0]: l for l in lines[1:]}
+    assert set(rows) == {"old@example.com", "alice@example.com", "full@example.com", "huge@example.com"}
+    assert ",hard,5.1.1,failed," in rows["alice@example.com"]
+    assert "m-alice,t-alice,b1,2024-01-01T08:00:00Z" in rows["alice@example.com"]
+
+    suppressed = load_campaign_suppressions(str(logs_dir), normalize_email)
+    assert suppressed == {"old@example.com", "alice@example.com", "huge@example.com"}
+    index = manage._open_global_suppression()
+    assert "alice@example.com" in index and "full@example.com" not in index
+    index.close()
+
+    calls.clear()
+    manage.cmd_check_bounces(args)
+    assert calls == []
+    assert len((logs_dir / "bounces.csv").read_text().splitlines()) == 5
@@ -19,3 +19,40 @@ def test_render_template_inserts_variables(tmp_campaign_dir):
     assert "Mario" in html
     assert "mario@example.com" in html
     assert "https://tracker/pixel" in html
+
+
+def test_memo_renderer_matches_jinja_and_reuses_renders():
+    from app.render_utils import MemoRenderer
+
+    source = (
+        "<p>Ciao {{ first_name }}</p>{% if vip %}<b>VIP</b>{% endif %}"
+        "<a href=\"{{ unsubscribe_url }}\">{{ email }}</a>{{ email|upper if shout else '' }}"
+    )
+    renderer = MemoRenderer(cache_size=2)
+    rows = [
+        {"first_name": "Mario", "vip": "", "email": "a@x.it", "unsubscribe_url": "https://u/1", "crm_id": "1"},
+        {"first_name": "Mario", "vip": "", "email": "b@x.it", "unsubscribe_url": "https://u/2", "crm_id": "2"},
+        {"first_name": "Anna", "vip": "1", "email": "c@x.it", "unsubscribe_url": "https://u/3", "shout": "1"},
+        {"first_name": "Mario", "email": "d@x.it", "unsubscribe_url": None, "tags": ["x"]},
+    ]
+    for row in rows:
+        assert renderer.render(source, row) == Template(source).render(**row)
+    # `email` è usato anche con un filtro: resta nella chiave, niente sostituzione tardiva.
+    assert renderer.hits == 0
+
+    subject = "Novità per {{ first_name }}"
+    for row in rows:
+        assert renderer.render(subject, row) == Template(subject).render(**row)
+    assert renderer.hits == 2  # solo first_name conta: Mario, Mario (hit), Anna, Mario (hit)
+
+    body = "<p>{{ first_name }}</p><img src=\"{{ tracking_pixel_url }}\">{{ email }}"
+    renderer = MemoRenderer()
+    for i in range(50):
+        row = {"first_name": "Mario", "email": f"u{i}@x.it", "tracking_pixel_url": f"https://t/{i}"}
+        assert renderer.render(body, row) == Template(body).render(**row)
+    assert (renderer.misses, renderer.hits) == (1, 49)
+
+    # Lo stesso render in cache serve righe con e senza i campi tardivi.
+    for row in ({"first_name": "Mario", "email": "x@x.it"}, {"first_name": "Mario", "tracking_pixel_url": "https://t/x"}):
+        assert renderer.render(body, row) == Template(body).render(**row)
+    assert renderer.misses == 1
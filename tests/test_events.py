@@ -0,0 +1,64 @@
+import json
+import os
+import shutil
+import types
+
+import pytest
+from googleapiclient.errors import HttpError
+
+import app.manage as manage
+
+
+def test_send_events_are_stored_and_exported_to_parquet(tmp_path, monkeypatch, tmp_campaign_dir):
+    pq = pytest.importorskip("pyarrow.parquet")
+    import pyarrow as pa
+
+    class FlakyService:
+        calls = 0
+
+        def users(self):
+            return self
+
+        def messages(self):
+            return self
+
+        def send(self, userId, body):
+            def _execute():
+                FlakyService.calls += 1
+                if FlakyService.calls == 1:
+                    raise HttpError(resp=types.SimpleNamespace(status=503, reason="boom"), content=b"{}")
+                return {"id": f"m{FlakyService.calls}", "threadId": "t1"}
+            return types.SimpleNamespace(execute=_execute)
+
+    monkeypatch.setattr(manage, "ensure_label", lambda *a, **kw: None)
+    data_root = tmp_path / "data"
+    (data_root / "campaigns").mkdir(parents=True)
+    manage.DATA_ROOT = str(data_root)
+    manage.CAMPAIGNS_DIR = os.path.join(manage.DATA_ROOT, "campaigns")
+    shutil.copytree(tmp_campaign_dir, data_root / "campaigns" / "example")
+    cfg = {**manage.load_config("example"), "account_name": "acme", "delay_between_emails_seconds": 0}
+
+    manage._run_send("example", cfg, FlakyService(), str(data_root / "logs" / "example"))
+    manage._record_events("bounce", "example", "acme", [{"email": "bob@example.com"}])
+
+    files = os.listdir(data_root / "events")
+    assert len(files) == 1 and files[0].startswith("events-") and files[0].endswith(".jsonl")
+    events = [json.loads(l) for l in open(data_root / "events" / files[0], encoding="utf-8")]
+    # Alice fallisce e va in coda di retry: intanto parte Bob.
+    assert [e["event"] for e in events] == [
+        "send_attempt", "send_retry_scheduled", "send_attempt", "send_success", "send_attempt", "send_success", "bounce",
+    ]
+    assert {e["campaign"] for e in events} == {"example"} and {e["account"] for e in events} == {"acme"}
+    assert events[3]["email"] == "bob@example.com" and events[3]["message_id"] == "m2"
+    assert events[5]["email"] == "alice@example.com" and events[5]["attempt"] == 2
+    assert json.loads(events[1]["detail"])["sleep_seconds"] > 0
+
+    written = manage.cmd_export_events(types.SimpleNamespace(out=None, force=False))
+    table = pq.read_table(written[0])
+    assert table.num_rows == 7
+    for column in ("event", "campaign", "account"):
+        assert pa.types.is_dictionary(table.schema.field(column).type)
+    assert table.column("event").to_pylist()[-1] == "bounce"
+    assert table.column("attempt").to_pylist()[:5] == [1, 1, 1, 1, 2]
+    # Giorno già esportato e non modificato: saltato.
+    assert manage.cmd_export_events(types.SimpleNamespace(out=None, force=False)) == []
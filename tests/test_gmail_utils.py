@@ -1,5 +1,6 @@
 import base64
 import email
+import io
 from app.manage import make_message  # <-- cambia qui
 
 def test_make_message_without_attachment(tmp_path):
@@ -31,3 +32,82 @@ def test_make_message_with_attachment(tmp_path):
     parts = [p for p in parsed.walk() if p.get_content_maintype() != "multipart"]
     filenames = [p.get_filename() for p in parts if p.get_filename()]
     assert "allegato.txt" in filenames
+
+
+
+def test_streamed_attachment_roundtrips_and_matches_media_file(tmp_path):
+    import os
+    from app.manage import make_media_message
+    from app.mime_utils import write_message
+
+    payload = os.urandom(57 * 37 + 5)
+    f = tmp_path / "report.bin"
+    f.write_bytes(payload)
+    msg = make_message("a@example.com", "b@example.com", "Oggetto è", "<p>Ciao</p>", str(f))
+    parsed = email.message_from_bytes(base64.urlsafe_b64decode(msg["raw"]))
+    attachment = [p for p in parsed.walk() if p.get_filename() == "report.bin"][0]
+    assert attachment.get_payload(decode=True) == payload
+    assert all(len(line) <= 76 for line in attachment.get_payload().splitlines())
+
+    media = make_media_message("a@example.com", "b@example.com", "Oggetto", "<p>Ciao</p>", str(f))
+    try:
+        with open(media["media_path"], "rb") as fh:
+            on_disk = fh.read()
+        assert media["size"] == len(on_disk)
+        parsed = email.message_from_bytes(on_disk)
+        attachment = [p for p in parsed.walk() if p.get_filename() == "report.bin"][0]
+        assert attachment.get_payload(decode=True) == payload
+    finally:
+        os.remove(media["media_path"])
+
+    # Blocchi di lettura piccoli producono lo stesso messaggio di quelli grandi.
+    small, large = io.BytesIO(), io.BytesIO()
+    write_message(small, "a@x", "b@x", "S", "<p/>", str(f), chunk_size=57)
+    write_message(large, "a@x", "b@x", "S", "<p/>", str(f))
+    boundary = lambda raw: email.message_from_bytes(raw).get_boundary().encode()
+    assert small.getvalue().replace(boundary(small.getvalue()), b"B") == \
+        large.getvalue().replace(boundary(large.getvalue()), b"B")
+
+
+def test_media_send_resumes_from_last_acknowledged_chunk(tmp_path, monkeypatch):
+    import json
+    import os
+
+    from googleapiclient.discovery import build
+    from googleapiclient.http import HttpMockSequence
+
+    import app.manage as manage
+
+    attachment = tmp_path / "big.bin"
+    attachment.write_bytes(os.urandom(600 * 1024))
+    msg = manage.make_media_message("a@example.com", "b@example.com", "Big", "<p>Hi</p>", str(attachment))
+    size = msg["size"]
+    chunk = manage.MEDIA_CHUNK_GRANULARITY
+
+    http = HttpMockSequence([
+        ({"status": "200", "location": "https://upload.example/session"}, ""),
+        ({"status": "308", "range": f"bytes=0-{chunk - 1}"}, ""),
+        ({"status": "503"}, "unavailable"),
+        ({"status": "308", "range": f"bytes=0-{chunk - 1}"}, ""),
+        ({"status": "308", "range": f"bytes=0-{2 * chunk - 1}"}, ""),
+        ({"status": "200"}, json.dumps({"id": "m1", "threadId": "t1"})),
+    ])
+    service = build("gmail", "v1", http=http, static_discovery=True)
+
+    events = []
+    monkeypatch.setattr(manage, "log_event", lambda level, event, **fields: events.append((event, fields)))
+    sent = manage._send_with_backoff(
+        service, msg, 3, 0, 2, 0, resumable=True, chunk_size=chunk, email="b@example.com", campaign="big",
+    )
+    assert sent == {"id": "m1", "threadId": "t1"}
+    # Il retry dentro la sessione di upload è attribuito al destinatario come quelli in coda.
+    [(event, fields)] = events
+    assert event == "send_retry_scheduled"
+    assert (fields["email"], fields["campaign"]) == ("b@example.com", "big")
+    assert size > 2 * chunk
+    # Dopo il 503 il client chiede lo stato della sessione e rimanda solo dal secondo chunk.
+    status_query = http.request_sequence[3]
+    assert status_query[3]["Content-Range"] == f"bytes */{size}"
+    assert http.request_sequence[4][3]["Content-Range"].startswith(f"bytes {chunk}-")
+    manage._discard_message(msg)
+    assert not os.path.exists(msg["media_path"])
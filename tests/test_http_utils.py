@@ -0,0 +1,78 @@
+import os
+import threading
+import types
+
+import app.manage as manage
+from app.http_utils import PooledHttp
+
+
+def test_pooled_http_bounds_and_reuses_connections(monkeypatch):
+    active = {"now": 0, "max": 0}
+    lock = threading.Lock()
+
+    class FakeHttp:
+        def request(self, uri, method="GET", body=None, headers=None, **kw):
+            with lock:
+                active["now"] += 1
+                active["max"] = max(active["max"], active["now"])
+            threading.Event().wait(0.01)  # time.sleep è neutralizzato dal conftest
+            with lock:
+                active["now"] -= 1
+            return ({"status": "200"}, uri.encode())
+
+        def close(self):
+            pass
+
+    pool = PooledHttp(credentials=None, size=3, timeout=5)
+    monkeypatch.setattr(pool, "_new_http", FakeHttp)
+    results = []
+    threads = [
+        threading.Thread(target=lambda i=i: results.append(pool.request(f"https://x/{i}", "GET")[1]))
+        for i in range(20)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(results) == sorted(f"https://x/{i}".encode() for i in range(20))
+    assert pool.created == 3 and active["max"] <= 3
+    pool.close()
+    assert pool.created == 0
+
+
+def test_check_replies_fetches_threads_concurrently(tmp_path, monkeypatch, tmp_campaign_dir):
+    import shutil
+
+    data_root = tmp_path / "data"
+    (data_root / "campaigns").mkdir(parents=True)
+    shutil.copytree(tmp_campaign_dir, data_root / "campaigns" / "example")
+    manage.DATA_ROOT = str(data_root)
+    manage.CAMPAIGNS_DIR = os.path.join(manage.DATA_ROOT, "campaigns")
+    logs_dir = data_root / "logs" / "example"
+    logs_dir.mkdir(parents=True)
+    (logs_dir / "sent_threads.csv").write_text(
+        "email,threadId\n" + "".join(f"u{i}@x.com,t{i}\n" for i in range(6))
+    )
+
+    class Service:
+        def users(self):
+            return self
+
+        def getProfile(self, userId):
+            return types.SimpleNamespace(execute=lambda: {"emailAddress": "me@x.com"})
+
+    seen_threads = set()
+
+    def fake_get_thread(service, thread_id):
+        seen_threads.add(threading.get_ident())
+        threading.Event().wait(0.02)
+        sender = "Someone <u@x.com>" if thread_id in ("t1", "t4") else "Me <me@x.com>"
+        return {"messages": [{}, {"payload": {"headers": [{"name": "From", "value": sender}]}}]}
+
+    monkeypatch.setattr(manage, "get_service", lambda *_: Service())
+    monkeypatch.setattr(manage, "get_thread", fake_get_thread)
+    manage.cmd_check_replies(types.SimpleNamespace(campaign="example"))
+
+    replies = (logs_dir / "replies.csv").read_text().splitlines()
+    assert replies[1:] == ["u1@x.com,True,", "u4@x.com,True,"]  # ts vuoto: nessun internalDate
+    assert len(seen_threads) > 1
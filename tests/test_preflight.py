@@ -98,3 +98,51 @@ def test_preflight_checks_sheet(tmp_path, tmp_campaign_dir, monkeypatch, capsys)
     summary = next(log for log in logs if log["event"] == "preflight_summary")
     assert summary["data"]["sheet_status"] == "ok"
     assert dummy.called
+
+
+def test_preflight_reports_global_suppression(tmp_path, tmp_campaign_dir, capsys):
+    _setup_project(tmp_path, tmp_campaign_dir)
+    index = manage._open_global_suppression()
+    index.add_many(["Alice@example.com", "someone@else.com"])
+    index.close()
+
+    args = types.SimpleNamespace(campaign="example")
+    manage.cmd_preflight(args)
+
+    logs = _parse_logs(capsys.readouterr().out)
+    data = next(log for log in logs if log["event"] == "preflight_summary")["data"]
+    assert data["globally_suppressed"] == 1
+    assert data["global_suppression_size"] == 2
+
+
+def test_preflight_renders_rows_strictly_in_worker_pool(tmp_path, tmp_campaign_dir, monkeypatch, capsys):
+    _setup_project(tmp_path, tmp_campaign_dir)
+    campaign_dir = Path(manage.DATA_ROOT) / "campaigns" / "example"
+    (campaign_dir / "template.html").write_text("<p>Ciao {{ first_name }} di {{ company }}</p>")
+    rows = ["email,first_name,company,attachment_path"]
+    rows += [f"user{i}@example.com,User{i},Acme,data/attachments/default.pdf" for i in range(5)]
+    rows += ["USER0@example.com,Dup,Acme,", "ghost@example.com,Gio,X,data/nope.pdf"]
+    rows += ["missing@example.com,Mia"]  # riga corta: company mancante
+    (campaign_dir / "recipients.csv").write_text("\n".join(rows) + "\n")
+    monkeypatch.setattr(manage, "PREFLIGHT_RENDER_BATCH", 2)
+
+    manage.cmd_preflight(types.SimpleNamespace(campaign="example", workers=2, sample=0))
+
+    logs = _parse_logs(capsys.readouterr().out)
+    data = next(log for log in logs if log["event"] == "preflight_summary")["data"]
+    assert data["total_recipients"] == 8
+    assert data["duplicate_rows"] == 1
+    assert data["projected_sends"] == 7
+    assert data["rendered_rows"] == 6
+    assert data["render_errors"] == 1
+    assert data["attachment_missing"] == 1
+    assert data["projected_payload_bytes"] > 0
+    errors = [log["data"] for log in logs if log["event"] == "preflight_render_error"]
+    assert errors[0]["email"] == "missing@example.com" and "company" in errors[0]["error"]
+    missing = [log["data"] for log in logs if log["event"] == "preflight_attachment_missing"]
+    assert missing[0]["rows"] == 1
+
+    manage.cmd_preflight(types.SimpleNamespace(campaign="example", workers=1, sample=3))
+    data = next(log for log in _parse_logs(capsys.readouterr().out) if log["event"] == "preflight_summary")["data"]
+    assert data["render_sampled"] is True
+    assert data["rendered_rows"] + data["render_errors"] == 3
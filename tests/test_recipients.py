@@ -0,0 +1,77 @@
+from app.recipients_utils import (
+    CsvRecipientReader, load_resume_checkpoint, save_resume_checkpoint,
+)
+
+
+def test_csv_reader_positions_and_checkpoint_validation(tmp_path):
+    path = tmp_path / "recipients.csv"
+    path.write_bytes('\ufeffemail,note\r\na@x.com,"multi\r\nline"\r\nb@x.com,ok\r\n'.encode("utf-8"))
+
+    reader = CsvRecipientReader(str(path))
+    rows = []
+    for row in reader:
+        rows.append((row["email"], reader.row_end))
+    assert [r[0] for r in rows] == ["a@x.com", "b@x.com"]
+    first_end = rows[0][1]
+
+    resumed = list(CsvRecipientReader(str(path), first_end))
+    assert [r["email"] for r in resumed] == ["b@x.com"]
+
+    checkpoint = tmp_path / "resume.json"
+    save_resume_checkpoint(str(checkpoint), str(path), first_end, 2)
+    assert load_resume_checkpoint(str(checkpoint), str(path)) == (first_end, 2)
+
+    with open(path, "ab") as f:
+        f.write(b"c@x.com,new\r\n")
+    assert load_resume_checkpoint(str(checkpoint), str(path)) == (first_end, None)
+
+    path.write_bytes(path.read_bytes().replace(b"a@x.com", b"z@x.com"))
+    assert load_resume_checkpoint(str(checkpoint), str(path)) == (None, None)
+
+
+def test_recipient_sources_project_columns_and_resume(tmp_path):
+    import json
+
+    import pytest
+
+    from app.recipients_utils import count_rows, find_recipients_file, open_recipient_source, template_columns
+
+    columns = template_columns("<p>{{ first_name }} {% if vip %}VIP{% endif %}</p>", "Ciao {{ city }}")
+    assert columns == {"email", "attachment_path", "first_name", "vip", "city"}
+
+    records = [
+        {"email": f"u{i}@x.com", "first_name": f"U{i}", "city": "Roma", "crm_id": i, "notes": None}
+        for i in range(5)
+    ]
+    jsonl = tmp_path / "recipients.jsonl"
+    jsonl.write_text("".join(json.dumps(r) + "\n" for r in records))
+    assert find_recipients_file(str(tmp_path)) == str(jsonl)
+
+    csv_path = tmp_path / "people.csv"
+    csv_path.write_text("email,first_name,city,crm_id\n" + "".join(
+        f"{r['email']},{r['first_name']},{r['city']},{r['crm_id']}\n" for r in records
+    ))
+    assert find_recipients_file(str(tmp_path), "people.csv") == str(csv_path)
+
+    sources = [str(jsonl), str(csv_path)]
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pylist(records)
+    pq.write_table(table, tmp_path / "recipients.parquet", row_group_size=2)
+    feather.write_feather(table, tmp_path / "recipients.arrow", chunksize=2)
+    sources += [str(tmp_path / "recipients.parquet"), str(tmp_path / "recipients.arrow")]
+
+    for path in sources:
+        reader = open_recipient_source(path, columns=columns)
+        rows = []
+        for row in reader:
+            rows.append((row, reader.row_end))
+        assert [r["email"] for r, _ in rows] == [r["email"] for r in records], path
+        assert set(rows[0][0]) == {"email", "first_name", "city"}, path
+        assert count_rows(path) == 5
+
+        resumed = list(open_recipient_source(path, rows[2][1], columns=columns))
+        assert [r["email"] for r in resumed] == ["u3@x.com", "u4@x.com"], path
+        assert count_rows(path, rows[2][1]) == 2
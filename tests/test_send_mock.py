@@ -1,4 +1,6 @@
+import base64
 import csv
+import email
 import json
 import os
 import shutil
@@ -10,6 +12,13 @@ from googleapiclient.errors import HttpError
 
 import app.manage as manage
 
+def _worker_status(logs_dir):
+    """Lo status.<worker>.json dell'unico worker della campagna."""
+    statuses = manage.read_worker_statuses(str(logs_dir))
+    assert len(statuses) == 1
+    return statuses[0]
+
+
 class DummyService:
     def __init__(self):
         self.sent = []
@@ -203,6 +212,8 @@ def test_cmd_send_stops_after_max_attempts(tmp_path, monkeypatch, tmp_campaign_d
     lines = [l.strip() for l in open(logs_dir / "sent_log.csv") if l.strip()]
     assert "bob@example.com" in lines
     assert "alice@example.com" not in lines
+    # Alice è scartata in modo definitivo: il checkpoint la supera.
+    assert json.loads((logs_dir / manage.RESUME_FILENAME).read_text())["row"] == 2
 
 
 def test_cmd_send_uses_default_attachment_when_missing(tmp_path, monkeypatch, tmp_campaign_dir):
@@ -308,3 +319,647 @@ def test_cmd_send_test_uses_first_row_but_custom_recipient(tmp_path, monkeypatch
 
     assert captured_kwargs["to"] == "test@example.com"
     assert "alice" in captured_kwargs["html_body"].lower() or "bob" in captured_kwargs["html_body"].lower()
+
+
+def test_cmd_send_dedupes_and_suppresses_before_render(tmp_path, monkeypatch, tmp_campaign_dir):
+    dummy = DummyService()
+    monkeypatch.setattr(manage, "get_service", lambda *_: dummy)
+    monkeypatch.setattr(manage, "ensure_label", lambda *a, **kw: "lbl")
+    monkeypatch.setattr(manage, "add_labels", lambda *a, **kw: None)
+
+    data_root = tmp_path / "data"
+    (data_root / "campaigns").mkdir(parents=True)
+    os.environ["DATA_ROOT"] = str(data_root)
+    os.environ["CREDS_ROOT"] = str(tmp_path / "creds")
+    os.makedirs(os.environ["CREDS_ROOT"], exist_ok=True)
+    manage.DATA_ROOT = os.environ["DATA_ROOT"]
+    manage.CREDS_ROOT = os.environ["CREDS_ROOT"]
+    manage.CAMPAIGNS_DIR = os.path.join(manage.DATA_ROOT, "campaigns")
+
+    shutil.copytree(tmp_campaign_dir, data_root / "campaigns" / "example")
+    recipients_path = data_root / "campaigns" / "example" / "recipients.csv"
+    with open(recipients_path, "a", encoding="utf-8") as f:
+        f.write(" Bob@Example.com ,Bobby,\n")
+        f.write("carol@example.com,Carol,\n")
+
+    logs_dir = data_root / "logs" / "example"
+    logs_dir.mkdir(parents=True, exist_ok=True)
+    with open(logs_dir / "bounces.csv", "w", encoding="utf-8") as f:
+        f.write("bounced_email\nCAROL@example.com\n")
+
+    rendered = []
+    real_render = manage.render_template
+
+    def spy_render(tpl_path, ctx):
+        rendered.append(ctx["email"])
+        return real_render(tpl_path, ctx)
+
+    monkeypatch.setattr(manage, "render_template", spy_render)
+
+    args = types.SimpleNamespace(campaign="example")
+    manage.cmd_send(args)
+
+    assert rendered == ["alice@example.com", "bob@example.com"]
+    assert len(dummy.sent) == 2
+    state = json.load(open(logs_dir / manage.STATE_FILENAME))
+    assert "carol@example.com" not in state
+
+
+def test_cmd_send_resumes_from_checkpoint_offset(tmp_path, monkeypatch, tmp_campaign_dir):
+    dummy = DummyService()
+    monkeypatch.setattr(manage, "get_service", lambda *_: dummy)
+    monkeypatch.setattr(manage, "ensure_label", lambda *a, **kw: "lbl")
+    monkeypatch.setattr(manage, "add_labels", lambda *a, **kw: None)
+
+    data_root = tmp_path / "data"
+    (data_root / "campaigns").mkdir(parents=True)
+    os.environ["DATA_ROOT"] = str(data_root)
+    os.environ["CREDS_ROOT"] = str(tmp_path / "creds")
+    os.makedirs(os.environ["CREDS_ROOT"], exist_ok=True)
+    manage.DATA_ROOT = os.environ["DATA_ROOT"]
+    manage.CREDS_ROOT = os.environ["CREDS_ROOT"]
+    manage.CAMPAIGNS_DIR = os.path.join(manage.DATA_ROOT, "campaigns")
+
+    shutil.copytree(tmp_campaign_dir, data_root / "campaigns" / "example")
+    cfg_path = data_root / "campaigns" / "example" / "campaign_config.yaml"
+    cfg = yaml.safe_load(open(cfg_path))
+    cfg["daily_send_limit"] = 1
+    with open(cfg_path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(cfg, f)
+
+    args = types.SimpleNamespace(campaign="example")
+    manage.cmd_send(args)
+
+    logs_dir = data_root / "logs" / "example"
+    checkpoint = json.load(open(logs_dir / "resume.json"))
+    assert checkpoint["row"] == 1
+    assert checkpoint["total_rows"] == 2
+
+    # Se la riga di Alice venisse riletta verrebbe rispedita: il resume deve saltarla con seek.
+    state = json.load(open(logs_dir / manage.STATE_FILENAME))
+    state["alice@example.com"]["status"] = "pending"
+    with open(logs_dir / manage.STATE_FILENAME, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    (logs_dir / "sent_log.csv").write_text("", encoding="utf-8")
+    recipients_path = data_root / "campaigns" / "example" / "recipients.csv"
+    with open(recipients_path, "a", encoding="utf-8") as f:
+        f.write("carol@example.com,Carol,\n")
+
+    dummy.sent.clear()
+    shutil.rmtree(data_root / manage.LEDGER_DIRNAME)  # finestra di 24 ore trascorsa
+    manage.cmd_send(args)
+    assert len(dummy.sent) == 1
+    raw = base64.urlsafe_b64decode(dummy.sent[0]["raw"])
+    assert b"bob@example.com" in raw
+    assert json.load(open(logs_dir / "resume.json"))["row"] == 2
+
+
+def test_cmd_send_builds_messages_in_process_pool(tmp_path, monkeypatch, tmp_campaign_dir):
+    dummy = DummyService()
+    monkeypatch.setattr(manage, "get_service", lambda *_: dummy)
+    monkeypatch.setattr(manage, "ensure_label", lambda *a, **kw: "lbl")
+    monkeypatch.setattr(manage, "add_labels", lambda *a, **kw: None)
+
+    data_root = tmp_path / "data"
+    (data_root / "campaigns").mkdir(parents=True)
+    os.environ["DATA_ROOT"] = str(data_root)
+    os.environ["CREDS_ROOT"] = str(tmp_path / "creds")
+    os.makedirs(os.environ["CREDS_ROOT"], exist_ok=True)
+    manage.DATA_ROOT = os.environ["DATA_ROOT"]
+    manage.CREDS_ROOT = os.environ["CREDS_ROOT"]
+    manage.CAMPAIGNS_DIR = os.path.join(manage.DATA_ROOT, "campaigns")
+
+    shutil.copytree(tmp_campaign_dir, data_root / "campaigns" / "example")
+    cfg_path = data_root / "campaigns" / "example" / "campaign_config.yaml"
+    cfg = yaml.safe_load(open(cfg_path))
+    cfg["mime_workers"] = 2
+    cfg["mime_queue_size"] = 1
+    with open(cfg_path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(cfg, f)
+
+    manage.cmd_send(types.SimpleNamespace(campaign="example"))
+
+    recipients = []
+    for body in dummy.sent:
+        parsed = email.message_from_bytes(base64.urlsafe_b64decode(body["raw"]))
+        recipients.append(parsed["To"])
+    assert recipients == ["alice@example.com", "bob@example.com"]
+
+
+def test_cmd_send_simulate_projects_days_without_sending(tmp_path, monkeypatch, tmp_campaign_dir, capsys):
+    def no_service(*_):
+        raise AssertionError("la simulazione non deve usare Gmail")
+
+    monkeypatch.setattr(manage, "get_service", no_service)
+    data_root = tmp_path / "data"
+    (data_root / "campaigns").mkdir(parents=True)
+    manage.DATA_ROOT = str(data_root)
+    manage.CREDS_ROOT = str(tmp_path / "creds")
+    manage.CAMPAIGNS_DIR = os.path.join(manage.DATA_ROOT, "campaigns")
+    campaign_dir = data_root / "campaigns" / "example"
+    shutil.copytree(tmp_campaign_dir, campaign_dir)
+    cfg = yaml.safe_load(open(campaign_dir / "campaign_config.yaml"))
+    cfg.update({"daily_send_limit": 2, "delay_between_emails_seconds": 60, "batch_size": 2})
+    (campaign_dir / "campaign_config.yaml").write_text(yaml.safe_dump(cfg))
+    rows = "".join(f"user{i}@example.com,User{i},\n" for i in range(5))
+    (campaign_dir / "recipients.csv").write_text("email,first_name,attachment_path\n" + rows)
+
+    args = types.SimpleNamespace(
+        campaign="example", simulate=True, sim_start="2024-01-01T08:00:00Z", sim_latency=1.0,
+        sim_error_rate=0.0, sim_fatal_error_rate=0.0, sim_seed=1, sim_max_days=30,
+    )
+    report = manage.cmd_send(args)
+
+    assert [d["sent"] for d in report["per_day"]] == [2, 2, 1]
+    assert [d["date"] for d in report["per_day"]] == ["2024-01-01", "2024-01-02", "2024-01-03"]
+    assert report["start"] == "2024-01-01T08:00:00Z"
+    assert report["finish"].startswith("2024-01-03T08:0")
+    assert report["sent"] == 5 and report["completed"]
+    assert not (data_root / "logs").exists()
+    out = [json.loads(l) for l in capsys.readouterr().out.splitlines() if l.strip()]
+    assert [e["event"] for e in out] == ["send_simulation_report"]
+
+
+def test_run_send_circuit_breaker_probes_without_burning_attempts(tmp_path, monkeypatch, tmp_campaign_dir, capsys):
+    class OutageService(DummyService):
+        def __init__(self, failures):
+            super().__init__()
+            self.failures = failures
+            self.calls = 0
+
+        def send(self, userId, body):
+            def _execute():
+                self.calls += 1
+                if self.calls <= self.failures:
+                    raise _http_error(503)
+                self.sent.append(body)
+                return {"id": f"m{self.calls}", "threadId": "t1"}
+            return types.SimpleNamespace(execute=_execute)
+
+    monkeypatch.setattr(manage, "ensure_label", lambda *a, **kw: "lbl")
+    monkeypatch.setattr(manage, "add_labels", lambda *a, **kw: None)
+    data_root = tmp_path / "data"
+    (data_root / "campaigns").mkdir(parents=True)
+    manage.DATA_ROOT = str(data_root)
+    manage.CAMPAIGNS_DIR = os.path.join(manage.DATA_ROOT, "campaigns")
+    shutil.copytree(tmp_campaign_dir, data_root / "campaigns" / "example")
+    cfg = manage.load_config("example")
+    cfg.update({
+        "max_retry_attempts": 2, "global_error_threshold_for_cooldown": 1, "global_error_cooldown_seconds": 10,
+        "circuit_breaker_multiplier": 2, "delay_between_emails_seconds": 0,
+    })
+    service = OutageService(failures=6)
+    clock = manage.VirtualClock()
+    logs_dir = data_root / "logs" / "example"
+
+    result = manage._run_send("example", cfg, service, str(logs_dir), clock=clock)
+
+    # Alice e Bob falliscono e vanno in coda; il retry di Alice esaurisce i suoi 2 tentativi e apre il
+    # circuito (conta il contatto, non il tentativo), poi 3 sonde singole falliscono (finestre 10, 20, 40, 80 s).
+    assert result["sent"] == 2 and result["errors"] == 0
+    assert result["circuit_opens"] == 4
+    assert result["circuit_open_seconds"] == 150
+    state = json.loads((logs_dir / manage.STATE_FILENAME).read_text())
+    # Le sonde non consumano tentativi: restano il primo invio e il retry di ciascuno.
+    assert [e["attempts"] for e in state.values()] == [2, 2]
+    events = [json.loads(l)["event"] for l in capsys.readouterr().out.splitlines() if l.strip()]
+    circuit = [e for e in events if e.startswith("circuit_")]
+    assert circuit == ["circuit_open", "circuit_half_open"] * 4 + ["circuit_closed"]
+
+    # Disservizio più lungo di circuit_breaker_max_outage_seconds: il giro si ferma senza consumare tentativi.
+    (logs_dir / manage.STATE_FILENAME).unlink()
+    (logs_dir / "sent_log.csv").unlink()
+    (logs_dir / manage.RESUME_FILENAME).unlink()
+    (logs_dir / manage.CLAIMS_FILENAME).unlink()
+    cfg["circuit_breaker_max_outage_seconds"] = 60
+    cfg["max_retry_attempts"] = 1
+    result = manage._run_send("example", cfg, OutageService(failures=100), str(logs_dir), clock=clock)
+    assert result["circuit_aborted"] and result["sent"] == 0 and result["errors"] == 0
+    state = json.loads((logs_dir / manage.STATE_FILENAME).read_text())
+    assert state["alice@example.com"] == {**state["alice@example.com"], "status": "pending", "attempts": 0}
+
+
+def test_run_send_until_done_waits_for_rolling_window_shared_by_account(tmp_path, monkeypatch, tmp_campaign_dir, capsys):
+    from datetime import datetime, timedelta
+
+    monkeypatch.setattr(manage, "ensure_label", lambda *a, **kw: "lbl")
+    monkeypatch.setattr(manage, "add_labels", lambda *a, **kw: None)
+    data_root = tmp_path / "data"
+    (data_root / "campaigns").mkdir(parents=True)
+    manage.DATA_ROOT = str(data_root)
+    manage.CAMPAIGNS_DIR = os.path.join(manage.DATA_ROOT, "campaigns")
+    shutil.copytree(tmp_campaign_dir, data_root / "campaigns" / "example")
+    cfg = manage.load_config("example")
+    cfg.update({"daily_send_limit": 2, "delay_between_emails_seconds": 0})
+
+    # Un'altra campagna dello stesso account ha già spedito un'ora fa.
+    start = datetime(2024, 1, 1, 9, 0, 0)
+    ledger = manage.open_send_ledger(manage._ledger_dir(), cfg.get("account_name", "default"))
+    ledger.confirm(ledger.reserve(start - timedelta(hours=1), 2, "other"), start - timedelta(hours=1))
+    ledger.close()
+
+    dummy = DummyService()
+    clock = manage.VirtualClock(start)
+    logs_dir = data_root / "logs" / "example"
+    result = manage._run_send("example", cfg, dummy, str(logs_dir), clock=clock, until_done=True)
+
+    assert result["sent"] == 2 and not result["limit_reached"]
+    assert clock.now() == start + timedelta(hours=23)
+    events = [json.loads(l) for l in capsys.readouterr().out.splitlines() if l.strip()]
+    waits = [e["data"] for e in events if e["event"] == "daily_limit_wait"]
+    assert [w["resume_at"] for w in waits] == ["2024-01-02T08:00:00Z"]
+
+    # Senza --until-done un nuovo giro non aggira il limite: la finestra è ancora piena.
+    (logs_dir / manage.STATE_FILENAME).unlink()
+    (logs_dir / "sent_log.csv").unlink()
+    (logs_dir / manage.RESUME_FILENAME).unlink()
+    (logs_dir / manage.CLAIMS_FILENAME).unlink()
+    dummy.sent.clear()
+    result = manage._run_send("example", cfg, dummy, str(logs_dir), clock=clock)
+    assert result["sent"] == 0 and result["limit_reached"]
+    assert dummy.sent == []
+
+
+def test_run_send_shares_campaign_with_other_workers_through_leases(tmp_path, monkeypatch, tmp_campaign_dir, capsys):
+    from app.lease_utils import LeaseStore
+
+    monkeypatch.setattr(manage, "ensure_label", lambda *a, **kw: "lbl")
+    monkeypatch.setattr(manage, "add_labels", lambda *a, **kw: None)
+    data_root = tmp_path / "data"
+    (data_root / "campaigns").mkdir(parents=True)
+    manage.DATA_ROOT = str(data_root)
+    manage.CAMPAIGNS_DIR = os.path.join(manage.DATA_ROOT, "campaigns")
+    shutil.copytree(tmp_campaign_dir, data_root / "campaigns" / "example")
+    cfg = {**manage.load_config("example"), "delay_between_emails_seconds": 0}
+    logs_dir = data_root / "logs" / "example"
+    logs_dir.mkdir(parents=True)
+    claims_path = str(logs_dir / manage.CLAIMS_FILENAME)
+
+    # Un altro worker ha preso Alice e, durante il giro, salva in state.json un suo invio.
+    other = LeaseStore(claims_path, owner="other-worker")
+    assert other.claim("alice@example.com") == "claimed"
+
+    # Un altro ancora ha salvato un invio solo in claims.db, senza aver unito state.json.
+    assert other.claim("yan@example.com") == "claimed"
+    other.save_entry("yan@example.com", {"status": "sent", "attempts": 1})
+
+    class OtherWorkerService(DummyService):
+        def send(self, userId, body):
+            state_path = logs_dir / manage.STATE_FILENAME
+            state = manage.load_send_state(str(state_path))
+            state["zed@example.com"] = {"status": "sent", "attempts": 1}
+            manage.save_send_state(str(state_path), state)
+            return super().send(userId, body)
+
+    writes = []
+    write_json = manage.StateTable.write_json
+    monkeypatch.setattr(manage.StateTable, "write_json", lambda self, path: (writes.append(path), write_json(self, path)))
+    dummy = OtherWorkerService()
+    result = manage._run_send("example", cfg, dummy, str(logs_dir))
+
+    assert result["sent"] == 1
+    assert b"bob@example.com" in base64.urlsafe_b64decode(dummy.sent[0]["raw"])
+    # I tentativi salvano la sola entry in claims.db: state.json si riscrive una volta, a fine giro.
+    assert len(writes) == 1
+    state = json.loads((logs_dir / manage.STATE_FILENAME).read_text())
+    assert state["bob@example.com"]["status"] == "sent"
+    assert state["zed@example.com"]["status"] == "sent"
+    assert state["yan@example.com"]["status"] == "sent"
+    assert "alice@example.com" not in state
+    assert json.loads((logs_dir / manage.RESUME_FILENAME).read_text())["row"] == 0  # il checkpoint non supera Alice
+
+    # Il worker cade dopo due tentativi su Alice: scaduto il lease, Alice torna disponibile
+    # con i suoi tentativi; Bob resta concluso.
+    other.save_entry("alice@example.com", {"status": "error", "attempts": 2})
+    LeaseStore(claims_path, owner="other-worker", lease_seconds=-1).renew("alice@example.com")
+    dummy.sent.clear()
+    capsys.readouterr()
+    result = manage._run_send("example", cfg, DummyService(), str(logs_dir))
+    assert result["sent"] == 1
+    events = [json.loads(l) for l in capsys.readouterr().out.splitlines() if l.strip()]
+    assert [e["data"]["claims_taken_over"] for e in events if e["event"] == "campaign_send_complete"] == [1]
+    state = json.loads((logs_dir / manage.STATE_FILENAME).read_text())
+    assert {k: e["status"] for k, e in state.items()} == {
+        "alice@example.com": "sent", "bob@example.com": "sent", "zed@example.com": "sent", "yan@example.com": "sent",
+    }
+    assert state["alice@example.com"]["attempts"] == 3
+    assert other.claim("alice@example.com") == "done"
+    rows = list(csv.DictReader(open(logs_dir / "sent_threads.csv", encoding="utf-8")))
+    assert [r["email"] for r in rows] == ["bob@example.com", "alice@example.com"]
+
+
+def test_run_send_renews_claim_after_circuit_wait_longer_than_lease(tmp_path, monkeypatch, tmp_campaign_dir, capsys):
+    from app.lease_utils import LeaseStore
+
+    monkeypatch.setattr(manage, "ensure_label", lambda *a, **kw: "lbl")
+    monkeypatch.setattr(manage, "add_labels", lambda *a, **kw: None)
+    data_root = tmp_path / "data"
+    (data_root / "campaigns").mkdir(parents=True)
+    manage.DATA_ROOT = str(data_root)
+    manage.CAMPAIGNS_DIR = os.path.join(manage.DATA_ROOT, "campaigns")
+    shutil.copytree(tmp_campaign_dir, data_root / "campaigns" / "example")
+    cfg = {
+        **manage.load_config("example"), "delay_between_emails_seconds": 0, "claim_lease_seconds": 900,
+        "global_error_threshold_for_cooldown": 1, "global_error_cooldown_seconds": 1000, "max_retry_attempts": 1,
+    }
+    logs_dir = data_root / "logs" / "example"
+    claims_path = str(logs_dir / manage.CLAIMS_FILENAME)
+
+    class StealingClock(manage.VirtualClock):
+        def sleep(self, seconds):
+            super().sleep(seconds)
+            if seconds >= 1000:
+                # Durante la pausa del circuito il lease di Alice scade: un altro worker la prende e la invia.
+                other = LeaseStore(claims_path, owner="other-worker", clock=self)
+                assert other.claim("alice@example.com") == "claimed"
+                # ...e ha già unito il suo invio in state.json.
+                state_path = logs_dir / manage.STATE_FILENAME
+                state = manage.load_send_state(str(state_path))
+                state["alice@example.com"] = {"status": "sent", "attempts": 1}
+                manage.save_send_state(str(state_path), state)
+                other.mark_merged()
+                other.close()
+
+    class FlakyOnce(DummyService):
+        def __init__(self):
+            super().__init__()
+            self.failed = False
+
+        def send(self, userId, body):
+            if not self.failed:
+                self.failed = True
+                return types.SimpleNamespace(execute=lambda: (_ for _ in ()).throw(_http_error(503)))
+            return super().send(userId, body)
+
+    service = FlakyOnce()
+    result = manage._run_send("example", cfg, service, str(logs_dir), clock=StealingClock())
+
+    # Alice non parte due volte: il lease perso si scopre al rinnovo dopo l'attesa; Bob (sonda) sì.
+    assert result["sent"] == 1
+    assert [b"bob@example.com" in base64.urlsafe_b64decode(b["raw"]) for b in service.sent] == [True]
+    events = [json.loads(l)["event"] for l in capsys.readouterr().out.splitlines() if l.strip()]
+    assert events.count("claim_lost") == 1
+    # L'entry del nuovo proprietario prevale su quella locale in state.json.
+    state = json.loads((logs_dir / manage.STATE_FILENAME).read_text())
+    assert state["alice@example.com"]["status"] == "sent"
+
+
+def test_stage_creates_drafts_and_send_only_sends_them(tmp_path, monkeypatch, tmp_campaign_dir, capsys):
+    class DraftService(DummyService):
+        def __init__(self):
+            super().__init__()
+            self.drafts_created = []
+            self.drafts_sent = []
+
+        def drafts(self):
+            return self
+
+        def create(self, userId, body, media_body=None):
+            if "message" not in body:
+                return super().create(userId, body)
+            self.drafts_created.append(body["message"])
+            draft_id = f"r-{len(self.drafts_created)}"
+            return types.SimpleNamespace(execute=lambda: {"id": draft_id, "message": {"id": "x"}})
+
+        def send(self, userId, body):
+            if "id" not in body:
+                return super().send(userId, body)
+            self.drafts_sent.append(body["id"])
+            if body["id"] == "r-2":
+                return types.SimpleNamespace(execute=lambda: (_ for _ in ()).throw(_http_error(404)))
+            return types.SimpleNamespace(execute=lambda: {"id": "m-" + body["id"], "threadId": "t-" + body["id"]})
+
+    monkeypatch.setattr(manage, "ensure_label", lambda *a, **kw: "lbl")
+    monkeypatch.setattr(manage, "add_labels", lambda *a, **kw: None)
+    data_root = tmp_path / "data"
+    (data_root / "campaigns").mkdir(parents=True)
+    manage.DATA_ROOT = str(data_root)
+    manage.CAMPAIGNS_DIR = os.path.join(manage.DATA_ROOT, "campaigns")
+    shutil.copytree(tmp_campaign_dir, data_root / "campaigns" / "example")
+    cfg = {**manage.load_config("example"), "delay_between_emails_seconds": 0}
+    logs_dir = data_root / "logs" / "example"
+    service = DraftService()
+
+    result = manage._run_stage("example", cfg, service, str(logs_dir))
+    assert result["staged"] == 2 and result["errors"] == 0
+    state = json.loads((logs_dir / manage.STATE_FILENAME).read_text())
+    assert [e["draft_id"] for e in state.values()] == ["r-1", "r-2"]
+    assert all(e["status"] == "pending" and e["attempts"] == 0 for e in state.values())
+    assert b"alice@example.com" in base64.urlsafe_b64decode(service.drafts_created[0]["raw"])
+    # Già in bozza: un secondo stage non ricarica niente.
+    assert manage._run_stage("example", cfg, service, str(logs_dir))["already_staged"] == 2
+
+    # Nella finestra di invio solo drafts.send; la bozza di Bob è stata cancellata e viene ricostruita.
+    renders = []
+    original_render = manage.render_template
+    monkeypatch.setattr(manage, "render_template", lambda *a: renders.append(a) or original_render(*a))
+    result = manage._run_send("example", cfg, service, str(logs_dir))
+    assert result["sent"] == 2 and result["errors"] == 0
+    assert service.drafts_sent == ["r-1", "r-2"]
+    assert len(service.sent) == 1 and b"bob@example.com" in base64.urlsafe_b64decode(service.sent[0]["raw"])
+    assert len(renders) == 1
+    state = json.loads((logs_dir / manage.STATE_FILENAME).read_text())
+    assert state["alice@example.com"]["message_id"] == "m-r-1"
+    assert {k: (e["status"], e["attempts"], "draft_id" in e) for k, e in state.items()} == {
+        "alice@example.com": ("sent", 1, False), "bob@example.com": ("sent", 1, False),
+    }
+    events = [json.loads(l) for l in capsys.readouterr().out.splitlines() if l.strip()]
+    assert [e["data"]["draft_id"] for e in events if e["event"] == "draft_missing"] == ["r-2"]
+
+
+def test_run_send_maintains_status_file_for_status_command(tmp_path, monkeypatch, tmp_campaign_dir, capsys):
+    from datetime import datetime
+
+    monkeypatch.setattr(manage, "ensure_label", lambda *a, **kw: "lbl")
+    monkeypatch.setattr(manage, "add_labels", lambda *a, **kw: None)
+    data_root = tmp_path / "data"
+    (data_root / "campaigns").mkdir(parents=True)
+    manage.DATA_ROOT = str(data_root)
+    manage.CAMPAIGNS_DIR = os.path.join(manage.DATA_ROOT, "campaigns")
+    shutil.copytree(tmp_campaign_dir, data_root / "campaigns" / "example")
+    cfg = {**manage.load_config("example"), "delay_between_emails_seconds": 60, "daily_send_limit": 1}
+    logs_dir = data_root / "logs" / "example"
+    seen = []
+
+    class PeekingService(DummyService):
+        def send(self, userId, body):
+            seen.append(_worker_status(logs_dir))
+            return super().send(userId, body)
+
+    clock = manage.VirtualClock(datetime(2024, 1, 1, 9, 0, 0))
+    manage._run_send("example", cfg, PeekingService(), str(logs_dir), clock=clock, until_done=True)
+
+    # Durante il giro: stato letto senza toccare CSV né state.json.
+    assert seen[0]["state"] == "running" and seen[0]["remaining"] == 2 and seen[0]["daily_remaining"] == 1
+    assert seen[1]["counts"] == {"sent": 1, "pending": 1} and seen[1]["sent_this_run"] == 1
+    assert seen[1]["state"] == "waiting" and seen[1]["next_send_at"] == "2024-01-02T09:00:00Z"
+    status = _worker_status(logs_dir)
+    assert status["state"] == "finished" and status["counts"] == {"sent": 2} and status["remaining"] == 0
+    assert status["eta"] == status["updated_at"] == "2024-01-02T09:01:00Z"
+
+    capsys.readouterr()
+    (logs_dir / manage.STATE_FILENAME).unlink()
+    (logs_dir / "sent_log.csv").unlink()
+    (logs_dir / manage.RESUME_FILENAME).unlink()
+    (logs_dir / manage.CLAIMS_FILENAME).unlink()
+    manage._run_send("example", cfg, DummyService(), str(logs_dir), clock=clock)
+    capsys.readouterr()
+    statuses = manage.cmd_status(types.SimpleNamespace(campaign=None, all=True, json=False))
+    assert [s["state"] for s in statuses] == ["limit_reached"]
+    # La quota di 1 invio è già usata da Bob: si riparte quando il suo invio esce dalla finestra.
+    assert capsys.readouterr().out.startswith(
+        "example: limit_reached | pending=1 | restanti=2 | quota=0/1 | velocità=-/h | prossimo=2024-01-03T09:00:00Z"
+    )
+
+
+def test_run_send_retries_from_delay_queue_without_blocking_others(tmp_path, monkeypatch, tmp_campaign_dir, capsys):
+    class AliceFlaky(DummyService):
+        def __init__(self, failures):
+            super().__init__()
+            self.failures = failures
+            self.log = []
+
+        def send(self, userId, body):
+            to = b"alice" if b"alice@example.com" in base64.urlsafe_b64decode(body["raw"]) else b"other"
+            self.log.append((round(clock.monotonic(), 1), to))
+            if to == b"alice" and self.failures > 0:
+                self.failures -= 1
+                return types.SimpleNamespace(execute=lambda: (_ for _ in ()).throw(_http_error(503)))
+            return super().send(userId, body)
+
+    monkeypatch.setattr(manage, "ensure_label", lambda *a, **kw: "lbl")
+    monkeypatch.setattr(manage, "add_labels", lambda *a, **kw: None)
+    monkeypatch.setattr(manage.random, "uniform", lambda a, b: 0)
+    data_root = tmp_path / "data"
+    (data_root / "campaigns").mkdir(parents=True)
+    manage.DATA_ROOT = str(data_root)
+    manage.CAMPAIGNS_DIR = os.path.join(manage.DATA_ROOT, "campaigns")
+    shutil.copytree(tmp_campaign_dir, data_root / "campaigns" / "example")
+    with open(data_root / "campaigns" / "example" / "recipients.csv", "a", encoding="utf-8") as f:
+        f.write("carol@example.com,Carol,\n")
+    cfg = {
+        **manage.load_config("example"), "delay_between_emails_seconds": 0, "max_retry_attempts": 3,
+        "retry_backoff_initial_seconds": 5, "retry_backoff_multiplier": 2, "max_attempts_per_contact": 5,
+    }
+    logs_dir = data_root / "logs" / "example"
+
+    clock = manage.VirtualClock()
+    service = AliceFlaky(failures=2)
+    result = manage._run_send("example", cfg, service, str(logs_dir), clock=clock)
+
+    # Bob e Carol partono subito; Alice rientra dopo 5 s e poi dopo altri 10 s.
+    assert service.log == [(0, b"alice"), (0, b"other"), (0, b"other"), (5, b"alice"), (15, b"alice")]
+    assert result["sent"] == 3 and result["errors"] == 0
+    state = json.loads((logs_dir / manage.STATE_FILENAME).read_text())
+    assert state["alice@example.com"]["status"] == "sent" and state["alice@example.com"]["attempts"] == 3
+    assert json.loads((logs_dir / manage.RESUME_FILENAME).read_text())["row"] == 3
+
+    # max_attempts_per_contact vale anche per i retry in coda.
+    for name in (manage.STATE_FILENAME, "sent_log.csv", manage.RESUME_FILENAME, manage.CLAIMS_FILENAME):
+        (logs_dir / name).unlink()
+    shutil.rmtree(data_root / manage.LEDGER_DIRNAME)
+    capsys.readouterr()
+    cfg["max_attempts_per_contact"] = 2
+    result = manage._run_send("example", cfg, AliceFlaky(failures=10), str(logs_dir), clock=manage.VirtualClock())
+    assert result["sent"] == 2 and result["errors"] == 1
+    events = [json.loads(l) for l in capsys.readouterr().out.splitlines() if l.strip()]
+    assert [e["data"]["attempts"] for e in events if e["event"] == "send_failed"] == [2]
+    assert json.loads((logs_dir / manage.RESUME_FILENAME).read_text())["row"] == 0
+
+
+def test_status_remaining_counts_rows_before_resume_checkpoint_as_done(tmp_path, monkeypatch, tmp_campaign_dir):
+    monkeypatch.setattr(manage, "ensure_label", lambda *a, **kw: "lbl")
+    monkeypatch.setattr(manage, "add_labels", lambda *a, **kw: None)
+    data_root = tmp_path / "data"
+    (data_root / "campaigns").mkdir(parents=True)
+    manage.DATA_ROOT = str(data_root)
+    manage.CAMPAIGNS_DIR = os.path.join(manage.DATA_ROOT, "campaigns")
+    shutil.copytree(tmp_campaign_dir, data_root / "campaigns" / "example")
+    recipients = data_root / "campaigns" / "example" / "recipients.csv"
+    with open(recipients, "a", encoding="utf-8") as f:
+        f.write("ALICE@example.com,Alice,\ncarol@example.com,Carol,\n")
+    logs_dir = data_root / "logs" / "example"
+    logs_dir.mkdir(parents=True)
+    (logs_dir / "unsubs.csv").write_text("ts,email\n2024-01-01,carol@example.com\n", encoding="utf-8")
+    cfg = {**manage.load_config("example"), "delay_between_emails_seconds": 0}
+    seen = []
+
+    class PeekingService(DummyService):
+        def send(self, userId, body):
+            seen.append(_worker_status(logs_dir)["remaining"])
+            return super().send(userId, body)
+
+    manage._run_send("example", cfg, PeekingService(), str(logs_dir), clock=manage.VirtualClock())
+    assert _worker_status(logs_dir)["remaining"] == 0
+
+    # Nuovo giro dal checkpoint: duplicato e soppresso restano prima del checkpoint, resta solo Dave.
+    with open(recipients, "a", encoding="utf-8") as f:
+        f.write("dave@example.com,Dave,\n")
+    seen.clear()
+    manage._run_send("example", cfg, PeekingService(), str(logs_dir), clock=manage.VirtualClock())
+    assert seen == [1]
+    assert _worker_status(logs_dir)["remaining"] == 0
+
+
+def test_run_send_stopping_on_a_retry_leaves_no_built_message_behind(tmp_path, monkeypatch, tmp_campaign_dir):
+    monkeypatch.setattr(manage, "ensure_label", lambda *a, **kw: "lbl")
+    monkeypatch.setattr(manage, "add_labels", lambda *a, **kw: None)
+    monkeypatch.setattr(manage.random, "uniform", lambda a, b: 0)
+    data_root = tmp_path / "data"
+    (data_root / "campaigns").mkdir(parents=True)
+    manage.DATA_ROOT = str(data_root)
+    manage.CAMPAIGNS_DIR = os.path.join(manage.DATA_ROOT, "campaigns")
+    shutil.copytree(tmp_campaign_dir, data_root / "campaigns" / "example")
+    with open(data_root / "campaigns" / "example" / "recipients.csv", "a", encoding="utf-8") as f:
+        f.write("carol@example.com,Carol,\n")
+    cfg = {
+        **manage.load_config("example"), "delay_between_emails_seconds": 10, "daily_send_limit": 2,
+        "retry_backoff_initial_seconds": 5,
+    }
+    built, discarded = [], []
+    build = manage._build_message_job
+    monkeypatch.setattr(manage, "_build_message_job", lambda *job: (built.append(job[5]), build(*job))[1])
+    monkeypatch.setattr(manage, "_discard_message", lambda msg: discarded.append(msg))
+
+    class AliceFailsOnce(DummyService):
+        failed = False
+
+        def send(self, userId, body):
+            if not self.failed and b"alice@example.com" in base64.urlsafe_b64decode(body["raw"]):
+                self.failed = True
+                return types.SimpleNamespace(execute=lambda: (_ for _ in ()).throw(_http_error(503)))
+            return super().send(userId, body)
+
+    result = manage._run_send("example", cfg, AliceFailsOnce(), str(data_root / "logs" / "example"),
+                              clock=manage.VirtualClock())
+
+    # Il retry di Alice chiude la quota: Carol non viene nemmeno costruita.
+    assert result["sent"] == 2 and result["limit_reached"]
+    assert built == ["alice@example.com", "bob@example.com"]
+    assert len(discarded) == 2
+
+
+def test_status_combines_worker_files_of_one_campaign(tmp_path, capsys):
+    manage.DATA_ROOT = str(tmp_path / "data")
+    logs_dir = tmp_path / "data" / "logs" / "example"
+    logs_dir.mkdir(parents=True)
+    base = {"campaign": "example", "daily_limit": 100, "daily_remaining": 40, "errors_this_run": 0}
+    workers = {
+        "a": {"state": "running", "updated_at": "2024-01-01T09:00:00Z", "next_send_at": "2024-01-01T09:00:30Z",
+              "sent_this_run": 10, "rate_per_hour": 20.0, "remaining": 50, "counts": {"sent": 30}},
+        "b": {"state": "waiting", "updated_at": "2024-01-01T09:00:10Z", "next_send_at": "2024-01-01T09:00:20Z",
+              "sent_this_run": 5, "rate_per_hour": 10.0, "remaining": 45, "counts": {"sent": 35}},
+        "old": {"state": "finished", "updated_at": "2023-12-31T18:00:00Z", "sent_this_run": 7, "remaining": 0},
+    }
+    for name, fields in workers.items():
+        (logs_dir / f"status.{name}.json").write_text(json.dumps({**base, "worker": name, **fields}))
+
+    [status] = manage.cmd_status(types.SimpleNamespace(campaign="example", all=False, json=True))
+    assert status["state"] == "running" and status["counts"] == {"sent": 35}
+    assert (status["sent_this_run"], status["rate_per_hour"], status["remaining"]) == (15, 30.0, 45)
+    assert status["next_send_at"] == "2024-01-01T09:00:20Z"
+    assert [w["worker"] for w in status["workers"]] == ["old", "a", "b"]
+
+    # Un nuovo worker toglie gli status dei giri conclusi, non quelli dei worker ancora attivi.
+    manage.prune_worker_statuses(str(logs_dir), keep=str(logs_dir / "status.c.json"))
+    assert sorted(p.name for p in logs_dir.iterdir()) == ["status.a.json", "status.b.json"]
@@ -0,0 +1,48 @@
+import json
+
+from app.state_utils import StateTable
+from app.suppression_utils import make_normalizer
+
+
+def test_state_table_round_trips_state_json(tmp_path):
+    path = tmp_path / "state.json"
+    original = {
+        "Alice@Example.com": {"status": "pending", "attempts": 0},
+        "alice@example.com": {
+            "status": "sent", "attempts": 2, "last_attempt": "2024-01-01T08:00:00Z",
+            "last_success_ts": "2024-01-01T08:00:01Z", "message_id": "18c2f0a1b2c3d4e5", "thread_id": "18c2f0a1b2c3d4e5",
+            "tracking_id": "AbC-_123xyz0",
+        },
+        "bob@example.com": {
+            "status": "error", "attempts": 5, "error": "<HttpError 503>", "last_error_ts": "2024-01-01 08:00:00",
+            "message_id": "0abc", "note": {"custom": True},
+        },
+    }
+    path.write_text(json.dumps(original))
+
+    table = StateTable.load(str(path), make_normalizer({}))
+    assert list(table) == ["alice@example.com", "bob@example.com"]
+    assert table["alice@example.com"] == original["alice@example.com"]
+    # Valori fuori formato (timestamp non ISO, id con zero iniziale) restano identici negli extra.
+    assert table["bob@example.com"] == original["bob@example.com"]
+    assert list(table.keys_with_status("sent")) == ["alice@example.com"]
+    assert table.status_counts() == {"sent": 1, "error": 1}
+
+    entry = table["bob@example.com"]
+    entry["status"] = "sending"
+    entry["attempts"] += 1
+    entry.pop("error", None)
+    table["carol@example.com"] = {"status": "pending", "attempts": 0}
+    table.write_json(str(path))
+
+    assert table.status_counts() == {"sent": 1, "sending": 1, "pending": 1}
+    saved = json.loads(path.read_text())
+    assert saved["bob@example.com"]["attempts"] == 6 and "error" not in saved["bob@example.com"]
+    assert saved["alice@example.com"] == original["alice@example.com"]
+    assert path.read_text() == json.dumps(saved, ensure_ascii=False, indent=2)
+
+    other = StateTable()
+    other["alice@example.com"] = {"status": "pending"}
+    other["dave@example.com"] = {"status": "sent", "attempts": 1}
+    table.merge_from(other, skip={"alice@example.com"})
+    assert table["alice@example.com"]["status"] == "sent" and table["dave@example.com"]["attempts"] == 1
@@ -0,0 +1,54 @@
+from app.suppression_utils import normalize_email, load_campaign_suppressions
+
+
+def test_normalize_email_folding_options():
+    assert normalize_email("  Bob@Example.COM ") == "bob@example.com"
+    assert normalize_email("bob+news@example.com") == "bob+news@example.com"
+    assert normalize_email("bob+news@example.com", fold_plus=True) == "bob@example.com"
+    assert normalize_email("Mario.Rossi@googlemail.com", fold_gmail_dots=True) == "mariorossi@gmail.com"
+    assert normalize_email("mario.rossi@example.com", fold_gmail_dots=True) == "mario.rossi@example.com"
+
+
+def test_load_campaign_suppressions_reads_bounces_and_unsubs(tmp_path):
+    (tmp_path / "bounces.csv").write_text("bounced_email\nA@x.com\n", encoding="utf-8")
+    (tmp_path / "unsubs.csv").write_text("ts,email\n2024-01-01,b@x.com \n", encoding="utf-8")
+    assert load_campaign_suppressions(str(tmp_path), normalize_email) == {"a@x.com", "b@x.com"}
+
+
+def test_suppression_index_journal_and_compaction(tmp_path, monkeypatch):
+    import app.suppression_utils as suppression_utils
+
+    root = tmp_path / "suppression"
+    index = suppression_utils.SuppressionIndex(str(root))
+    assert "a@x.com" not in index
+    assert index.add_many(["A@x.com", "b@x.com", "a@x.com "]) == 2
+    assert "a@x.com" in index
+
+    index.compact()
+    assert not (root / "suppressed.journal").exists()
+    assert (root / "suppressed.idx").stat().st_size == 2 * suppression_utils.HASH_SIZE
+
+    monkeypatch.setattr(suppression_utils, "JOURNAL_COMPACT_THRESHOLD", 2)
+    other = suppression_utils.SuppressionIndex(str(root))
+    other.add_many([f"user{i}@y.com" for i in range(5)])
+    index.refresh()
+    assert len(index) == 7
+    for i in range(5):
+        assert f"user{i}@y.com" in index
+    assert "b@x.com" in index and "c@x.com" not in index
+
+
+def test_suppression_index_matches_folded_variants(tmp_path):
+    import app.suppression_utils as suppression_utils
+
+    index = suppression_utils.SuppressionIndex(str(tmp_path / "suppression"))
+    index.add_many(["ab@gmail.com", "Carol.Bianchi+news@Example.com"])
+    assert "a.b+x@gmail.com" in index and "A.B@googlemail.com" in index
+    assert "carol.bianchi@example.com" in index and "carol.bianchi+other@example.com" in index
+    assert "carolbianchi@example.com" not in index
+
+    # Voci scritte prima della forma canonica (hash del solo indirizzo normalizzato).
+    with open(tmp_path / "suppression" / "suppressed.journal", "ab") as f:
+        f.write(suppression_utils._legacy_digest("d.e+tag@gmail.com"))
+    index.refresh()
+    assert "d.e+tag@gmail.com" in index
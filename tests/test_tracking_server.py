@@ -0,0 +1,85 @@
+import asyncio
+import csv
+
+from app.suppression_utils import SuppressionIndex
+from app.tracking_server import TrackingServer, PIXEL_PNG
+
+
+async def _request(port, raw):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(raw)
+    await writer.drain()
+    data = await reader.read()
+    writer.close()
+    return data
+
+
+def test_tracking_server_records_opens_and_unsubs(tmp_path):
+    async def scenario():
+        server = TrackingServer(str(tmp_path), flush_interval=60)
+        srv = await server.start("127.0.0.1", 0)
+        port = srv.sockets[0].getsockname()[1]
+        pixel = await _request(
+            port,
+            b"GET /t?mode=pixel&cid=example&to=alice@example.com HTTP/1.1\r\n"
+            b"User-Agent: test\r\nConnection: close\r\n\r\n",
+        )
+        unsub = await _request(
+            port,
+            b"GET /t?mode=unsubscribe&cid=example&email=bob@example.com HTTP/1.0\r\n\r\n",
+        )
+        await server.stop()
+        return pixel, unsub
+
+    pixel, unsub = asyncio.run(scenario())
+    assert pixel.startswith(b"HTTP/1.1 200") and pixel.endswith(PIXEL_PNG)
+    assert b"Disiscrizione" in unsub
+
+    logs_dir = tmp_path / "logs" / "example"
+    opens = list(csv.DictReader(open(logs_dir / "opens_local.csv", encoding="utf-8")))
+    assert opens[0]["to"] == "alice@example.com"
+    assert opens[0]["ua"] == "test"
+    unsubs = list(csv.DictReader(open(logs_dir / "unsubs.csv", encoding="utf-8")))
+    assert unsubs[0]["email"] == "bob@example.com"
+    assert "bob@example.com" in SuppressionIndex(str(tmp_path / "suppression"))
+
+
+def test_tracking_server_keeps_connection_alive(tmp_path):
+    async def scenario():
+        server = TrackingServer(str(tmp_path), flush_interval=60)
+        srv = await server.start("127.0.0.1", 0)
+        port = srv.sockets[0].getsockname()[1]
+        request = b"GET /t?cid=../evil&to=x@example.com HTTP/1.1\r\n\r\n"
+        raw = await _request(port, request * 3 + request.replace(b"\r\n\r\n", b"\r\nConnection: close\r\n\r\n"))
+        await server.stop()
+        return raw
+
+    raw = asyncio.run(scenario())
+    assert raw.count(b"HTTP/1.1 200 OK") == 4
+    assert not (tmp_path / "logs").exists()
+    rows = list(csv.DictReader(open(tmp_path / "tracking" / "opens_local.csv", encoding="utf-8")))
+    assert len(rows) == 4
+
+
+def test_tracking_server_resolves_signed_unsubscribe_token(tmp_path):
+    from app.tracking_utils import load_tracking_secret, make_token, open_token_index
+
+    secret = load_tracking_secret(str(tmp_path / "tracking"))
+    index = open_token_index(str(tmp_path / "tracking"))
+    index.add("abcdefghijkl", "example", "carol@example.com")
+    index.close()
+    token = make_token(secret, "abcdefghijkl")
+
+    async def scenario():
+        server = TrackingServer(str(tmp_path), flush_interval=60)
+        srv = await server.start("127.0.0.1", 0)
+        port = srv.sockets[0].getsockname()[1]
+        await _request(port, f"GET /t?mode=unsubscribe&cid=example&t={token} HTTP/1.0\r\n\r\n".encode())
+        await _request(port, b"GET /t?mode=pixel&cid=example&t=forgedforgedforgedfo HTTP/1.0\r\n\r\n")
+        await server.stop()
+
+    asyncio.run(scenario())
+    logs_dir = tmp_path / "logs" / "example"
+    unsubs = list(csv.DictReader(open(logs_dir / "unsubs.csv", encoding="utf-8")))
+    assert [u["email"] for u in unsubs] == ["carol@example.com"]
+    assert not (logs_dir / "opens_local.csv").exists()
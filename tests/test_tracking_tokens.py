@@ -0,0 +1,68 @@
+import json
+import os
+import shutil
+import types
+
+import app.manage as manage
+from app.tracking_utils import (
+    make_token, new_tracking_id, open_token_index, resolve_recipients, verify_token,
+)
+from tests.test_send_mock import DummyService
+
+
+def test_token_roundtrip_and_tamper_detection(tmp_path):
+    secret = b"s3cret"
+    tracking_id = new_tracking_id()
+    token = make_token(secret, tracking_id)
+    assert len(token) == 20
+    assert verify_token(secret, token) == tracking_id
+    assert verify_token(b"other", token) is None
+    assert verify_token(secret, token[:-1] + ("A" if token[-1] != "A" else "B")) is None
+
+    index = open_token_index(str(tmp_path))
+    index.add(tracking_id, "example", "alice@example.com")
+    resolved = resolve_recipients([token, "Bob@x.com", "forged-token-value!!"], secret, index)
+    index.close()
+    assert resolved == {token: "alice@example.com", "Bob@x.com": "Bob@x.com"}
+
+
+def test_cmd_send_uses_tokens_instead_of_email(tmp_path, monkeypatch, tmp_campaign_dir):
+    dummy = DummyService()
+    monkeypatch.setattr(manage, "get_service", lambda *_: dummy)
+    monkeypatch.setattr(manage, "ensure_label", lambda *a, **kw: "lbl")
+    monkeypatch.setattr(manage, "add_labels", lambda *a, **kw: None)
+
+    data_root = tmp_path / "data"
+    (data_root / "campaigns").mkdir(parents=True)
+    os.environ["DATA_ROOT"] = str(data_root)
+    os.environ["CREDS_ROOT"] = str(tmp_path / "creds")
+    manage.DATA_ROOT = os.environ["DATA_ROOT"]
+    manage.CREDS_ROOT = os.environ["CREDS_ROOT"]
+    manage.CAMPAIGNS_DIR = os.path.join(manage.DATA_ROOT, "campaigns")
+    shutil.copytree(tmp_campaign_dir, data_root / "campaigns" / "example")
+
+    bodies = {}
+    real_render = manage.render_template
+
+    def spy_render(tpl_path, ctx):
+        bodies[ctx["email"]] = ctx["tracking_pixel_url"]
+        return real_render(tpl_path, ctx)
+
+    monkeypatch.setattr(manage, "render_template", spy_render)
+    manage.cmd_send(types.SimpleNamespace(campaign="example"))
+
+    state = json.load(open(data_root / "logs" / "example" / manage.STATE_FILENAME))
+    pixel = bodies["alice@example.com"]
+    assert "alice" not in pixel and "&t=" in pixel
+    token = pixel.split("&t=", 1)[1]
+    assert token.startswith(state["alice@example.com"]["tracking_id"])
+
+    logs_dir = data_root / "logs" / "example"
+    with open(logs_dir / "opens.csv", "w", encoding="utf-8") as f:
+        f.write(f"ts,cid,to,ua,ip\n2024-01-01,example,{token},,\n")
+    with open(logs_dir / "bounces.csv", "w", encoding="utf-8") as f:
+        f.write("bounced_email,kind\nbob@example.com,soft\n")
+    manage.cmd_stats(types.SimpleNamespace(campaign="example", print=False))
+    stats = open(logs_dir / "stats.csv", encoding="utf-8").read().splitlines()
+    assert "alice@example.com,True,False,False,True" in stats
+    assert "bob@example.com,True,False,False,False" in stats
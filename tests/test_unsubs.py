@@ -0,0 +1,87 @@
+import csv
+import os
+import shutil
+import types
+
+import app.manage as manage
+
+
+class DummySheets:
+    def __init__(self, rows):
+        self.rows = rows
+        self.ranges = []
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, spreadsheetId, range):
+        self.ranges.append(range)
+        start = int(range.split("!A", 1)[1].split(":", 1)[0])
+        return types.SimpleNamespace(execute=lambda: {"values": self.rows[start - 1:]})
+
+
+def _setup(tmp_path, tmp_campaign_dir):
+    data_root = tmp_path / "data"
+    (data_root / "campaigns").mkdir(parents=True)
+    shutil.copytree(tmp_campaign_dir, data_root / "campaigns" / "example")
+    os.environ["DATA_ROOT"] = str(data_root)
+    os.environ["CREDS_ROOT"] = str(tmp_path / "creds")
+    manage.DATA_ROOT = os.environ["DATA_ROOT"]
+    manage.CREDS_ROOT = os.environ["CREDS_ROOT"]
+    manage.CAMPAIGNS_DIR = os.path.join(manage.DATA_ROOT, "campaigns")
+    return data_root
+
+
+def test_fetch_unsubs_reads_only_new_rows(tmp_path, tmp_campaign_dir, monkeypatch):
+    data_root = _setup(tmp_path, tmp_campaign_dir)
+    sheets = DummySheets([["ts", "email"], ["2024-01-01", "bob@example.com"]])
+    monkeypatch.setattr(manage, "get_sheets_service", lambda *_: sheets)
+
+    args = types.SimpleNamespace(campaign="example")
+    manage.cmd_fetch_unsubs(args)
+    sheets.rows.append(["2024-01-02", "Carol@example.com"])
+    manage.cmd_fetch_unsubs(args)
+
+    assert sheets.ranges == ["unsubs!A1:B", "unsubs!A3:B"]
+    out = data_root / "logs" / "example" / "unsubs.csv"
+    rows = list(csv.DictReader(open(out, encoding="utf-8")))
+    assert [r["email"] for r in rows] == ["bob@example.com", "Carol@example.com"]
+
+    index = manage._open_global_suppression()
+    assert "carol@example.com" in index
+    index.close()
+
+
+def test_fetch_unsubs_keeps_unresolved_tokens_and_retries_them(tmp_path, tmp_campaign_dir, monkeypatch, capsys):
+    import json
+
+    from app.tracking_utils import load_tracking_secret, make_token, new_tracking_id, open_token_index
+
+    data_root = _setup(tmp_path, tmp_campaign_dir)
+    secret = load_tracking_secret(manage._tracking_dir())
+    tracking_id = new_tracking_id()
+    token = make_token(secret, tracking_id)
+    # Token emesso su un altro host: l'indice locale non lo conosce ancora.
+    sheets = DummySheets([["ts", "email"], ["2024-01-01", token], ["2024-01-02", "bob@example.com"]])
+    monkeypatch.setattr(manage, "get_sheets_service", lambda *_: sheets)
+    args = types.SimpleNamespace(campaign="example")
+    manage.cmd_fetch_unsubs(args)
+
+    logs_dir = data_root / "logs" / "example"
+    events = [json.loads(l) for l in capsys.readouterr().out.splitlines() if l.startswith("{")]
+    assert [e["data"]["count"] for e in events if e["event"] == "unsubs_unresolved"] == [1]
+    pending = list(csv.DictReader(open(logs_dir / manage.UNSUBS_UNRESOLVED_FILENAME, encoding="utf-8")))
+    assert [(r["token"], r["sheet_row"]) for r in pending] == [(token, "2")]
+
+    index = open_token_index(manage._tracking_dir())
+    index.add(tracking_id, "example", "alice@example.com")
+    index.close()
+    manage.cmd_fetch_unsubs(args)
+
+    rows = list(csv.DictReader(open(logs_dir / "unsubs.csv", encoding="utf-8")))
+    assert [r["email"] for r in rows] == ["bob@example.com", "alice@example.com"]
+    assert list(csv.DictReader(open(logs_dir / manage.UNSUBS_UNRESOLVED_FILENAME, encoding="utf-8"))) == []
+    assert sheets.ranges == ["unsubs!A1:B", "unsubs!A4:B"]